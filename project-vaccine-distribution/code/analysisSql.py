@@ -0,0 +1,150 @@
+'''
+SQL of the Part 3 requirements.
+
+Requirements 1-6 are pushed down to the database here (requirement 7 is in
+symptomFrequency.py, requirement 8 in reserveEstimator.py, requirement 9
+reads the rollup of derivedTables.py and requirement 10 is in
+contactTracing.py).
+
+The pandas versions in databaseAnalysis.py read whole tables (patient,
+diagnosis, vaccine_patient, ...) into data frames and join and aggregate
+them on the client. Here the joins, GROUP BYs and window functions run in
+PostgreSQL and only the final results are fetched, so the amount of data
+sent over the network is proportional to the size of the results.
+The results have the same shape as the ones of the pandas versions
+(databaseAnalysis.compare_requirements checks that).
+'''
+import pandas as pd
+from sqlalchemy import text
+
+import cohorts
+from dbConnection import run_concurrently
+from sqlRunner import run_statements
+
+# Requirement 1
+PATIENT_SYMPTOMS = """
+    CREATE TABLE patient_symptoms AS
+    SELECT patient.ssn, patient.gender, patient.birthday AS date_of_birth,
+        diagnosis.symptom, diagnosis.date AS diagnosis_date
+    FROM patient
+    JOIN diagnosis ON diagnosis.patient = patient.ssn
+"""
+
+# Requirement 2: number of columns of patient_vaccine_info
+MAX_DOSES = """
+    SELECT COALESCE(MAX(doses), 0)
+    FROM (SELECT COUNT(*) AS doses FROM vaccine_patient GROUP BY patient) AS counts
+"""
+
+# Requirement 2, {columns} is filled in by create_patient_vaccine_info
+PATIENT_VACCINE_INFO = """
+    CREATE TABLE patient_vaccine_info AS
+    WITH doses AS (
+        SELECT vp.patient, vp.date, batch.vaccine_type,
+            ROW_NUMBER() OVER (PARTITION BY vp.patient ORDER BY vp.date) AS dose
+        FROM vaccine_patient AS vp
+        JOIN vaccination_event AS ve ON ve.date = vp.date AND ve.hospital = vp.hospital
+        JOIN batch ON batch.id = ve.batch
+    )
+    SELECT patient.ssn, {columns}
+    FROM patient
+    LEFT JOIN doses ON doses.patient = patient.ssn
+    GROUP BY patient.ssn
+"""
+
+# Requirement 3
+TOP_SYMPTOMS = """
+    WITH ranked AS (
+        SELECT patient.gender, diagnosis.symptom,
+            ROW_NUMBER() OVER (PARTITION BY patient.gender
+                               ORDER BY COUNT(*) DESC, diagnosis.symptom) AS rank
+        FROM patient
+        JOIN diagnosis ON diagnosis.patient = patient.ssn
+        GROUP BY patient.gender, diagnosis.symptom
+    )
+    SELECT gender, symptom
+    FROM ranked
+    WHERE rank <= :n
+    ORDER BY gender, rank
+"""
+
+# Requirements 4 and 5: patients with age group (see cohorts.py) and number of doses
+PATIENT_STATUS = """
+    WITH doses AS (
+        SELECT patient, COUNT(*) AS vacc_status
+        FROM vaccine_patient
+        GROUP BY patient
+    )
+    SELECT patient.ssn, patient.name, patient.birthday, patient.gender,
+        {age_group} AS age_group,
+        COALESCE(doses.vacc_status, 0) AS vacc_status
+    FROM patient
+    LEFT JOIN doses ON doses.patient = patient.ssn
+""".format(age_group=cohorts.age_group_sql(cohorts.age_sql('patient.birthday')))
+
+
+def create_patient_symptoms(conn):
+    '''
+    Requirement 1: (re)create the patient_symptoms table in the database.
+    '''
+    run_statements(['DROP TABLE IF EXISTS patient_symptoms', PATIENT_SYMPTOMS], conn)
+
+
+def create_patient_vaccine_info(conn):
+    '''
+    Requirement 2: (re)create the patient_vaccine_info table in the database,
+    with columns date1..dateN and vaccine_type1..vaccine_typeN for the N most
+    doses any patient got (at least two).
+    '''
+    max_doses = max(conn.execute(text(MAX_DOSES)).scalar(), 2)
+    columns = ['MAX(doses.date) FILTER (WHERE doses.dose = %d) AS date%d' % (i, i)
+               for i in range(1, max_doses + 1)]
+    columns += ['MAX(doses.vaccine_type) FILTER (WHERE doses.dose = %d) AS vaccine_type%d' % (i, i)
+                for i in range(1, max_doses + 1)]
+    run_statements(['DROP TABLE IF EXISTS patient_vaccine_info',
+                    PATIENT_VACCINE_INFO.format(columns=', '.join(columns))], conn)
+
+
+def top_symptoms(conn, n=3):
+    '''
+    Requirement 3: the n most common symptoms per gender.
+    '''
+    return pd.read_sql_query(text(TOP_SYMPTOMS), conn, params={'n': n})
+
+
+def patient_vaccination_status(conn, now):
+    '''
+    Requirements 4 and 5: patients with their age group at the date now and
+    their number of doses.
+    '''
+    return pd.read_sql_query(text(PATIENT_STATUS), conn, params={'now': now.date()})
+
+
+def vaccination_status_by_age_group(conn, now):
+    '''
+    Requirement 6: percentage of patients with 0, 1, 2, ... doses per age
+    group, from a single GROUP BY (see cohorts.status_by_age_group). Rows
+    are the vaccination statuses, columns the age groups.
+    '''
+    return cohorts.status_by_age_group(conn, now)
+
+
+def requirements_1_to_6(conn, now):
+    '''
+    Run requirements 1-6 in the database. Requirements 1 and 2 only create
+    their tables; returns a dict of result name -> data frame for the others,
+    with the same keys as databaseAnalysis.requirements_1_to_6. conn is a
+    SQLAlchemy connection; the queries use other connections of its engine.
+    '''
+    create_patient_symptoms(conn)
+    create_patient_vaccine_info(conn)
+
+    # The queries are independent, so they run at the same time over
+    # connections of the pool of conn
+    res = run_concurrently(conn.engine, {
+        'top_symptoms': (top_symptoms,),
+        'vaccination_status': (patient_vaccination_status, now),
+        'status_by_age_group': (vaccination_status_by_age_group, now),
+    })
+    res['age_groups'] = res['vaccination_status'].drop(columns='vacc_status')
+    return res
@@ -0,0 +1,408 @@
+'''
+End-to-end benchmark of loading and querying the vaccine distribution data.
+
+  python benchmark.py run [--database-url URL] --scale 1 --out results.json
+  python benchmark.py run [--database-url URL] --scale 1 --partitioned --out partitioned.json
+  python benchmark.py compare old.json new.json [--show-all]
+
+run (re)creates the schema in the database given by --database-url or
+$VACCINEDIST_DATABASE_URL (see dbConnection.py), fills it with synthetic
+data of the chosen scale (dataGenerator.py) and times
+  - the load of every table (rows and rows/sec),
+  - every Part 3 requirement 1-10 of databaseAnalysis.py, with the tables
+    read by tableReader.read_table as in the analysis, and requirements 1-6
+    computed in the database as well (databaseAnalysis.py --sql),
+  - every statement of sqlQueries.sql,
+  - a few date window queries of the event tables; for these the tables
+    (or partitions) in the plan are recorded as well, so a run with
+    --partitioned (partitioning.py) shows which months were pruned.
+Requirements and queries are run --repeat times cold and warm. A cold run
+uses a new connection (no pooled connection) and starts with DISCARD ALL,
+so no session state or cached plans are reused; the shared buffers and the
+OS page cache of the server can't be flushed from a client, so cold means
+"cold connection" here. A warm run reuses one connection after a first
+unmeasured run. The median and minimum time, the number of result rows and
+the peak RSS of this process are written to a JSON file.
+
+compare reports the steps of the second file that are slower than in the
+first by more than the tolerance, and exits with 1 if there are any. With
+--show-all it prints the speedup of every step as well, e.g. of a
+partitioned run against an unpartitioned one.
+'''
+import argparse
+import json
+import platform
+import resource
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import pandas as pd
+from sqlalchemy import text
+from sqlalchemy.pool import NullPool
+
+import analysisSql
+import databaseAnalysis
+import dbConnection
+from dataGenerator import generate_tables
+from dbConnection import create_pool
+from derivedTables import rebuild_all
+from loadScheduler import DEFAULT_WORKERS, load_tables
+from partitioning import create_schema
+from sqlRunner import read_statements, run_script
+from sqlSchema import read_schema
+from tableReader import read_table
+
+CODE_DIR = Path(__file__).parent
+
+
+def peak_rss_mb():
+    '''
+    Peak resident set size of this process so far in MB.
+    '''
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
+
+
+def _rows(result):
+    if isinstance(result, pd.DataFrame):
+        return len(result)
+    if isinstance(result, (tuple, list)):
+        return sum(_rows(r) for r in result)
+    if isinstance(result, dict):
+        return sum(_rows(r) for r in result.values())
+    return 1
+
+
+def _read(conn, table):
+    return read_table(conn, table)
+
+
+def _requirement_1(conn, now):
+    return databaseAnalysis.patient_symptoms(_read(conn, 'patient'), _read(conn, 'diagnosis'))
+
+
+def _requirement_2(conn, now):
+    return databaseAnalysis.patient_vaccine_info(_read(conn, 'patient'), _read(conn, 'vaccine_patient'),
+                                                 _read(conn, 'vaccination_event'), _read(conn, 'batch'))
+
+
+def _requirement_3(conn, now):
+    return databaseAnalysis.top_symptoms(_requirement_1(conn, now))
+
+
+def _requirement_4(conn, now):
+    return databaseAnalysis.patient_age_groups(_read(conn, 'patient'), now)
+
+
+def _requirement_5(conn, now):
+    return databaseAnalysis.patient_vaccination_status(_requirement_4(conn, now), _read(conn, 'vaccine_patient'))
+
+
+def _requirement_6(conn, now):
+    return databaseAnalysis.vaccination_status_by_age_group(_requirement_5(conn, now))
+
+
+# Every requirement runs on its own, reading the tables it needs
+REQUIREMENTS = {
+    '1': _requirement_1,
+    '2': _requirement_2,
+    '3': _requirement_3,
+    '4': _requirement_4,
+    '5': _requirement_5,
+    '6': _requirement_6,
+    '7': lambda conn, now: databaseAnalysis.symptom_frequencies(conn),
+    '8': lambda conn, now: databaseAnalysis.vaccine_reserve(conn),
+    '9': lambda conn, now: databaseAnalysis.vaccination_progress(conn),
+    '10': lambda conn, now: databaseAnalysis.nurse_contacts(conn),
+}
+
+# Requirements 1-6 as SQL in the database (see analysisSql.py)
+SQL_REQUIREMENTS = {
+    '1 (sql)': lambda conn, now: analysisSql.create_patient_symptoms(conn),
+    '2 (sql)': lambda conn, now: analysisSql.create_patient_vaccine_info(conn),
+    '3 (sql)': lambda conn, now: analysisSql.top_symptoms(conn),
+    '4-5 (sql)': lambda conn, now: analysisSql.patient_vaccination_status(conn, now),
+    '6 (sql)': lambda conn, now: analysisSql.vaccination_status_by_age_group(conn, now),
+}
+
+
+def _query(sql):
+    def run(conn, now):
+        # Statements like CREATE VIEW are rolled back, so every run starts
+        # from the same database
+        try:
+            result = conn.execute(text(sql))
+            return result.fetchall() if result.returns_rows else []
+        finally:
+            conn.rollback()
+    return run
+
+
+# Date windows of the event tables (the generated data covers 2021)
+WINDOW_QUERIES = {
+    'window vaccinations (day)': """
+        SELECT hospital, COUNT(*) FROM vaccine_patient
+        WHERE date = DATE '2021-05-10'
+        GROUP BY hospital""",
+    'window diagnoses (month)': """
+        SELECT symptom, COUNT(*) FROM diagnosis
+        WHERE date >= DATE '2021-05-01' AND date < DATE '2021-06-01'
+        GROUP BY symptom""",
+    'window vaccinations (10 days)': """
+        SELECT ve.hospital, ve.batch, COUNT(*)
+        FROM vaccination_event AS ve
+        JOIN vaccine_patient AS vp ON vp.date = ve.date AND vp.hospital = ve.hospital
+        WHERE ve.date BETWEEN DATE '2021-05-05' AND DATE '2021-05-15'
+        AND vp.date BETWEEN DATE '2021-05-05' AND DATE '2021-05-15'
+        GROUP BY ve.hospital, ve.batch""",
+}
+
+
+def collect_steps():
+    '''
+    Dict of step name -> function(conn, now) for the requirements, the
+    queries of sqlQueries.sql and the date window queries.
+    '''
+    steps = {'requirement %s' % number: function for number, function in REQUIREMENTS.items()}
+    for number, function in SQL_REQUIREMENTS.items():
+        steps['requirement %s' % number] = function
+    for i, sql in enumerate(read_statements(CODE_DIR / 'sqlQueries.sql'), start=1):
+        steps['sqlQueries.sql #%d' % i] = _query(sql.replace(':', r'\:'))
+    for name, sql in WINDOW_QUERIES.items():
+        steps[name] = _query(sql)
+    return steps
+
+
+def _walk(node):
+    yield node
+    for child in node.get('Plans', []):
+        yield from _walk(child)
+
+
+def scanned_relations(conn, sql):
+    '''
+    Names of the tables (partitions) the plan of sql reads, without running
+    it. Partitions removed at planning time don't appear in the plan.
+    '''
+    plan = conn.exec_driver_sql('EXPLAIN (FORMAT JSON) ' + sql).scalar()
+    conn.rollback()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return sorted({node['Relation Name'] for node in _walk(plan[0]['Plan']) if 'Relation Name' in node})
+
+
+def _discard(conn):
+    '''
+    Reset the session of the new connection conn; DISCARD ALL can't run
+    inside a transaction, so it is sent in autocommit mode.
+    '''
+    raw = conn.connection.dbapi_connection
+    raw.autocommit = True
+    try:
+        cursor = raw.cursor()
+        cursor.execute('DISCARD ALL')
+        cursor.close()
+    finally:
+        raw.autocommit = False
+
+
+def _summary(seconds, rows):
+    return {
+        'seconds': seconds,
+        'median': statistics.median(seconds),
+        'min': min(seconds),
+        'rows': rows,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def time_step(function, engine, cold_engine, now, repeat):
+    '''
+    Time function cold (on new connections of cold_engine, see run) and
+    warm (on a pooled connection of engine), repeat times each.
+    Returns {'cold': summary, 'warm': summary}.
+    '''
+    seconds = []
+    for _ in range(repeat):
+        with cold_engine.connect() as conn:
+            _discard(conn)
+            start = time.perf_counter()
+            result = function(conn, now)
+            seconds.append(time.perf_counter() - start)
+    cold = _summary(seconds, _rows(result))
+
+    seconds = []
+    with engine.connect() as conn:
+        function(conn, now)
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = function(conn, now)
+            seconds.append(time.perf_counter() - start)
+    return {'cold': cold, 'warm': _summary(seconds, _rows(result))}
+
+
+def load(engine, scale, seed, workers=DEFAULT_WORKERS, partitioned=False):
+    '''
+    Recreate the schema (with the event tables partitioned by month if
+    partitioned) and load synthetic data of the given scale.
+    Returns a dict of table name -> {rows, seconds, rows_per_sec}.
+    '''
+    with engine.connect() as conn:
+        create_schema(conn, CODE_DIR / 'sqlCreatingDatabase.sql', partitioned=partitioned)
+    frames = generate_tables(scale, seed)
+    schema = read_schema(CODE_DIR / 'sqlCreatingDatabase.sql')
+
+    start = time.perf_counter()
+    stats = load_tables(frames, engine, schema, workers=workers)
+    total = time.perf_counter() - start
+    with engine.connect() as conn:
+        run_script(CODE_DIR / 'sqlIndexes.sql', conn)
+        rebuild_all(conn)
+        # rebuild_all works on the DBAPI connection, outside of SQLAlchemy's transaction
+        conn.connection.commit()
+
+    results = {table: {'rows': rows, 'seconds': seconds, 'rows_per_sec': rows / seconds if seconds else None}
+               for table, (rows, seconds) in stats.items()}
+    rows = sum(r['rows'] for r in results.values())
+    results['total'] = {'rows': rows, 'seconds': total, 'rows_per_sec': rows / total if total else None,
+                        'peak_rss_mb': peak_rss_mb()}
+    return results
+
+
+def run(url=None, scale=1.0, seed=0, repeat=3, workers=DEFAULT_WORKERS, only=None, partitioned=False,
+        statement_timeout_ms=None):
+    '''
+    Run the whole benchmark on the database of url (see
+    dbConnection.database_url) and return the results as a dict. only is
+    an optional list of step names to time.
+    '''
+    engine = create_pool(url, pool_size=workers, statement_timeout_ms=statement_timeout_ms)
+    # Cold runs get a new connection every time
+    cold_engine = create_pool(url, poolclass=NullPool, statement_timeout_ms=statement_timeout_ms)
+    try:
+        with engine.connect() as conn:
+            server = conn.execute(text('SELECT version()')).scalar()
+        results = {
+            'meta': {
+                'scale': scale,
+                'seed': seed,
+                'repeat': repeat,
+                'partitioned': partitioned,
+                'date': pd.Timestamp('now').isoformat(),
+                'python': platform.python_version(),
+                'pandas': pd.__version__,
+                'server': server,
+            },
+            'load': load(engine, scale, seed, workers, partitioned),
+            'steps': {},
+        }
+
+        # Ages are counted at a fixed date, so runs are comparable
+        now = pd.Timestamp('2022-01-01')
+        for name, function in collect_steps().items():
+            if only and name not in only:
+                continue
+            results['steps'][name] = timing = time_step(function, engine, cold_engine, now, repeat)
+            print(f"{name:<22} cold {timing['cold']['median'] * 1000:>10.2f} ms  "
+                  f"warm {timing['warm']['median'] * 1000:>10.2f} ms  rows {timing['warm']['rows']}")
+            if name in WINDOW_QUERIES:
+                with engine.connect() as conn:
+                    timing['relations'] = scanned_relations(conn, WINDOW_QUERIES[name])
+                print(f"{'':<22} reads {', '.join(timing['relations'])}")
+    finally:
+        cold_engine.dispose()
+        engine.dispose()
+    return results
+
+
+def compare(old, new, tolerance=0.2, min_seconds=0.005):
+    '''
+    Regressions of the results new against old: steps whose median time grew
+    by more than tolerance (and at least min_seconds), and tables whose load
+    rate dropped by more than tolerance.
+    Returns a list of (name, description) pairs.
+    '''
+    problems = []
+    for table, stats in new['load'].items():
+        base = old['load'].get(table)
+        if base and base['rows_per_sec'] and stats['rows_per_sec'] \
+                and stats['rows_per_sec'] < base['rows_per_sec'] / (1 + tolerance):
+            problems.append(('load ' + table, f"{base['rows_per_sec']:.0f} -> {stats['rows_per_sec']:.0f} rows/s"))
+
+    for name, timing in new['steps'].items():
+        for mode in ['cold', 'warm']:
+            base = old['steps'].get(name, {}).get(mode)
+            if base is None:
+                continue
+            before, after = base['median'], timing[mode]['median']
+            if after > before * (1 + tolerance) and after - before >= min_seconds:
+                problems.append((f'{name} ({mode})', f'{before * 1000:.2f} ms -> {after * 1000:.2f} ms'))
+    if old['meta'].get('scale') != new['meta'].get('scale'):
+        problems.append(('meta', f"scale {old['meta'].get('scale')} != {new['meta'].get('scale')}"))
+    return problems
+
+
+def speedups(old, new):
+    '''
+    List of (step name, old median, new median) of the warm runs of the
+    steps in both results.
+    '''
+    return [(name, old['steps'][name]['warm']['median'], timing['warm']['median'])
+            for name, timing in new['steps'].items() if name in old['steps']]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark loading and the Part 3 queries.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='run the benchmark')
+    run_parser.add_argument('--scale', type=float, default=1.0, help='scale of the synthetic data (default: %(default)s)')
+    run_parser.add_argument('--seed', type=int, default=0, help='random seed of the data (default: %(default)s)')
+    run_parser.add_argument('--repeat', type=int, default=3, help='runs per step and mode (default: %(default)s)')
+    run_parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                            help='tables loaded in parallel (default: %(default)s)')
+    run_parser.add_argument('--only', action='append', help='only time this step (can be repeated)')
+    run_parser.add_argument('--partitioned', action='store_true',
+                            help='partition the event tables by month (see partitioning.py)')
+    run_parser.add_argument('--out', default='benchmark.json', help='results file (default: %(default)s)')
+    # The tables of the database are replaced
+    dbConnection.add_arguments(run_parser)
+
+    compare_parser = commands.add_parser('compare', help='compare two results files')
+    compare_parser.add_argument('old')
+    compare_parser.add_argument('new')
+    compare_parser.add_argument('--tolerance', type=float, default=0.2,
+                                help='allowed relative slowdown (default: %(default)s)')
+    compare_parser.add_argument('--min-ms', type=float, default=5.0,
+                                help='ignore slowdowns smaller than this (default: %(default)s)')
+    compare_parser.add_argument('--show-all', action='store_true', help='print the speedup of every step')
+    args = parser.parse_args(argv)
+
+    if args.command == 'run':
+        results = run(args.database_url, args.scale, args.seed, args.repeat, args.workers, args.only,
+                      args.partitioned, args.statement_timeout)
+        with open(args.out, 'w') as file:
+            json.dump(results, file, indent=2)
+        print(f'Results written to {args.out}')
+        return 0
+
+    with open(args.old) as file:
+        old = json.load(file)
+    with open(args.new) as file:
+        new = json.load(file)
+    if args.show_all:
+        for name, before, after in speedups(old, new):
+            print(f'{name:<30} {before * 1000:>10.2f} ms -> {after * 1000:>10.2f} ms  x{before / after:.2f}')
+    problems = compare(old, new, args.tolerance, args.min_ms / 1000)
+    for name, problem in problems:
+        print(f'REGRESSION {name}: {problem}')
+    if not problems:
+        print('No regressions')
+    return 1 if problems else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
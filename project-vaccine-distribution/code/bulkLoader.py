@@ -0,0 +1,103 @@
+'''
+Bulk loading of pandas data frames into PostgreSQL.
+
+DataFrame.to_sql sends the rows as (multi-row) INSERT statements, which gets
+slow once the bigger sheets grow to millions of rows. Here the frame is
+written as CSV into an in-memory buffer, chunk by chunk, and streamed to the
+server with COPY ... FROM STDIN (psycopg2 copy_expert). If the driver does not
+support COPY, or the INSERT path is asked for explicitly, we fall back to
+DataFrame.to_sql.
+'''
+import io
+
+# Number of data frame rows written into one COPY buffer.
+DEFAULT_CHUNK_SIZE = 50000
+
+# Marker for missing values inside the CSV stream, so that empty strings
+# and NULLs stay distinguishable.
+COPY_NULL = '\\N'
+
+
+class CopyUnsupported(Exception):
+    '''
+    The connection given to copy_dataframe can't run COPY (its DBAPI cursor
+    has no copy_expert).
+    '''
+
+
+def quote_ident(name):
+    '''
+    Quote a (possibly schema qualified) table or column name for PostgreSQL.
+    '''
+    return '.'.join('"%s"' % part.replace('"', '""') for part in name.split('.'))
+
+
+def _copy_cursor(conn):
+    '''
+    Return a DBAPI cursor that supports copy_expert, or None if the
+    connection (SQLAlchemy or raw psycopg2 connection) cannot do COPY.
+    '''
+    raw = getattr(conn, 'connection', conn)
+    if not hasattr(raw, 'cursor'):
+        return None
+    cursor = raw.cursor()
+    if not hasattr(cursor, 'copy_expert'):
+        cursor.close()
+        return None
+    return cursor
+
+
+def supports_copy(conn):
+    '''
+    Whether copy_dataframe can use the connection conn.
+    '''
+    cursor = _copy_cursor(conn)
+    if cursor is None:
+        return False
+    cursor.close()
+    return True
+
+
+def copy_dataframe(df, table, conn, chunk_size=DEFAULT_CHUNK_SIZE):
+    '''
+    Stream the rows of df into table with COPY ... FROM STDIN.
+    Column names of df must match the columns of the table.
+    Returns the number of rows copied; raises CopyUnsupported if conn
+    can't run COPY (see supports_copy).
+    '''
+    cursor = _copy_cursor(conn)
+    if cursor is None:
+        raise CopyUnsupported('Connection does not support COPY')
+
+    columns = ', '.join(quote_ident(str(c)) for c in df.columns)
+    copy_sql = "COPY %s (%s) FROM STDIN WITH (FORMAT csv, NULL '%s', ENCODING 'UTF8')" % (
+        quote_ident(table), columns, COPY_NULL)
+
+    try:
+        for start in range(0, len(df), chunk_size):
+            text = df.iloc[start:start + chunk_size].to_csv(
+                index=False, header=False, na_rep=COPY_NULL)
+            # Sent as UTF-8 bytes whatever the client encoding is
+            cursor.copy_expert(copy_sql, io.BytesIO(text.encode('utf-8')))
+    finally:
+        cursor.close()
+    return len(df)
+
+
+def load_dataframe(df, table, conn, method='copy', chunk_size=DEFAULT_CHUNK_SIZE):
+    '''
+    Append the rows of df to table.
+
+    method='copy' uses COPY ... FROM STDIN and falls back to INSERTs when the
+    connection does not support COPY; method='insert' always uses
+    DataFrame.to_sql. Returns the number of rows loaded.
+    '''
+    if method == 'copy':
+        if supports_copy(conn):
+            return copy_dataframe(df, table, conn, chunk_size=chunk_size)
+        print(f'COPY not supported by the connection, inserting rows into {table} instead')
+    elif method != 'insert':
+        raise ValueError(f'Unknown load method: {method}')
+
+    df.to_sql(table, con=conn, if_exists='append', index=False)
+    return len(df)
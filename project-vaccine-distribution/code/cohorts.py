@@ -0,0 +1,170 @@
+'''
+Age groups and vaccination statuses of the patients (Part 3 requirements
+4-6).
+
+The patients are binned by their age in full years at a fixed reference
+date over the edges of AGE_EDGES (or any other sorted list of edges): a
+patient with edges[i] <= age < edges[i + 1] is in group i, the last group
+is open ended. Ages are computed from the dates as integers (yyyymmdd) and
+binned with np.searchsorted, and the age group x number of doses
+distribution is counted with a single np.bincount, so everything is linear
+in the number of patients and works for any number of doses.
+
+The same bins are used in SQL with WIDTH_BUCKET (age_group_sql), where the
+distribution is a single GROUP BY (STATUS_COUNTS). Both give their counts
+to status_table, so the pandas and SQL versions have the same shape.
+'''
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+# Lower edges of the age groups of requirement 4: 0-9, 10-19, 20-39, 40-59, 60+
+AGE_EDGES = [0, 10, 20, 40, 60]
+# Requirement 6 always shows at least the statuses 0, 1 and 2 doses
+MIN_DOSES = 2
+
+# Requirement 6 in one pass: patients per age group and number of doses,
+# {age_group} is filled in by status_counts_sql
+STATUS_COUNTS = """
+    WITH doses AS (
+        SELECT patient, COUNT(*) AS vacc_status
+        FROM vaccine_patient
+        GROUP BY patient
+    )
+    SELECT {age_group} AS age_group, COALESCE(doses.vacc_status, 0) AS vacc_status, COUNT(*) AS patients
+    FROM patient
+    LEFT JOIN doses ON doses.patient = patient.ssn
+    GROUP BY 1, 2
+"""
+
+
+def age_labels(edges=AGE_EDGES):
+    '''
+    Names of the age groups of edges, e.g. ['0-9', ..., '60+'].
+    '''
+    labels = ['%d-%d' % (low, high - 1) for low, high in zip(edges, edges[1:])]
+    return labels + ['%d+' % edges[-1]]
+
+
+AGE_GROUPS = age_labels()
+
+
+def _yyyymmdd(dates):
+    return dates.year * 10000 + dates.month * 100 + dates.day
+
+
+def ages_at(birthdays, reference):
+    '''
+    Age in full years at the date reference of every date in birthdays (one
+    less if the birthday hasn't come yet that year), NaN for missing dates.
+    '''
+    birthdays = pd.DatetimeIndex(pd.to_datetime(birthdays))
+    reference = pd.Timestamp(reference)
+    ages = (_yyyymmdd(reference) - _yyyymmdd(birthdays)) // 10000
+    return np.asarray(ages, dtype=float)
+
+
+def age_group_codes(ages, edges=AGE_EDGES):
+    '''
+    Index of the age group of every age in edges, -1 for ages below the
+    first edge and missing ages.
+    '''
+    ages = np.asarray(ages, dtype=float)
+    codes = np.searchsorted(edges, ages, side='right') - 1
+    codes[np.isnan(ages)] = -1
+    return codes
+
+
+def age_groups(ages, edges=AGE_EDGES):
+    '''
+    Name of the age group of every age (None outside the groups).
+    '''
+    names = np.array(age_labels(edges) + [None], dtype=object)
+    return names[age_group_codes(ages, edges)]
+
+
+def dose_counts(patients, vaccinated):
+    '''
+    Number of doses of every patient in patients, counted from the patient
+    column of the vaccinations vaccinated.
+    '''
+    counts = pd.Series(vaccinated).value_counts()
+    return pd.Series(patients).map(counts).fillna(0).astype('int64').to_numpy()
+
+
+def status_table(counts, edges=AGE_EDGES):
+    '''
+    Requirement 6 from counts, an array of patients per age group (rows)
+    and number of doses (columns): the percentage of every number of doses
+    in every age group, with the statuses ('0-vacc', '1-vacc', ...) as rows
+    and the age groups that have patients as columns.
+    '''
+    totals = counts.sum(axis=1)
+    groups = np.flatnonzero(totals)
+    percentages = 100.0 * counts[groups] / totals[groups, None]
+    columns = pd.Index(np.array(age_labels(edges), dtype=object)[groups], name='vacc_status')
+    index = ['%d-vacc' % doses for doses in range(counts.shape[1])]
+    return pd.DataFrame(percentages.T, index=index, columns=columns)
+
+
+def status_distribution(groups, doses, edges=AGE_EDGES):
+    '''
+    Requirement 6 for patients in the age groups groups (names, see
+    age_groups) with the numbers of doses doses, counted in one pass.
+    '''
+    codes = pd.Categorical(groups, categories=age_labels(edges)).codes.astype(np.int64)
+    doses = np.asarray(doses, dtype=np.int64)
+    statuses = max(int(doses.max()) if len(doses) else 0, MIN_DOSES) + 1
+    grouped = codes >= 0
+    counts = np.bincount(codes[grouped] * statuses + doses[grouped], minlength=len(edges) * statuses)
+    return status_table(counts.reshape(len(edges), statuses), edges)
+
+
+def age_group_sql(age, edges=AGE_EDGES, names=True):
+    '''
+    SQL expression of the age group of the age (in years) expression age:
+    its name, or its index in edges with names=False. NULL below the first
+    edge (and for NULL ages).
+    '''
+    bucket = 'WIDTH_BUCKET(%s, ARRAY[%s]::DOUBLE PRECISION[])' % (age, ', '.join(str(edge) for edge in edges))
+    # Bucket 0 is below the first edge (e.g. born after the reference date)
+    if not names:
+        return '(NULLIF(%s, 0) - 1)' % bucket
+    # Arrays are indexed from 1, so bucket 0 is NULL here as well
+    return '(ARRAY[%s])[%s]' % (', '.join("'%s'" % name for name in age_labels(edges)), bucket)
+
+
+def age_sql(birthday, now=':now'):
+    '''
+    SQL expression of the age in full years at now of the date expression
+    birthday, computed like ages_at (negative for birthdays after now,
+    where AGE() would give 0).
+    '''
+    return "FLOOR((TO_CHAR(CAST(%s AS DATE), 'YYYYMMDD')::INT - TO_CHAR(%s, 'YYYYMMDD')::INT) / 10000.0)" % (
+        now, birthday)
+
+
+def status_counts_sql(edges=AGE_EDGES):
+    return STATUS_COUNTS.format(age_group=age_group_sql(age_sql('patient.birthday'), edges, names=False))
+
+
+def status_by_age_group(conn, now, edges=AGE_EDGES):
+    '''
+    Requirement 6 counted in the database at the date now, see status_table.
+    '''
+    df = pd.read_sql_query(text(status_counts_sql(edges)), conn, params={'now': now.date()})
+    return status_from_counts(df, edges)
+
+
+def status_from_counts(df, edges=AGE_EDGES):
+    '''
+    Requirement 6 from the rows of STATUS_COUNTS (age_group index, vacc_status,
+    patients), see status_table. Rows without an age group are left out.
+    '''
+    df = df[df['age_group'].notna()]
+    codes = df['age_group'].to_numpy(dtype=np.int64)
+    doses = df['vacc_status'].to_numpy(dtype=np.int64)
+    statuses = max(int(doses.max()) if len(doses) else 0, MIN_DOSES) + 1
+    counts = np.zeros((len(edges), statuses), dtype=np.int64)
+    counts[codes, doses] = df['patients'].to_numpy(dtype=np.int64)
+    return status_table(counts, edges)
@@ -0,0 +1,170 @@
+'''
+Contact tracing for staff members, a generalization of Part 3 requirement 10.
+
+For a list of workers and a date window, one query finds for every worker
+the vaccination events they worked at (events at their hospital on a weekday
+of their shift) and everybody they may have met there: the vaccinated
+patients and the other staff members on the same shift.
+
+All workers are traced with a single set-based query: the workers are
+passed as an array, the weekday names are mapped to ISO day numbers by a
+small VALUES table that is joined once (instead of a CASE per joined row)
+and the joins use the indexes of sqlIndexes.sql
+(vaccination_event(hospital, date), vaccine_patient(date, hospital),
+vaccination_shift(hospital, weekday)). Tracing hundreds of staff members
+is one round trip. The window is compared with the date columns directly,
+so partitioned event tables (partitioning.py) only read its months.
+
+pandas is only imported for the data frames of trace_contacts; the command
+line (also run by vaccinedist.py trace) prints the rows of contact_rows, so
+a lookup starts quickly.
+
+  python contactTracing.py [--database-url URL] --worker 19740919-7140 --start 2021-05-05 --end 2021-05-15
+'''
+import argparse
+import csv
+import datetime
+
+import dbConnection
+from sqlRunner import format_rows
+
+CONTACTS = """
+    WITH weekdays (weekday, isodow) AS (
+        VALUES ('Monday', 1), ('Tuesday', 2), ('Wednesday', 3), ('Thursday', 4),
+               ('Friday', 5), ('Saturday', 6), ('Sunday', 7)
+    ),
+    worker_events AS (
+        -- Events every worker participated in: their hospital, a weekday of their shift
+        SELECT vs.worker, ve.hospital, ve.date, vs.weekday
+        FROM unnest(%(workers)s::text[]) AS w (worker)
+        JOIN vaccination_shift AS vs ON vs.worker = w.worker
+        JOIN weekdays ON weekdays.weekday = vs.weekday
+        JOIN vaccination_event AS ve ON ve.hospital = vs.hospital
+            AND ve.date BETWEEN %(start)s AND %(end)s
+            AND EXTRACT(isodow FROM ve.date) = weekdays.isodow
+    )
+
+    -- Patients vaccinated at these events
+    SELECT we.worker, 'patient' AS kind, patient.ssn, patient.name,
+        MIN(we.date) AS first_contact, MAX(we.date) AS last_contact
+    FROM worker_events AS we
+    JOIN vaccine_patient AS vp ON vp.date = we.date AND vp.hospital = we.hospital
+        -- Implied by the join, but lets a partitioned vaccine_patient skip the other months
+        AND vp.date BETWEEN %(start)s AND %(end)s
+    JOIN patient ON patient.ssn = vp.patient
+    GROUP BY we.worker, patient.ssn, patient.name
+
+    UNION ALL
+
+    -- Other staff members working the same shifts
+    SELECT we.worker, 'staff' AS kind, staff.ssn, staff.name,
+        MIN(we.date) AS first_contact, MAX(we.date) AS last_contact
+    FROM worker_events AS we
+    JOIN vaccination_shift AS vs ON vs.hospital = we.hospital AND vs.weekday = we.weekday
+        AND vs.worker <> we.worker
+    JOIN staff ON staff.ssn = vs.worker
+    GROUP BY we.worker, staff.ssn, staff.name
+
+    ORDER BY worker, kind, ssn
+"""
+
+COLUMNS = ['worker', 'kind', 'ssn', 'name', 'first_contact', 'last_contact']
+
+# The nurse and window of Part 3 requirement 10
+REQUIREMENT_10 = {'workers': ['19740919-7140'], 'start': '2021-05-05', 'end': '2021-05-15'}
+
+
+def _date(value):
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    return datetime.date.fromisoformat(str(value)[:10])
+
+
+def query_params(workers, start, end):
+    '''
+    Parameters of CONTACTS. start and end are dates, timestamps or ISO date
+    strings; both are included in the window.
+    '''
+    return {'workers': list(workers), 'start': _date(start), 'end': _date(end)}
+
+
+def window(end=None, start=None, days=10):
+    '''
+    (start, end) of a window of days days ending at end (default: today),
+    unless start is given.
+    '''
+    end = _date(end) if end is not None else datetime.date.today()
+    return (_date(start) if start is not None else end - datetime.timedelta(days=days)), end
+
+
+def contact_rows(conn, workers, start, end):
+    '''
+    Rows (tuples of COLUMNS) of the contacts of workers between start and
+    end, see trace_contacts.
+    '''
+    cursor = getattr(conn, 'connection', conn).cursor()
+    try:
+        cursor.execute(CONTACTS, query_params(workers, start, end))
+        return cursor.fetchall()
+    finally:
+        cursor.close()
+
+
+def trace_contacts(conn, workers, start, end):
+    '''
+    Patients and staff members each of workers may have met at vaccination
+    events between start and end (inclusive). conn is a SQLAlchemy or
+    psycopg2 connection.
+    Returns a data frame with the columns worker, kind ('patient' or
+    'staff'), ssn, name, first_contact and last_contact.
+    '''
+    import pandas as pd
+
+    return pd.DataFrame(contact_rows(conn, workers, start, end), columns=COLUMNS)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Find the patients and staff members workers may have met.')
+    parser.add_argument('--worker', action='append', default=[], help='SSN of a worker (can be repeated)')
+    parser.add_argument('--workers-file', help='file with one worker SSN per line')
+    parser.add_argument('--end', help='last day of the window (default: today)')
+    parser.add_argument('--start', help='first day of the window (default: --days before --end)')
+    parser.add_argument('--days', type=int, default=10, help='length of the window in days (default: %(default)s)')
+    parser.add_argument('--out', help='write the contacts to this CSV file instead of printing them')
+    dbConnection.add_arguments(parser)
+    args = parser.parse_args(argv)
+
+    workers = list(args.worker)
+    if args.workers_file:
+        with open(args.workers_file) as file:
+            workers += [line.strip() for line in file if line.strip()]
+    if not workers:
+        parser.error('give at least one --worker or --workers-file')
+    start, end = window(args.end, args.start, args.days)
+
+    conn = dbConnection.connect(args.database_url, args.statement_timeout)
+    try:
+        rows = contact_rows(conn, workers, start, end)
+    finally:
+        conn.close()
+
+    if args.out:
+        with open(args.out, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(COLUMNS)
+            writer.writerows(rows)
+    else:
+        print(format_rows(COLUMNS, rows))
+    counts = {}
+    for row in rows:
+        counts[row[0], row[1]] = counts.get((row[0], row[1]), 0) + 1
+    print(f'\n{len(workers)} workers traced from {start} to {end}')
+    print(format_rows(['worker', 'patient', 'staff'],
+                      [(worker, counts.get((worker, 'patient'), 0), counts.get((worker, 'staff'), 0))
+                       for worker in workers]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,350 @@
+'''
+Synthetic data for the vaccine distribution schema at any scale.
+
+The workbook in data/ only has a few hundred rows, which is too small to see
+how the loader and the analysis behave on real amounts of data. This module
+generates referentially consistent data for all twelve tables of
+sqlCreatingDatabase.sql:
+  - hospitals with staff working shifts on some weekdays,
+  - vaccination events on the weekdays a hospital has shifts, each using a
+    batch stored at that hospital and produced before (and expiring after)
+    the event,
+  - a transport chain for every batch ending at its hospital (a few batches
+    end up at the wrong hospital, as in the real data),
+  - patients with 0-3 doses at least three weeks apart,
+  - diagnoses a few days after a vaccination.
+The scale factor multiplies the number of patients (10 000 per unit); the
+other tables grow along. With the same seed and scale the output is always
+the same. The big tables (patient, vaccine_patient, diagnosis) are produced
+in chunks, so the data can be streamed to CSV/Parquet files or straight into
+the database with COPY without holding everything in memory.
+'''
+import argparse
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import dbConnection
+
+PATIENTS_PER_SCALE = 10000
+START_DATE = pd.Timestamp('2021-01-04')
+DAYS = 364
+WEEKDAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+VACCINE_TYPES = pd.DataFrame({
+    'id': ['V01', 'V02', 'V03', 'V04'],
+    'name': ['AstraZeneca', 'Moderna', 'Comirnaty', 'Janssen'],
+    'doses': [2, 2, 2, 1],
+    'temp_min': [2, -25, -90, 2],
+    'temp_max': [8, -15, -60, 8],
+})
+
+SYMPTOMS = pd.DataFrame({
+    'name': ['headache', 'diarrhea', 'joint pain', 'muscle ache', 'nausea', 'fatigue', 'chills', 'fever',
+             'high fever', 'inflammation near injection', 'itchiness near injection', 'warmth near injection',
+             'pain near injection', 'feelings of illness', 'lymfadenopathy', 'vomiting', 'anaphylaxia',
+             'shortness of breath', 'chest pain', 'leg swelling', 'prologned abdominal pain',
+             'sereve or prolonged headache', 'blurring of vision', 'hematomas',
+             'bluemarks or petechias (not near injection)'],
+    'critical': [False] * 16 + [True] * 9,
+})
+
+# Probabilities of a patient getting 0, 1, 2 or 3 doses
+DOSE_COUNTS = [0.25, 0.25, 0.45, 0.05]
+
+
+def _phones(rng, n, prefix):
+    digits = rng.integers(0, 10_000_000, n)
+    return pd.Series(digits).map(lambda d: '%s-%03d-%04d' % (prefix, d // 10000, d % 10000))
+
+
+def _ssn(birthdays, serial, long_format):
+    '''
+    Social security numbers like the ones in the workbook: the birthday and
+    a serial number that keeps them unique.
+    '''
+    fmt = '%Y%m%d' if long_format else '%y%m%d'
+    return pd.Series(birthdays).dt.strftime(fmt).to_numpy() + pd.Series(serial).map('-%06d'.__mod__).to_numpy()
+
+
+def _birthdays(rng, n, min_age, max_age):
+    days = rng.integers(min_age * 365, max_age * 365, n)
+    return START_DATE - pd.to_timedelta(days, unit='D')
+
+
+def generate_dimensions(scale, rng):
+    '''
+    Every table except patient, vaccine_patient and diagnosis.
+    Returns a dict of table name -> data frame.
+    '''
+    tables = {'vaccine_type': VACCINE_TYPES.copy()}
+
+    types = VACCINE_TYPES['id'].to_numpy()
+    n_manuf = 2 * len(types)
+    tables['manufacturer'] = pd.DataFrame({
+        'id': ['M%d' % (i + 1) for i in range(n_manuf)],
+        'origin': rng.choice(['India', 'Germany', 'USA', 'Belgium', 'Sweden'], n_manuf),
+        'phone': _phones(rng, n_manuf, '+1'),
+        'vaccine_type': np.repeat(types, 2),
+    })
+
+    n_hosp = max(2, int(round(10 * scale ** 0.5)))
+    hospitals = np.array(['Hospital %d' % (i + 1) for i in range(n_hosp)], dtype=object)
+    tables['hospital'] = pd.DataFrame({
+        'name': hospitals,
+        'address': ['Street %d 00%03d HELSINKI' % (i + 1, i % 1000) for i in range(n_hosp)],
+        'phone': _phones(rng, n_hosp, '09'),
+    })
+
+    # Staff: 6-10 people per hospital, each working 2-3 of its open weekdays
+    per_hosp = rng.integers(6, 11, n_hosp)
+    staff_hosp = np.repeat(np.arange(n_hosp), per_hosp)
+    n_staff = len(staff_hosp)
+    birthdays = _birthdays(rng, n_staff, 22, 65)
+    tables['staff'] = pd.DataFrame({
+        'ssn': _ssn(birthdays, np.arange(n_staff), long_format=True),
+        'name': ['Staff %d' % (i + 1) for i in range(n_staff)],
+        'birthday': birthdays,
+        'phone': _phones(rng, n_staff, '040'),
+        'role': np.where(rng.random(n_staff) < 0.25, 'doctor', 'nurse'),
+        'vacc_status': rng.random(n_staff) < 0.9,
+        'hospital': hospitals[staff_hosp],
+    })
+
+    open_days = rng.random((n_hosp, 7)) < 0.5
+    open_days[np.arange(n_hosp), rng.integers(0, 7, n_hosp)] = True
+    shifts = []
+    for h in range(n_hosp):
+        days = np.flatnonzero(open_days[h])
+        workers = tables['staff']['ssn'].to_numpy()[staff_hosp == h]
+        for i, worker in enumerate(workers):
+            count = min(len(days), rng.integers(2, 4))
+            chosen = rng.choice(days, count, replace=False)
+            # Every open day has at least one worker
+            chosen = np.union1d(chosen, days[i::len(workers)])
+            shifts.extend((hospitals[h], WEEKDAYS[d], worker) for d in chosen)
+    tables['vaccination_shift'] = pd.DataFrame(shifts, columns=['hospital', 'weekday', 'worker'])
+
+    # Events on 80 % of the open weekdays of every hospital
+    dates = START_DATE + pd.to_timedelta(np.arange(DAYS), unit='D')
+    hosp_idx, day_idx = np.nonzero(open_days[:, dates.dayofweek] & (rng.random((n_hosp, DAYS)) < 0.8))
+    order = np.argsort(day_idx, kind='stable')
+    hosp_idx, day_idx = hosp_idx[order], day_idx[order]
+    n_events = len(hosp_idx)
+    event_dates = dates[day_idx]
+
+    # One batch per event, stored at the hospital of the event
+    batch_ids = np.array(['B%06d' % (i + 1) for i in range(n_events)], dtype=object)
+    batch_types = rng.integers(0, len(types), n_events)
+    expected_patients = PATIENTS_PER_SCALE * scale * np.dot(DOSE_COUNTS, range(4)) / n_events
+    prod_dates = event_dates - pd.to_timedelta(rng.integers(30, 121, n_events), unit='D')
+    tables['batch'] = pd.DataFrame({
+        'id': batch_ids,
+        'num_of_vacc': np.maximum(1, np.ceil(expected_patients * rng.uniform(1.0, 1.5, n_events))).astype(int),
+        'vaccine_type': types[batch_types],
+        'manufacturer': np.array(tables['manufacturer']['id'])[2 * batch_types + rng.integers(0, 2, n_events)],
+        'prod_date': prod_dates,
+        'exp_date': prod_dates + pd.Timedelta(days=180),
+        'hospital': hospitals[hosp_idx],
+    })
+
+    tables['transport_log'] = _transport_log(rng, batch_ids, hosp_idx, event_dates, hospitals)
+
+    tables['vaccination_event'] = pd.DataFrame({
+        'date': event_dates,
+        'hospital': hospitals[hosp_idx],
+        'batch': batch_ids,
+    })
+    tables['symptoms'] = SYMPTOMS.copy()
+    return tables
+
+
+def _transport_log(rng, batch_ids, hosp_idx, event_dates, hospitals):
+    '''
+    1-3 transports per batch, each leaving from where the previous one
+    arrived. The last one arrives a few days before the event, at the
+    hospital of the batch for 98 % of the batches.
+    '''
+    n_hosp = len(hospitals)
+    legs = rng.integers(1, 4, len(batch_ids))
+    batch = np.repeat(np.arange(len(batch_ids)), legs)
+    # Position of the leg counted from the last one (0 = last)
+    from_last = np.concatenate([np.arange(n)[::-1] for n in legs])
+
+    arrival = rng.integers(0, n_hosp, len(batch))
+    last = from_last == 0
+    misplaced = rng.random(len(batch)) < 0.02
+    arrival[last & ~misplaced] = hosp_idx[batch[last & ~misplaced]]
+    departure = np.empty_like(arrival)
+    first = np.r_[True, batch[1:] != batch[:-1]]
+    departure[~first] = arrival[np.flatnonzero(~first) - 1]
+    departure[first] = rng.integers(0, n_hosp, first.sum())
+
+    arr_date = event_dates[batch] - pd.to_timedelta(3 * from_last + rng.integers(1, 3, len(batch)), unit='D')
+    log = pd.DataFrame({
+        'batch': batch_ids[batch],
+        'dep_hos': hospitals[departure],
+        'arr_hos': hospitals[arrival],
+        'dep_date': arr_date - pd.Timedelta(days=1),
+        'arr_date': arr_date,
+    })
+    return log[log['dep_hos'] != log['arr_hos']].reset_index(drop=True)
+
+
+def generate_patients(scale, rng, events, chunk_rows, start=0):
+    '''
+    Yield (table name, data frame) chunks of patient, vaccine_patient and
+    diagnosis for at most chunk_rows patients at a time. events is the
+    vaccination_event frame.
+    '''
+    events = events.sort_values('date', kind='stable').reset_index(drop=True)
+    event_days = ((events['date'] - START_DATE).dt.days).to_numpy()
+    n_events = len(events)
+    total = int(round(PATIENTS_PER_SCALE * scale))
+
+    for offset in range(start, total, chunk_rows):
+        n = min(chunk_rows, total - offset)
+        birthdays = _birthdays(rng, n, 0, 95)
+        ssn = _ssn(birthdays, np.arange(offset, offset + n), long_format=False)
+        yield 'patient', pd.DataFrame({
+            'ssn': ssn,
+            'name': ['Patient %d' % (i + 1) for i in range(offset, offset + n)],
+            'birthday': birthdays,
+            'gender': rng.choice(['M', 'F'], n),
+        })
+
+        # Doses: the first one at a random event, the next ones at an event
+        # at least 21 days after the previous dose
+        doses = rng.choice(len(DOSE_COUNTS), n, p=DOSE_COUNTS)
+        patient_idx, event_idx = [], []
+        current = rng.integers(0, n_events, n)
+        active = doses > 0
+        for dose in range(1, len(DOSE_COUNTS)):
+            patient_idx.append(np.flatnonzero(active))
+            event_idx.append(current[active])
+            target = event_days[current] + 21 + rng.integers(0, 30, n)
+            current = np.searchsorted(event_days, target) + rng.integers(0, 5, n)
+            active &= (doses > dose) & (current < n_events)
+            current = np.minimum(current, n_events - 1)
+        patient_idx = np.concatenate(patient_idx)
+        event_idx = np.concatenate(event_idx)
+        vaccine_patient = pd.DataFrame({
+            'patient': ssn[patient_idx],
+            'date': events['date'].to_numpy()[event_idx],
+            'hospital': events['hospital'].to_numpy()[event_idx],
+        })
+        yield 'vaccine_patient', vaccine_patient
+
+        # Diagnoses for 30 % of the doses, 1-14 days after the vaccination
+        sick = rng.random(len(vaccine_patient)) < 0.3
+        diagnosis = pd.DataFrame({
+            'patient': vaccine_patient['patient'].to_numpy()[sick],
+            'symptom': rng.choice(SYMPTOMS['name'].to_numpy(), sick.sum()),
+            'date': vaccine_patient['date'].to_numpy()[sick] + pd.to_timedelta(
+                rng.integers(1, 15, sick.sum()), unit='D'),
+        })
+        yield 'diagnosis', diagnosis.drop_duplicates().reset_index(drop=True)
+
+
+def generate(scale=1.0, seed=0, chunk_rows=100000):
+    '''
+    Yield (table name, data frame) chunks for all tables, in an order where
+    every chunk only references rows of earlier chunks, so they can be
+    loaded into the database as they come.
+    '''
+    rng = np.random.default_rng(seed)
+    dimensions = generate_dimensions(scale, rng)
+    for table in ['vaccine_type', 'manufacturer', 'hospital', 'staff', 'vaccination_shift', 'batch',
+                  'transport_log', 'vaccination_event', 'symptoms']:
+        yield table, dimensions[table]
+    yield from generate_patients(scale, rng, dimensions['vaccination_event'], chunk_rows)
+
+
+def generate_tables(scale=1.0, seed=0, chunk_rows=100000):
+    '''
+    All tables in memory, as a dict of table name -> data frame.
+    '''
+    chunks = {}
+    for table, frame in generate(scale, seed, chunk_rows):
+        chunks.setdefault(table, []).append(frame)
+    return {table: pd.concat(frames, ignore_index=True) for table, frames in chunks.items()}
+
+
+def write_files(out_dir, scale=1.0, seed=0, chunk_rows=100000, file_format='csv'):
+    '''
+    Write every chunk as a partition file out_dir/<table>/part-NNNNN.<format>.
+    Returns a dict of table name -> number of rows.
+    '''
+    out_dir = Path(out_dir)
+    rows, parts = {}, {}
+    for table, frame in generate(scale, seed, chunk_rows):
+        part = parts.get(table, 0)
+        path = out_dir / table / ('part-%05d.%s' % (part, file_format))
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if file_format == 'parquet':
+            frame.to_parquet(path, index=False)
+        else:
+            frame.to_csv(path, index=False)
+        parts[table] = part + 1
+        rows[table] = rows.get(table, 0) + len(frame)
+    return rows
+
+
+def copy_to_database(conn, scale=1.0, seed=0, chunk_rows=100000):
+    '''
+    COPY the generated chunks straight into the tables over the psycopg2 (or
+    SQLAlchemy) connection conn, committing after every chunk.
+    Returns a dict of table name -> number of rows.
+    '''
+    from bulkLoader import copy_dataframe
+    from partitioning import create_partitions
+
+    raw = getattr(conn, 'connection', conn)
+    rows = {}
+    for table, frame in generate(scale, seed, chunk_rows):
+        create_partitions(conn, {table: frame})
+        rows[table] = rows.get(table, 0) + copy_dataframe(frame, table, conn)
+        raw.commit()
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate synthetic vaccine distribution data.')
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='scale factor, %d patients per unit (default: %%(default)s)' % PATIENTS_PER_SCALE)
+    parser.add_argument('--seed', type=int, default=0, help='random seed (default: %(default)s)')
+    parser.add_argument('--chunk-rows', type=int, default=100000,
+                        help='patients per generated chunk (default: %(default)s)')
+    parser.add_argument('--format', choices=['csv', 'parquet', 'copy'], default='csv',
+                        help='write partition files or COPY into the database (default: %(default)s)')
+    parser.add_argument('--out', help='output directory for csv/parquet')
+    parser.add_argument('--create-schema', action='store_true',
+                        help='(re)create the tables with sqlCreatingDatabase.sql before copying')
+    parser.add_argument('--partitioned', action='store_true',
+                        help='with --create-schema, partition the event tables by month (see partitioning.py)')
+    # The database of --format copy
+    dbConnection.add_arguments(parser)
+    args = parser.parse_args(argv)
+
+    if args.format == 'copy':
+        from partitioning import create_schema
+
+        conn = dbConnection.connect(args.database_url, args.statement_timeout)
+        try:
+            if args.create_schema:
+                create_schema(conn, partitioned=args.partitioned)
+            rows = copy_to_database(conn, args.scale, args.seed, args.chunk_rows)
+        finally:
+            conn.close()
+    else:
+        if not args.out:
+            parser.error('--out is needed for csv and parquet output')
+        rows = write_files(args.out, args.scale, args.seed, args.chunk_rows, args.format)
+
+    for table, count in rows.items():
+        print(f'{table}: {count} rows')
+
+
+if __name__ == '__main__':
+    main()
@@ -22,394 +22,420 @@ ADDITIONAL source for PostgreSQL
     https://medium.com/analytics-vidhya/pandas-dataframe-to-postgresql-using-python-part-2-3ddb41f473bd
 
 '''
-import psycopg2
+import argparse
 from psycopg2 import Error
-from sqlalchemy import create_engine, text
+from sqlalchemy.types import Date
 import pandas as pd
-import numpy as np
 from pathlib import Path
 import datetime
-import openpyxl
-import matplotlib.pyplot as plt
+import analysisSql
+import cohorts
+from contactTracing import REQUIREMENT_10, trace_contacts
+from derivedTables import ensure_built, plot_vaccination_curves, vaccination_curves
+import dbConnection
+from dbConnection import create_pool, describe
+import profiling
+from profiling import stage
+from reserveEstimator import overall_reserve
+from resultCache import ResultCache
+import symptomFrequency
+from tableReader import read_table
+from taskGraph import DEFAULT_PROCESSES, DEFAULT_THREADS, Task, run_tasks
 
 
 # NOTE TO GRADER: IF YOU WANT TO RUN THIS FILE, DON'T FORGET TO INSTALL requirements.txt.
 # We added new requirements there and this file might not work without them.
 
-def run_sql_from_file(file_path, conn):
-    '''
-    Read and run SQL queries from a file at file_path.
-    '''
-    ok = True
-    with open(file_path, 'r') as file:
-        sql_cmd = ''
-        for line in file:
-            i = line.find('--')
-            if i != -1:
-                line = line[:i]
-            line = line.strip()
-            if line == '':
-                # Empty or comment-only line
-                continue
-
-            sql_cmd += ' ' + line
-            if line.endswith(';'):
-                try:
-                    conn.execute(text(sql_cmd))
-                except Exception as e:
-                    print(f'\nError while executing SQL:\n{e}\n')
-                    ok = False
-                sql_cmd = ''
-    return ok
-
-
-def main():
-    DATADIR = str(Path(__file__).parent.parent)  # for relative path
-    print("Data directory: ", DATADIR)
+def patient_symptoms(dfPatient, dfDiagnosis):
+    '''
+    Part 3 requirement 1: diagnosed symptoms with the gender and birthday of the patient.
+    '''
+    dfReq1 = dfPatient
+    dfReq1 = dfReq1[['ssn', 'gender', 'birthday']]
+    dfReq1 = dfReq1.merge(dfDiagnosis, left_on='ssn', right_on='patient')
+    dfReq1.drop('patient', axis=1, inplace=True)
+    dfReq1 = dfReq1.rename(columns={
+        'birthday': 'date_of_birth',
+        'date': 'diagnosis_date'})
+    return dfReq1
 
-    # In postgres=# shell: CREATE ROLE [role_name] WITH CREATEDB LOGIN PASSWORD '[pssword]'; 
-    # https://www.postgresql.org/docs/current/sql-createrole.html
 
-    database = "grp10_vaccinedist"
-    user = 'grp10'
-    password = 'VeKQ^hLf'
-    host = 'dbcourse2022.cs.aalto.fi'
-    # use connect function to establish the connection
-    try:
-        # Connect the postgres database from your local machine using psycopg2
-        connection = psycopg2.connect(
-            database=database,
-            user=user,
-            password=password,
-            host=host
-        )
+def patient_vaccine_info(dfPatient, vacc_patient_df, vaccine_df, dfBatch):
+    '''
+    Part 3 requirement 2: one row per patient with the dates and vaccine types
+    of their doses in order, as columns date1..dateN and vaccine_type1..
+    vaccine_typeN (N is the largest number of doses any patient got, at least
+    two). Patients without vaccinations get empty columns.
 
-        # Create a cursor to perform database operations
-        cursor = connection.cursor()
+    The doses are numbered per patient with cumcount and spread into columns
+    with a single pivot, so this runs in linear time in the number of doses.
+    '''
+    doses = vacc_patient_df[['patient', 'date', 'hospital']].merge(
+        vaccine_df[['date', 'hospital', 'batch']], on=['date', 'hospital'])
+    doses = doses.merge(dfBatch[['id', 'vaccine_type']], left_on='batch', right_on='id')
+    doses = doses.sort_values(['patient', 'date'])
+    doses['dose'] = doses.groupby('patient').cumcount() + 1
 
-        print("PostgreSQL server information")
-        print(connection.get_dsn_parameters(), "\n")
-        cursor.execute("SELECT version();")
-        record = cursor.fetchone()
-        print("You are connected to - ", record, "\n")
+    max_doses = max(int(doses['dose'].max()) if len(doses) else 0, 2)
+    wide = doses.pivot(index='patient', columns='dose', values=['date', 'vaccine_type'])
+    wide = wide.reindex(columns=pd.MultiIndex.from_product([['date', 'vaccine_type'], range(1, max_doses + 1)]))
+    wide.columns = [f'{name}{dose}' for name, dose in wide.columns]
 
-        # Population of DB with tables:
+    # Left merge keeps the patients that haven't been vaccinated
+    res = dfPatient[['ssn']].merge(wide, left_on='ssn', right_index=True, how='left')
+    return res.reset_index(drop=True)
 
-        # Step 1: Connect to db using SQLAlchemy create_engine
-        DIALECT = 'postgresql+psycopg2://'
-        db_uri = "%s:%s@%s/%s" % (user, password, host, database)
-        print(DIALECT + db_uri)
 
-        engine = create_engine(DIALECT + db_uri)
-        psql_conn = engine.connect()
+def top_symptoms(dfPatientSymptoms, n=3):
+    '''
+    Part 3 requirement 3: the n most common symptoms for each gender, as
+    rows of (gender, symptom) from the most common down. Ties are broken by
+    the symptom name.
+    '''
+    counts = dfPatientSymptoms.groupby(['gender', 'symptom'], observed=True).size().reset_index(name='count')
+    counts = counts.sort_values(['gender', 'count', 'symptom'], ascending=[True, False, True])
+    return counts.groupby('gender').head(n)[['gender', 'symptom']].reset_index(drop=True)
+
+
+def patient_age_groups(dfPatient, now):
+    '''
+    Part 3 requirement 4: patients with their age group at the date now
+    (see cohorts.py).
+    '''
+    dfPAge = dfPatient.copy()
+    dfPAge['birthday'] = pd.to_datetime(dfPAge['birthday'])
+    dfPAge['age_group'] = cohorts.age_groups(cohorts.ages_at(dfPAge['birthday'], now))
+    return dfPAge
+
+
+def patient_vaccination_status(dfPAge, vacc_patient_df):
+    '''
+    Part 3 requirement 5: patients with the number of doses they got (vacc_status).
+    '''
+    dfR5patient = dfPAge.copy()
+    dfR5patient['vacc_status'] = cohorts.dose_counts(dfR5patient['ssn'], vacc_patient_df['patient'])
+    return dfR5patient
+
+
+def vaccination_status_by_age_group(dfR5patient):
+    '''
+    Part 3 requirement 6: percentage of patients with 0, 1, 2, ... doses in
+    every age group. Rows are the vaccination statuses, columns the age groups.
+    '''
+    return cohorts.status_distribution(dfR5patient['age_group'], dfR5patient['vacc_status'])
+
+
+def store_patient_symptoms(psql_conn, dfPatientSymptoms):
+    '''
+    Store the result of requirement 1 as the table patient_symptoms.
+    '''
+    dfPatientSymptoms.to_sql('patient_symptoms', con=psql_conn, index=True, if_exists='replace',
+                             dtype={'date_of_birth': Date, 'diagnosis_date': Date})
+
+
+def store_patient_vaccine_info(psql_conn, dfVaccineInfo):
+    '''
+    Store the result of requirement 2 as the table patient_vaccine_info.
+    '''
+    dates = {column: Date for column in dfVaccineInfo.columns if column.startswith('date')}
+    dfVaccineInfo.to_sql('patient_vaccine_info', con=psql_conn, index=True, if_exists='replace', dtype=dates)
+
+
+def requirements_1_to_6(psql_conn, now, write=True):
+    '''
+    Reference (pandas) implementation of Part 3 requirements 1-6: the
+    tables are read into typed data frames (see tableReader.py) and joined
+    and aggregated here.
+    With write=True the results of requirements 1 and 2 are stored as the
+    tables patient_symptoms and patient_vaccine_info.
+    Returns a dict of result name -> data frame.
+    '''
+    res = {}
+
+    # Part 3 requirement 1
+    dfPatient = read_table(psql_conn, 'patient')
+    dfDiagnosis = read_table(psql_conn, 'diagnosis')
+    res['patient_symptoms'] = patient_symptoms(dfPatient, dfDiagnosis)
+    if write:
+        store_patient_symptoms(psql_conn, res['patient_symptoms'])
+
+    # Part 3 requirement 2
+    vacc_patient_df = read_table(psql_conn, 'vaccine_patient')
+    vaccine_df = read_table(psql_conn, 'vaccination_event')
+    dfBatch = read_table(psql_conn, 'batch')
+    res['patient_vaccine_info'] = patient_vaccine_info(dfPatient, vacc_patient_df, vaccine_df, dfBatch)
+    if write:
+        store_patient_vaccine_info(psql_conn, res['patient_vaccine_info'])
+
+    # Part 3 requirements 3-6
+    res['top_symptoms'] = top_symptoms(res['patient_symptoms'])
+    res['age_groups'] = patient_age_groups(dfPatient, now)
+    res['vaccination_status'] = patient_vaccination_status(res['age_groups'], vacc_patient_df)
+    res['status_by_age_group'] = vaccination_status_by_age_group(res['vaccination_status'])
+    return res
+
+
+def symptom_frequencies(psql_conn):
+    '''
+    Part 3 requirement 7: every symptom with its relative frequency
+    (very common, common, rare or -) per vaccine type, see symptomFrequency.py.
+    '''
+    return symptomFrequency.symptom_frequencies(psql_conn)
+
+
+def vaccine_reserve(psql_conn):
+    '''
+    Part 3 requirement 8: percentage of the batch size to reserve for a
+    vaccination event (mean + standard deviation of the participation).
+    Combined from the running statistics of reserveEstimator.py.
+    '''
+    return overall_reserve(psql_conn)
+
+
+def vaccination_progress(psql_conn):
+    '''
+    Part 3 requirement 9: cumulative number of vaccinated patients and of
+    patients who completed their vaccination series per day, as two data
+    frames indexed by date. Read from the vaccination_daily rollup (see
+    derivedTables.py).
+    '''
+    return vaccination_curves(psql_conn)
+
+
+def nurse_contacts(psql_conn):
+    '''
+    Part 3 requirement 10: patients and staff members the nurse may have met
+    in vaccination events in the past 10 days.
+    '''
+    contacts = trace_contacts(psql_conn, **REQUIREMENT_10)
+    return contacts[['ssn', 'name']].drop_duplicates().reset_index(drop=True)
+
+
+def _without_status(dfStatus):
+    return dfStatus.drop(columns='vacc_status')
+
+
+# Tasks whose results answer each requirement
+REQUIREMENT_TASKS = {
+    1: ['store_patient_symptoms'],
+    2: ['store_patient_vaccine_info'],
+    3: ['top_symptoms'],
+    4: ['age_groups'],
+    5: ['vaccination_status'],
+    6: ['status_by_age_group'],
+    7: ['symptom_frequencies'],
+    8: ['vaccine_reserve'],
+    9: ['vaccination_progress'],
+    10: ['nurse_contacts'],
+}
 
-        # NOTE: For some reason, the code for executing queries from an sql file ignores the case,
-        # so all tables and attributes in the DB are lower-cased.
-        # So, until this is fixed, all columns in dataframes need to be lowercased.
-
-
-        # Part 3 requirement 1
-        dfPatient = pd.read_sql("select * from \"patient\"", psql_conn)
-        dfDiagnosis = pd.read_sql("select * from \"diagnosis\"", psql_conn)
-        dfReq1 = dfPatient
-        dfReq1 = dfReq1[['ssn', 'gender', 'birthday']]
-        dfReq1 = dfReq1.merge(dfDiagnosis, left_on='ssn', right_on='patient')
-        dfReq1.drop('patient', axis=1, inplace=True)
-        dfReq1 = dfReq1.rename(columns={
-            'birthday': 'date_of_birth',
-            'date': 'diagnosis_date'})
-        dfReq1.to_sql('patient_symptoms', con=psql_conn, index=True, if_exists='replace')
-
-        # Part 3 requirement 2
-        vacc_patient_df = pd.read_sql("select * from \"vaccine_patient\"", psql_conn)
-        vaccine_df = pd.read_sql("select * from \"vaccination_event\"", psql_conn)
-        dfBatch = pd.read_sql("select * from \"batch\"", psql_conn)
-        dfReq2 = dfPatient
-        dfReq2 = dfReq2[['ssn']]
-        dfReq2 = dfReq2.merge(vacc_patient_df, left_on='ssn', right_on='patient').drop('patient', axis=1)
-        dfReq2 = dfReq2.merge(vaccine_df, on=['date', 'hospital'])
-        dfReq2 = dfReq2.merge(dfBatch[['id', 'vaccine_type']], left_on='batch', right_on='id').drop(
-            ['hospital', 'batch', 'id'], axis=1)
-
-        dates = pd.DataFrame()
-        types = pd.DataFrame()
-        grouped = dfReq2.groupby('ssn')
-        for i in grouped:
-            item = i[1].reset_index(0).drop('index', axis=1).reset_index(0)
-            item = item.pivot(index='ssn', columns='index')
-            date = item['date'].reset_index(0)
-            vacctype = item['vaccine_type'].reset_index(0)
-            if 1 not in date:
-                date[1] = np.nan
-            if 1 not in vacctype:
-                vacctype[1] = np.nan
-            dates = pd.concat([dates, date])
-            types = pd.concat([types, vacctype])
-
-        res = dates.merge(types, on='ssn')
-        res.loc[res['0_x'] > res['1_x'], ['0_x', '1_x', '0_y', '1_y']] = res.loc[
-            res['0_x'] > res['1_x'], ['1_x', '0_x', '1_y', '0_y']].values
-        res = res.rename(columns={
-            '0_x': 'date1',
-            '1_x': 'date2',
-            '0_y': 'vaccine_type1',
-            '1_y': 'vaccine_type2'
-        })
-        missing = dfPatient[~dfPatient['ssn'].isin(res['ssn'])]
-        missing = missing[['ssn']]
-        missing['date1'] = np.nan
-        missing['date2'] = np.nan
-        missing['vaccine_type1'] = np.nan
-        missing['vaccine_type2'] = np.nan
-        res = pd.concat([res, missing])
-
-        res.to_sql('patient_vaccine_info', con=psql_conn, index=True, if_exists='replace')
-
-        # Part 3 requirement 3
-        dfPatientSymptoms = pd.read_sql("select * from \"patient_symptoms\"", psql_conn)
-
-        dfSymptomsMales = dfPatientSymptoms[dfPatientSymptoms.gender == 'M']
-        dfSymptomsFemales = dfPatientSymptoms[dfPatientSymptoms.gender == 'F']
-
-        topMales = dfSymptomsMales['symptom'].value_counts().index.tolist()[:3]
-        topFemales = dfSymptomsFemales['symptom'].value_counts().index.tolist()[:3]
-
-        print("Requirement 3: \n")
-        print("Top 3 symptoms for males: \n")
-        print(topMales)
-        print("\n\nTop 3 symptoms for females: \n")
-        print(topFemales)
-
-
-        # Part 3 requirement 4
-        ageValues = ['0-9', '10-19', '20-39', '40-59', '60+']
-
-        now = pd.Timestamp('now')
-        dfPAge = dfPatient
-        dfPAge.loc[:, 'birthday'] = pd.to_datetime(dfPatient.birthday)
-        #dfPAge['birthday'] = pd.to_datetime(dfPAge['birthday'], format='%y%m%d')
-
-        dfPAge['age'] = (now - dfPAge['birthday']).astype('<m8[Y]')
-
-        ageConditions = [
-            (dfPAge['age'] < 10),
-            (dfPAge['age'] >= 10) & (dfPAge['age'] < 20),
-            (dfPAge['age'] >= 20) & (dfPAge['age'] < 39),
-            (dfPAge['age'] >= 39) & (dfPAge['age'] < 59),
-            (dfPAge['age'] >= 60)
+
+def analysis_tasks(now, sql=False):
+    '''
+    The Part 3 requirements as tasks for taskGraph.run_tasks. Inputs that
+    are not tasks are tables, which are read once and shared. With sql=True
+    requirements 1-6 run as SQL in the database (see analysisSql.py).
+    '''
+    if sql:
+        tasks = [
+            Task('store_patient_symptoms', analysisSql.create_patient_symptoms, kind='sql', cacheable=False),
+            Task('store_patient_vaccine_info', analysisSql.create_patient_vaccine_info, kind='sql',
+                 cacheable=False),
+            Task('top_symptoms', analysisSql.top_symptoms, kind='sql', reads=['patient', 'diagnosis']),
+            Task('vaccination_status', analysisSql.patient_vaccination_status, params={'now': now}, kind='sql',
+                 reads=['patient', 'vaccine_patient']),
+            Task('age_groups', _without_status, ['vaccination_status']),
+            Task('status_by_age_group', analysisSql.vaccination_status_by_age_group, params={'now': now},
+                 kind='sql', reads=['patient', 'vaccine_patient']),
         ]
-        dfPAge['age_group'] = np.select(ageConditions, ageValues)
-
-        # removing age column, as it's not required by the task
-        dfPAge.drop('age', axis=1, inplace=True)
-
-        print("\n\nRequirement 4: \n")
-        print("Patients with age groups: \n")
-        print(dfPAge)
-
-        # Part 3 requirement 5
-        dfR5vacc_patient = pd.read_sql("select * from \"vaccine_patient\"", psql_conn)
-        dfR5patient = dfPAge
-        dfR5vacc_patient = dfR5vacc_patient.groupby(['patient'])['date'].count()
-        dfR5vacc_patient = dfR5vacc_patient.reset_index()
-        dfR5vacc_patient.columns = ['ssn', 'vacc_status']
-        dfR5patient = dfR5patient.merge(dfR5vacc_patient, how='left', on='ssn')
-        dfR5patient['vacc_status'] = dfR5patient['vacc_status'].fillna(0)
-        print("\n\nRequirement 5: \n")
-        print("Patients with vaccination status column: \n")
-        print(dfR5patient)
-
-        # Part 3 requirement 6
-        dfR6patient = dfR5patient.groupby(['age_group'])['ssn'].count()
-        dfR6patient = dfR6patient.reset_index()
-        dfR6patient.columns = ['age_group', 'total_number']
-        dfR6patientVacc_0 = dfR5patient[dfR5patient['vacc_status'] == 0].groupby(['age_group'])['ssn'].count()
-        dfR6patientVacc_0 = dfR6patientVacc_0.reset_index()
-        dfR6patientVacc_0.columns = ['age_group', '0-vacc']
-        dfR6patientVacc_1 = dfR5patient[dfR5patient['vacc_status'] == 1].groupby(['age_group'])['ssn'].count()
-        dfR6patientVacc_1 = dfR6patientVacc_1.reset_index()
-        dfR6patientVacc_1.columns = ['age_group', '1-vacc']
-        dfR6patientVacc_2 = dfR5patient[dfR5patient['vacc_status'] == 2].groupby(['age_group'])['ssn'].count()
-        dfR6patientVacc_2 = dfR6patientVacc_2.reset_index()
-        dfR6patientVacc_2.columns = ['age_group', '2-vacc']
-        dfR6patient = dfR6patient.merge(dfR6patientVacc_0, how='left', on='age_group')
-        dfR6patient = dfR6patient.merge(dfR6patientVacc_1, how='left', on='age_group')
-        dfR6patient = dfR6patient.merge(dfR6patientVacc_2, how='left', on='age_group')
-        dfR6patient.iloc[:, 2:5] = dfR6patient.iloc[:, 2:5].divide(dfR6patient.iloc[:, 1], axis='rows')
-        dfR6patient.iloc[:, 2:5] = dfR6patient.iloc[:, 2:5].multiply(100, axis='rows')
-        dfR6patient = dfR6patient.drop('total_number', axis=1)
-        dfR6patient.rename(columns={'age_group': 'vacc_status'}, inplace=True)
-        dfR6patient = dfR6patient.set_index('vacc_status')
-        dfR6patient = dfR6patient.T
-        print("\n\nRequirement 6: \n")
-        print("Patient percentage in each group according to vaccination status: \n")
-        print(dfR6patient)
-
-        # Part 3 requirement 7
-        dfSymptoms = pd.read_sql("select * from \"symptoms\"", psql_conn)
-        query_7 = """
-        WITH MAPPING AS
-	        (SELECT VACCINE_PATIENT.PATIENT,
-			    VACCINATION_EVENT.DATE AS VACC_DATE,
-			    VACCINATION_EVENT.HOSPITAL,
-			    DIAGNOSIS.SYMPTOM,
-			    DIAGNOSIS.DATE AS SYMPTOM_DATE
-		    FROM VACCINATION_EVENT
-		    JOIN VACCINE_PATIENT ON VACCINE_PATIENT.DATE = VACCINATION_EVENT.DATE
-		    AND VACCINE_PATIENT.HOSPITAL = VACCINATION_EVENT.HOSPITAL
-		    JOIN DIAGNOSIS ON VACCINE_PATIENT.PATIENT = DIAGNOSIS.PATIENT AND VACCINATION_EVENT.DATE < DIAGNOSIS.DATE),
-	    DEDUPLICATED AS
-	        (SELECT PATIENT, HOSPITAL, SYMPTOM, SYMPTOM_DATE, MAX(VACC_DATE) AS VACC_DATE
-		FROM MAPPING
-		GROUP BY PATIENT, HOSPITAL, SYMPTOM, SYMPTOM_DATE)
-        SELECT DEDUPLICATED.PATIENT,
-	        DEDUPLICATED.HOSPITAL,
-	        DEDUPLICATED.SYMPTOM,
-	        DEDUPLICATED.SYMPTOM_DATE,
-	        DEDUPLICATED.VACC_DATE,
-	        BATCH.VACCINE_TYPE
-        FROM DEDUPLICATED
-        JOIN VACCINATION_EVENT ON VACCINATION_EVENT.DATE = DEDUPLICATED.VACC_DATE
-        AND VACCINATION_EVENT.HOSPITAL = DEDUPLICATED.HOSPITAL
-        JOIN BATCH ON BATCH.ID = VACCINATION_EVENT.BATCH
-        ORDER BY DEDUPLICATED.PATIENT
-        """
-        result = pd.read_sql_query(query_7, engine)
-        df_counts = result.groupby(['vaccine_type', 'symptom']).size().reset_index(name='count')
-        vaccine_group = df_counts.groupby(['vaccine_type'])['count'].sum().reset_index(name='total_count')
-        df_frequency = pd.merge(df_counts, vaccine_group, left_on='vaccine_type', right_on='vaccine_type', how='left')
-        df_frequency['frequency'] = df_frequency.apply(lambda row: row['count'] / row['total_count'], axis=1)
-        df_frequency['frequency_text'] = df_frequency.apply(lambda row: 'very common' if row['frequency'] >= 0.1
-        else ('common' if row['frequency'] >= 0.05 else 'rare'), axis=1)
-        pivot_symptoms = df_frequency.pivot_table(values='frequency_text', index=['symptom'],
-                                                  columns='vaccine_type', aggfunc='first').reset_index()
-        df_symptom_freq = pd.merge(dfSymptoms, pivot_symptoms, left_on='name', right_on='symptom', how='left')
-        df_symptom_freq = df_symptom_freq.drop('symptom', axis=1)
-        df_symptom_freq = df_symptom_freq.fillna('-')
-        print("\n\nRequirement 7: \n")
-        print("Symptoms with their relative frequencies: \n")
-        print(df_symptom_freq)
-
-        query_8 = """
-                SELECT VACCINE_PATIENT.DATE, VACCINATION_EVENT.HOSPITAL, BATCH.ID, BATCH.NUM_OF_VACC, 
-                COUNT(VACCINE_PATIENT.PATIENT) AS NUM_PATIENT
-                FROM VACCINE_PATIENT
-                JOIN VACCINATION_EVENT ON VACCINE_PATIENT.DATE = VACCINATION_EVENT.DATE
-                AND VACCINE_PATIENT.HOSPITAL = VACCINATION_EVENT.HOSPITAL
-                JOIN BATCH ON BATCH.ID = VACCINATION_EVENT.BATCH
-                GROUP BY VACCINE_PATIENT.DATE, VACCINATION_EVENT.HOSPITAL, BATCH.ID, BATCH.NUM_OF_VACC
-                ORDER BY VACCINE_PATIENT.DATE
-                        """
-        df8_vacc_patient = pd.read_sql_query(query_8, engine)
-        df8_vacc_patient["participation"] = round(
-            (df8_vacc_patient["num_patient"] / df8_vacc_patient["num_of_vacc"]) * 100, 2)
-        atnd_patient = round(df8_vacc_patient['participation'].mean(), 2)
-        std = round(df8_vacc_patient["participation"].std(), 2)
-        vacc_perc = atnd_patient + std
-        print("\n\nRequirement 8: \n")
-        print(f"Amount of vaccines that should be reserved for each vaccination to minimize waste is {vacc_perc}%")
-
-        # Part 3, Requirement 9
-        query_9_vaccinated = """
-            WITH patients AS (
-                SELECT vp.patient, MIN(vp.date) AS date
-                FROM vaccine_patient as vp
-                GROUP BY vp.patient
-            )
-
-            SELECT patients.date, COUNT(patients.patient) AS n
-            FROM patients
-            GROUP BY patients.date
-            ORDER BY patients.date
-            ;
-        """
-        dfR9_vaccinated = pd.read_sql_query(query_9_vaccinated, engine)
-        dfR9_vaccinated['date'] = pd.to_datetime(dfR9_vaccinated['date'], format='%Y-%m-%d')
-        dfR9_vaccinated['n'] = dfR9_vaccinated['n'].cumsum()
-        dfR9_vaccinated.set_index(['date'], inplace=True)
-        dfR9_vaccinated = dfR9_vaccinated.rename(columns={'n': 'vaccinated'})
-        q9_plot = dfR9_vaccinated.plot()
-
-        query_9_full = """
-            WITH counts AS (
-                SELECT vp.patient, COUNT(vp.patient) AS shots, MAX(vp.date) AS last_date
-                FROM vaccine_patient AS vp
-                GROUP BY vp.patient
-            )
-
-            SELECT counts.last_date AS date, COUNT(counts.patient) as n
-            FROM counts
-            WHERE counts.shots > 1
-            GROUP BY counts.last_date
-            ORDER BY counts.last_date ASC
-            ;
-        """
-        dfR9_full = pd.read_sql_query(query_9_full, engine)
-        dfR9_full['date'] = pd.to_datetime(dfR9_full['date'], format='%Y-%m-%d')
-        dfR9_full['n'] = dfR9_full['n'].cumsum()
-        dfR9_full.set_index(['date'], inplace=True)
-        dfR9_full = dfR9_full.rename(columns={'n': 'two_vaccines'})
-
-        dfR9_full.plot(ax=q9_plot)#.get_figure().savefig(DATADIR + '/img/part3_req9.png')
-
-        #Uncomment this to see plot, however, doing so will prevent you seeing results of requirement 10
-        #plt.show()
-
-        #Part 3, Requirement 10
-        query_10 = """
-            WITH ve AS (
-                -- Vaccination events where worker in question participated
-                SELECT ve.hospital, ve.date, vs.weekday
-                FROM vaccination_shift AS vs
-                RIGHT JOIN vaccination_event AS ve
-                ON ve.hospital = vs.hospital AND EXTRACT(isodow FROM ve.date) = (
-                    -- Make sure to only include event if weekday matches with
-                    -- working shift for the worker in question.
-                    CASE vs.weekday
-                        WHEN 'Monday' THEN 1
-                        WHEN 'Tuesday' THEN 2
-                        WHEN 'Wednesday' THEN 3
-                        WHEN 'Thursday' THEN 4
-                        WHEN 'Friday' THEN 5
-                        WHEN 'Saturday' THEN 6
-                        WHEN 'Sunday' THEN 7
-                    END
-                ) AND ve.date >= '2021-05-05' AND ve.date <= '2021-05-15'
-                WHERE vs.worker = '19740919-7140'
-            )
-
-            -- Patients
-            SELECT patient.ssn, patient.name
-            FROM ve
-            LEFT JOIN vaccine_patient AS vp
-            ON vp.hospital = ve.hospital AND vp.date = ve.date
-            LEFT JOIN patient
-            ON patient.ssn = vp.patient
-
-            UNION
-
-            -- Staff members
-            SELECT staff.ssn, staff.name
-            FROM ve
-            LEFT JOIN vaccination_shift AS vs
-            ON vs.hospital = ve.hospital AND vs.weekday = ve.weekday AND vs.worker != '19740919-7140'
-            LEFT JOIN staff
-            ON staff.ssn = vs.worker
-            GROUP BY staff.ssn, staff.name
-            ;
-        """
-        query_10_result = pd.read_sql_query(query_10, engine)
-        print("\n\nRequirement 10: \n")
-        print("Patients and staff members that the nurse may have met in vaccination events in the past 10 days: \n")
-        print(query_10_result)
+    else:
+        tasks = [
+            # The joins over the big tables are worth another process, the
+            # rest is cheaper than copying its inputs there
+            Task('patient_symptoms', patient_symptoms, ['patient', 'diagnosis'], heavy=True),
+            Task('store_patient_symptoms', store_patient_symptoms, ['patient_symptoms'], kind='sql',
+                 cacheable=False),
+            Task('patient_vaccine_info', patient_vaccine_info,
+                 ['patient', 'vaccine_patient', 'vaccination_event', 'batch'], heavy=True),
+            Task('store_patient_vaccine_info', store_patient_vaccine_info, ['patient_vaccine_info'], kind='sql',
+                 cacheable=False),
+            Task('top_symptoms', top_symptoms, ['patient_symptoms']),
+            Task('age_groups', patient_age_groups, ['patient'], params={'now': now}),
+            Task('vaccination_status', patient_vaccination_status, ['age_groups', 'vaccine_patient']),
+            Task('status_by_age_group', vaccination_status_by_age_group, ['vaccination_status']),
+        ]
+    return tasks + [
+        Task('symptom_frequencies', symptom_frequencies, kind='sql',
+             reads=['symptoms', 'diagnosis', 'vaccine_patient', 'vaccination_event', 'batch']),
+        Task('vaccine_reserve', vaccine_reserve, kind='sql', reads=['reserve_stats']),
+        Task('vaccination_progress', vaccination_progress, kind='sql', reads=['vaccination_daily']),
+        Task('nurse_contacts', nurse_contacts, kind='sql',
+             reads=['vaccination_shift', 'vaccination_event', 'vaccine_patient', 'patient', 'staff']),
+    ]
+
+
+def _normalized(df):
+    '''
+    Data frame in a canonical form for comparing results: without the
+    to_sql index column, categoricals as plain values, dates as datetime64[ns],
+    rows sorted by all columns.
+    '''
+    df = df.drop(columns=['index'], errors='ignore').copy()
+    for column in df.columns:
+        if isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = df[column].astype(df[column].cat.categories.dtype)
+        if df[column].dtype == object and df[column].map(lambda x: isinstance(x, datetime.date)).any():
+            df[column] = pd.to_datetime(df[column])
+        if pd.api.types.is_datetime64_any_dtype(df[column]):
+            df[column] = df[column].astype('datetime64[ns]')
+    return df.sort_values(list(df.columns)).reset_index(drop=True)
+
+
+def compare_requirements(psql_conn, now):
+    '''
+    Run requirements 1-6 both in pandas and as SQL in the database and
+    assert that the results are identical.
+    '''
+    sqlRes = analysisSql.requirements_1_to_6(psql_conn, now)
+    sqlRes['patient_symptoms'] = pd.read_sql("select * from \"patient_symptoms\"", psql_conn)
+    sqlRes['patient_vaccine_info'] = pd.read_sql("select * from \"patient_vaccine_info\"", psql_conn)
+    pandasRes = requirements_1_to_6(psql_conn, now, write=False)
+
+    for name in ['patient_symptoms', 'patient_vaccine_info', 'top_symptoms', 'age_groups', 'vaccination_status']:
+        pd.testing.assert_frame_equal(_normalized(pandasRes[name]), _normalized(sqlRes[name]),
+                                      check_dtype=False, obj=name)
+    pd.testing.assert_frame_equal(pandasRes['status_by_age_group'], sqlRes['status_by_age_group'],
+                                  check_dtype=False, obj='status_by_age_group')
+    # Release the locks on the result tables, other connections replace them
+    psql_conn.commit()
+    print("Requirements 1-6: pandas and SQL results are identical\n")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Part 3 analysis of the vaccine distribution database.')
+    parser.add_argument('--sql', action='store_true',
+                        help='run requirements 1-6 as SQL in the database instead of in pandas')
+    parser.add_argument('--compare', action='store_true',
+                        help='check that the pandas and SQL versions of requirements 1-6 give the same results')
+    parser.add_argument('--only', type=lambda value: [int(n) for n in value.split(',')],
+                        default=list(REQUIREMENT_TASKS),
+                        help='comma separated requirements to run, e.g. 7,8 (default: all)')
+    parser.add_argument('--reference-date', type=pd.Timestamp, default=None, metavar='YYYY-MM-DD',
+                        help='date at which the ages of requirement 4 are counted (default: today)')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='compute every result again instead of using cached results of unchanged tables')
+    parser.add_argument('--threads', type=int, default=DEFAULT_THREADS,
+                        help='tasks running SQL at the same time (default: %(default)s)')
+    parser.add_argument('--processes', type=int, default=DEFAULT_PROCESSES,
+                        help='processes for the heavy pandas tasks, 0 runs them in threads (default: %(default)s)')
+    dbConnection.add_arguments(parser)
+    profiling.add_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # Stages (every task) and statements are recorded with --profile / --trace
+    profiler = profiling.from_args(args)
+    before = None
+    DATADIR = str(Path(__file__).parent.parent)  # for relative path
+    print("Data directory: ", DATADIR)
+
+    # The database is given by --database-url, $VACCINEDIST_DATABASE_URL or the
+    # libpq environment (PGHOST, PGDATABASE, PGUSER, PGPASSWORD), see dbConnection.py
+    engine = psql_conn = None
+    try:
+        # One pool of connections for everything
+        engine = create_pool(args.database_url, pool_size=args.threads, statement_timeout_ms=args.statement_timeout)
+        if profiler:
+            profiler.instrument(engine)
+        url, version = describe(engine)
+        print("PostgreSQL server information")
+        print(url, "\n")
+        print("You are connected to - ", version, "\n")
+
+        psql_conn = engine.connect()
+        if profiler and args.pg_stat_statements:
+            before = profiling.snapshot_statements(psql_conn)
+
+        # Ages in requirement 4 are counted at this date
+        now = (args.reference_date or pd.Timestamp('now')).normalize()
+        # The tasks read the derived tables on connections of their own, so
+        # the missing ones are built once here and not by concurrent tasks
+        with stage('ensure derived tables'):
+            ensure_built(psql_conn)
+        if args.compare:
+            with stage('compare requirements'):
+                compare_requirements(psql_conn, now)
+
+        # Every table is read once; independent requirements run at the same
+        # time. With --sql requirements 1-6 run in the database.
+        targets = [name for number in args.only for name in REQUIREMENT_TASKS[number]]
+        # Results computed from the same table versions are taken from the
+        # result cache (see resultCache.py)
+        res = run_tasks(analysis_tasks(now, sql=args.sql), engine, targets,
+                        threads=args.threads, processes=args.processes,
+                        result_cache=None if args.no_cache else ResultCache())
+
+        if 3 in args.only:
+            topSymptoms = res['top_symptoms']
+            topMales = topSymptoms[topSymptoms.gender == 'M']['symptom'].tolist()
+            topFemales = topSymptoms[topSymptoms.gender == 'F']['symptom'].tolist()
+
+            print("Requirement 3: \n")
+            print("Top 3 symptoms for males: \n")
+            print(topMales)
+            print("\n\nTop 3 symptoms for females: \n")
+            print(topFemales)
+
+        if 4 in args.only:
+            print("\n\nRequirement 4: \n")
+            print("Patients with age groups: \n")
+            print(res['age_groups'])
+
+        if 5 in args.only:
+            print("\n\nRequirement 5: \n")
+            print("Patients with vaccination status column: \n")
+            print(res['vaccination_status'])
+
+        if 6 in args.only:
+            print("\n\nRequirement 6: \n")
+            print("Patient percentage in each group according to vaccination status: \n")
+            print(res['status_by_age_group'])
+
+        if 7 in args.only:
+            print("\n\nRequirement 7: \n")
+            print("Symptoms with their relative frequencies: \n")
+            print(res['symptom_frequencies'])
+
+        if 8 in args.only:
+            print("\n\nRequirement 8: \n")
+            print("Amount of vaccines that should be reserved for each vaccination to minimize waste is "
+                  f"{res['vaccine_reserve']}%")
+
+        if 9 in args.only:
+            dfR9_vaccinated, dfR9_completed = res['vaccination_progress']
+            with stage('plot requirement 9'):
+                plot_vaccination_curves(dfR9_vaccinated, dfR9_completed, DATADIR + '/img/part3_req9.png')
+            print("\n\nRequirement 9: \n")
+            print(f"Vaccination curves plotted to {DATADIR}/img/part3_req9.png")
+
+        if 10 in args.only:
+            print("\n\nRequirement 10: \n")
+            print("Patients and staff members that the nurse may have met in vaccination events in the past 10 days: \n")
+            print(res['nurse_contacts'])
 
     except (Exception, Error) as error:
         print("Error while connecting to PostgreSQL", error)
     finally:
-        if (connection):
+        if profiler:
+            profiling.finish(profiler, args, psql_conn, before)
+        if psql_conn is not None:
             psql_conn.close()
-            connection.close()
+        if engine is not None:
+            engine.dispose()
             print("PostgreSQL connection is closed")
 
 
-main()
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,207 @@
+'''
+Database connections of the scripts.
+
+Every script gets its connections from one SQLAlchemy engine created by
+create_pool:
+  - the database URL comes from the command line (--database-url), the
+    VACCINEDIST_DATABASE_URL environment variable or, by default, the
+    libpq environment (PGHOST, PGDATABASE, PGUSER, PGPASSWORD or
+    ~/.pgpass, ...), so no credentials are stored in the code,
+  - the pool keeps pool_size connections open, checks them before use
+    (pre-ping, so a connection dropped by the server is replaced instead of
+    failing the next query) and sets a statement timeout on every
+    connection (VACCINEDIST_STATEMENT_TIMEOUT, in milliseconds).
+Independent queries run at the same time with run_concurrently or a
+QueryExecutor: every call gets its own pooled connection in a thread, so
+the queries overlap in the database instead of waiting for each other.
+
+  export VACCINEDIST_DATABASE_URL=postgresql+psycopg2://grp10@dbcourse2022.cs.aalto.fi/grp10_vaccinedist
+  export PGPASSWORD=...
+
+Short commands that run one query (see vaccinedist.py) use connect, a
+plain psycopg2 connection with the same settings; SQLAlchemy and pandas
+are only imported when a pool or a data frame is needed.
+'''
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+URL_ENV = 'VACCINEDIST_DATABASE_URL'
+STATEMENT_TIMEOUT_ENV = 'VACCINEDIST_STATEMENT_TIMEOUT'
+# Without a host and database libpq uses PGHOST, PGDATABASE, ...
+DEFAULT_URL = 'postgresql+psycopg2://'
+DEFAULT_POOL_SIZE = 4
+DEFAULT_MAX_OVERFLOW = 4
+APPLICATION_NAME = 'vaccinedist'
+
+
+def database_url(url=None):
+    '''
+    SQLAlchemy URL of the database: url, else $VACCINEDIST_DATABASE_URL,
+    else the libpq defaults. postgresql:// URLs (as used by libpq) get the
+    psycopg2 driver.
+    '''
+    url = url or os.environ.get(URL_ENV) or DEFAULT_URL
+    for prefix in ['postgresql://', 'postgres://']:
+        if url.startswith(prefix):
+            url = 'postgresql+psycopg2://' + url[len(prefix):]
+    return url
+
+
+def create_pool(url=None, pool_size=DEFAULT_POOL_SIZE, max_overflow=DEFAULT_MAX_OVERFLOW,
+                statement_timeout_ms=None, pre_ping=True, **kwargs):
+    '''
+    Engine with a pool of pool_size connections (and up to max_overflow
+    more under load) to the database of database_url(url). Every
+    connection gets the statement timeout statement_timeout_ms (default
+    $VACCINEDIST_STATEMENT_TIMEOUT, 0 = none). With poolclass=NullPool
+    (in kwargs) every connect opens a new connection instead.
+    '''
+    from sqlalchemy import create_engine
+    from sqlalchemy.pool import NullPool
+
+    if kwargs.get('poolclass') is not NullPool:
+        kwargs.update(pool_size=pool_size, max_overflow=max_overflow)
+    return create_engine(database_url(url), pool_pre_ping=pre_ping,
+                         connect_args=_connect_args(statement_timeout_ms), **kwargs)
+
+
+def _connect_args(statement_timeout_ms=None):
+    if statement_timeout_ms is None:
+        statement_timeout_ms = int(os.environ.get(STATEMENT_TIMEOUT_ENV, 0))
+    connect_args = {'application_name': APPLICATION_NAME}
+    if statement_timeout_ms:
+        connect_args['options'] = '-c statement_timeout=%d' % statement_timeout_ms
+    return connect_args
+
+
+def connect(url=None, statement_timeout_ms=None):
+    '''
+    A single psycopg2 connection (no pool) to the database of
+    database_url(url), with the statement timeout of create_pool.
+    '''
+    import psycopg2
+
+    # libpq understands the URL without the SQLAlchemy driver name
+    dsn = database_url(url).replace('postgresql+psycopg2://', 'postgresql://', 1)
+    return psycopg2.connect(dsn, **_connect_args(statement_timeout_ms))
+
+
+def raw_cursor(conn):
+    '''
+    A DBAPI (psycopg2) cursor of conn, a SQLAlchemy or psycopg2 connection,
+    for SQL with psycopg2 placeholders (%(name)s).
+    '''
+    return getattr(conn, 'connection', conn).cursor()
+
+
+def query_frame(conn, sql, params=None):
+    '''
+    The result of sql (with psycopg2 placeholders) as a data frame with the
+    column names of the query.
+    '''
+    import pandas as pd
+
+    cursor = raw_cursor(conn)
+    try:
+        cursor.execute(sql, params)
+        return pd.DataFrame(cursor.fetchall(), columns=[column.name for column in cursor.description])
+    finally:
+        cursor.close()
+
+
+def add_arguments(parser):
+    '''
+    The connection options of the command line scripts.
+    '''
+    group = parser.add_argument_group('database')
+    group.add_argument('--database-url', help='SQLAlchemy URL of the database (default: $%s or the libpq '
+                                              'environment PGHOST, PGDATABASE, PGUSER, ...)' % URL_ENV)
+    group.add_argument('--statement-timeout', type=int, metavar='MS',
+                       help='cancel statements running longer than this (default: $%s or none)'
+                            % STATEMENT_TIMEOUT_ENV)
+
+
+def describe(engine):
+    '''
+    The URL (without the password) and the server version of engine.
+    '''
+    from sqlalchemy import text
+
+    with engine.connect() as conn:
+        version = conn.execute(text('SELECT version()')).scalar()
+    return engine.url.render_as_string(hide_password=True), version
+
+
+def run_with_connection(engine, function, *args, **kwargs):
+    '''
+    function(conn, *args, **kwargs) on a pooled connection of engine, which
+    is committed afterwards.
+    '''
+    with engine.connect() as conn:
+        result = function(conn, *args, **kwargs)
+        conn.commit()
+    return result
+
+
+class QueryExecutor:
+    '''
+    Runs functions taking a connection in a thread pool, each on its own
+    pooled connection of engine:
+
+        with QueryExecutor(engine) as executor:
+            q7 = executor.submit(symptom_frequencies)
+            q8 = executor.submit(vaccine_reserve)
+            print(q7.result(), q8.result())
+
+    threads should not exceed the pool size (plus overflow) of engine.
+    '''
+
+    def __init__(self, engine, threads=None):
+        self.engine = engine
+        self.pool = ThreadPoolExecutor(max_workers=threads or engine.pool.size())
+
+    def submit(self, function, *args, **kwargs):
+        return self.pool.submit(run_with_connection, self.engine, function, *args, **kwargs)
+
+    def run_all(self, calls):
+        '''
+        calls is a dict of name -> (function, *args); returns a dict of
+        name -> result once all of them are done.
+        '''
+        futures = {name: self.submit(*call) for name, call in calls.items()}
+        return {name: future.result() for name, future in futures.items()}
+
+    def shutdown(self):
+        self.pool.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+
+
+def run_concurrently(engine, calls, threads=None):
+    '''
+    Run calls (name -> (function, *args), function taking a connection
+    first) at the same time, see QueryExecutor.run_all.
+    '''
+    with QueryExecutor(engine, threads or len(calls)) as executor:
+        return executor.run_all(calls)
+
+
+def _read_query(conn, sql, params=None):
+    import pandas as pd
+    from sqlalchemy import text
+
+    return pd.read_sql_query(text(sql), conn, params=params)
+
+
+def read_queries(engine, queries, threads=None):
+    '''
+    Run the queries (name -> SQL or (SQL, parameters)) at the same time and
+    return a dict of name -> data frame.
+    '''
+    calls = {name: (_read_query,) + (query if isinstance(query, tuple) else (query,))
+             for name, query in queries.items()}
+    return run_concurrently(engine, calls, threads)
@@ -0,0 +1,147 @@
+'''
+Incremental (delta) loading of the workbook into an existing database.
+
+Instead of dropping and re-creating all tables, every incoming sheet is
+copied into a temporary staging table and compared with the target table by
+primary key:
+  - new keys are inserted and rows whose other columns changed are updated
+    (INSERT ... ON CONFLICT DO UPDATE, parents before children),
+  - keys that are no longer in the sheet are deleted with an anti-join
+    (children before parents), except the keys of rows that are only
+    missing because they failed validation (keep, see validation.py).
+Unchanged rows are not touched, so the writes are proportional to the delta.
+Everything happens in one transaction on one connection. The primary keys of
+the changed rows are collected, so that tables derived from the data (see
+derivedTables.py) can be updated for just those keys in the same transaction.
+'''
+import pandas as pd
+
+from bulkLoader import DEFAULT_CHUNK_SIZE, copy_dataframe, quote_ident
+from partitioning import create_partitions, partitioned_tables
+from sqlSchema import dependency_levels
+
+
+def tables_exist(conn, schema):
+    '''
+    True if every table of the parsed schema exists in the database.
+    '''
+    cursor = conn.connection.cursor()
+    try:
+        cursor.execute('SELECT to_regclass(name) IS NOT NULL FROM unnest(%s) AS name', (list(schema),))
+        return all(exists for exists, in cursor.fetchall())
+    finally:
+        cursor.close()
+
+
+def _staging_name(table):
+    return 'stage_' + table
+
+
+def _upsert_sql(table, stage, columns, key, partitioned=False):
+    cols = ', '.join(quote_ident(c) for c in columns)
+    keys = ', '.join(quote_ident(c) for c in key)
+    sql = 'INSERT INTO %s (%s) SELECT DISTINCT ON (%s) %s FROM %s ON CONFLICT (%s) ' % (
+        quote_ident(table), cols, keys, cols, quote_ident(stage), keys)
+
+    others = [c for c in columns if c not in key]
+    if not others:
+        # Every column is part of the key: a row either exists or it doesn't
+        sql += 'DO NOTHING'
+    else:
+        sql += 'DO UPDATE SET %s WHERE (%s) IS DISTINCT FROM (%s)' % (
+            ', '.join('%s = EXCLUDED.%s' % (quote_ident(c), quote_ident(c)) for c in others),
+            ', '.join('%s.%s' % (quote_ident(table), quote_ident(c)) for c in others),
+            ', '.join('EXCLUDED.%s' % quote_ident(c) for c in others))
+    if not partitioned:
+        # xmax is 0 only for freshly inserted rows
+        return sql + ' RETURNING (xmax = 0), %s' % keys
+    # System columns can't be returned from partitioned tables; the main
+    # query still sees the table as it was before the upsert instead
+    match = ' AND '.join('t.%s = u.%s' % (quote_ident(c), quote_ident(c)) for c in key)
+    return 'WITH u AS (%s RETURNING %s) SELECT NOT EXISTS (SELECT 1 FROM %s AS t WHERE %s), %s FROM u' % (
+        sql, keys, quote_ident(table), match, ', '.join('u.%s' % quote_ident(c) for c in key))
+
+
+def _keep_name(table):
+    return 'keep_' + table
+
+
+def _delete_sql(table, stage, key, keep=None):
+    match = ' AND '.join('s.%s = t.%s' % (quote_ident(c), quote_ident(c)) for c in key)
+    sql = 'DELETE FROM %s AS t WHERE NOT EXISTS (SELECT 1 FROM %s AS s WHERE %s)' % (
+        quote_ident(table), quote_ident(stage), match)
+    if keep is not None:
+        sql += ' AND NOT EXISTS (SELECT 1 FROM %s AS s WHERE %s)' % (quote_ident(keep), match)
+    return sql + ' RETURNING %s' % ', '.join('t.%s' % quote_ident(c) for c in key)
+
+
+def apply_delta(frames, conn, schema, delete=True, chunk_size=DEFAULT_CHUNK_SIZE, on_changes=None, keep=None):
+    '''
+    Bring the tables in the database in line with frames (table name ->
+    data frame with the full contents of the table), writing only the rows
+    that differ. With delete=False rows missing from the frames are kept.
+    keep (table name -> data frame of primary keys) lists rows that are
+    kept as they are although they are missing from the frames, e.g. the
+    rows set aside by validation.
+
+    on_changes(conn, changes) is called before committing, with changes a
+    dict of table name -> data frame of the primary keys of the inserted,
+    updated and deleted rows (e.g. derivedTables.refresh_all).
+
+    conn is a SQLAlchemy connection; the changes are committed at the end,
+    or rolled back if anything fails.
+    Returns a dict of table name -> (inserted, updated, deleted).
+    '''
+    order = [table for level in dependency_levels(schema, list(frames)) for table in level]
+    stats = {table: [0, 0, 0] for table in order}
+    keys = {table: [] for table in order}
+    raw = conn.connection
+    cursor = raw.cursor()
+    try:
+        create_partitions(conn, frames)
+        partitioned = partitioned_tables(conn)
+        for table in order:
+            stage = _staging_name(table)
+            cursor.execute('CREATE TEMP TABLE %s (LIKE %s) ON COMMIT DROP' % (
+                quote_ident(stage), quote_ident(table)))
+            copy_dataframe(frames[table], stage, conn, chunk_size=chunk_size)
+            cursor.execute('ANALYZE %s' % quote_ident(stage))
+        keep = {table: df for table, df in (keep or {}).items() if table in stats and len(df)}
+        for table, df in keep.items():
+            cursor.execute('CREATE TEMP TABLE %s ON COMMIT DROP AS SELECT %s FROM %s WITH NO DATA' % (
+                quote_ident(_keep_name(table)), ', '.join(quote_ident(c) for c in df.columns),
+                quote_ident(table)))
+            copy_dataframe(df, _keep_name(table), conn, chunk_size=chunk_size)
+
+        for table in order:
+            columns = list(frames[table].columns)
+            cursor.execute(_upsert_sql(table, _staging_name(table), columns, schema[table].primary_key,
+                                       table in partitioned))
+            for inserted, *key in cursor.fetchall():
+                stats[table][0 if inserted else 1] += 1
+                keys[table].append(key)
+
+        if delete:
+            for table in reversed(order):
+                cursor.execute(_delete_sql(table, _staging_name(table), schema[table].primary_key,
+                                           _keep_name(table) if table in keep else None))
+                deleted = cursor.fetchall()
+                stats[table][2] = len(deleted)
+                keys[table].extend(deleted)
+
+        if on_changes is not None:
+            changes = {table: pd.DataFrame([tuple(k) for k in rows], columns=schema[table].primary_key)
+                       for table, rows in keys.items() if rows}
+            on_changes(conn, changes)
+
+        raw.commit()
+    except Exception:
+        raw.rollback()
+        raise
+    finally:
+        cursor.close()
+
+    for table in order:
+        inserted, updated, deleted = stats[table]
+        print(f'{table}: {inserted} inserted, {updated} updated, {deleted} deleted')
+    return {table: tuple(counts) for table, counts in stats.items()}
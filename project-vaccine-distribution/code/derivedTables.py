@@ -0,0 +1,282 @@
+'''
+Tables derived from the loaded data, kept up to date by the loader.
+
+After a full load every derived table is rebuilt (rebuild_all). After an
+incremental load only the rows affected by the changed keys are recomputed
+(refresh_all, which deltaLoader.apply_delta calls before committing). New
+derived tables are added to DERIVED_TABLES.
+
+Vaccination rollup (Part 3 requirement 9):
+  - patient_vaccination_progress: one row per vaccinated patient with the
+    date, hospital and vaccine type of the first dose and the date and
+    hospital of the dose that completed the series, i.e. the dose number
+    vaccine_type.doses of the vaccine type of the first dose (NULL if not
+    completed yet),
+  - vaccination_daily: the number of first doses and completed series per
+    date, hospital and vaccine type.
+The cumulative vaccination curves are computed from vaccination_daily,
+which has one row per day and hospital instead of one per dose.
+
+Dose reserve (Part 3 requirement 8): event_participation and reserve_stats,
+see reserveEstimator.py.
+
+Queries 5 and 6: patient_status and the view hospital_inventory, see
+summaryTables.py.
+
+  python derivedTables.py [--database-url URL] rebuild
+  python derivedTables.py [--database-url URL] plot [--out ../img/part3_req9.png]
+'''
+import argparse
+from collections import namedtuple
+from pathlib import Path
+
+import pandas as pd
+
+import dbConnection
+from dbConnection import create_pool, raw_cursor
+from reserveEstimator import rebuild_reserve_stats, refresh_reserve_stats
+from summaryTables import (create_inventory_view, rebuild_patient_status, refresh_inventory_view,
+                           refresh_patient_status)
+
+DerivedTable = namedtuple('DerivedTable', ['name', 'tables', 'rebuild', 'refresh'])
+
+CREATE_ROLLUP = """
+    DROP TABLE IF EXISTS patient_vaccination_progress, vaccination_daily;
+
+    CREATE TABLE patient_vaccination_progress (
+        patient            TEXT NOT NULL,
+        doses              INT NOT NULL,
+        first_date         DATE NOT NULL,
+        first_hospital     TEXT NOT NULL,
+        vaccine_type       TEXT NOT NULL,
+        completed_date     DATE,
+        completed_hospital TEXT,
+
+        PRIMARY KEY(patient)
+    );
+
+    CREATE TABLE vaccination_daily (
+        date         DATE NOT NULL,
+        hospital     TEXT NOT NULL,
+        vaccine_type TEXT NOT NULL,
+        first_doses  INT NOT NULL,
+        completions  INT NOT NULL,
+
+        PRIMARY KEY(date, hospital, vaccine_type)
+    );
+
+    CREATE INDEX patient_vaccination_progress_first ON patient_vaccination_progress (first_date);
+    CREATE INDEX patient_vaccination_progress_completed ON patient_vaccination_progress (completed_date)
+"""
+
+# {where} limits the patients
+PROGRESS = """
+    INSERT INTO patient_vaccination_progress
+    WITH doses AS (
+        SELECT vp.patient, vp.date, vp.hospital, batch.vaccine_type,
+            ROW_NUMBER() OVER (PARTITION BY vp.patient ORDER BY vp.date) AS dose,
+            COUNT(*) OVER (PARTITION BY vp.patient) AS doses
+        FROM vaccine_patient AS vp
+        JOIN vaccination_event AS ve ON ve.date = vp.date AND ve.hospital = vp.hospital
+        JOIN batch ON batch.id = ve.batch
+        {where}
+    )
+    SELECT first.patient, first.doses, first.date, first.hospital, first.vaccine_type,
+        completed.date, completed.hospital
+    FROM doses AS first
+    JOIN vaccine_type AS vt ON vt.id = first.vaccine_type
+    LEFT JOIN doses AS completed ON completed.patient = first.patient AND completed.dose = vt.doses
+    WHERE first.dose = 1
+"""
+
+# {first} and {completed} limit the dates
+DAILY = """
+    INSERT INTO vaccination_daily (date, hospital, vaccine_type, first_doses, completions)
+    SELECT date, hospital, vaccine_type, SUM(first_doses), SUM(completions)
+    FROM (
+        SELECT first_date AS date, first_hospital AS hospital, vaccine_type, 1 AS first_doses, 0 AS completions
+        FROM patient_vaccination_progress
+        {first}
+        UNION ALL
+        SELECT completed_date, completed_hospital, vaccine_type, 0, 1
+        FROM patient_vaccination_progress
+        WHERE completed_date IS NOT NULL {completed}
+    ) AS counts
+    GROUP BY date, hospital, vaccine_type
+"""
+
+AFFECTED_DATES = """
+    SELECT first_date FROM patient_vaccination_progress WHERE patient = ANY(%(patients)s)
+    UNION
+    SELECT completed_date FROM patient_vaccination_progress
+    WHERE patient = ANY(%(patients)s) AND completed_date IS NOT NULL
+"""
+
+CURVES = """
+    SELECT date, SUM(first_doses) AS vaccinated, SUM(completions) AS completed
+    FROM vaccination_daily
+    GROUP BY date
+    ORDER BY date
+"""
+
+
+def table_exists(conn, table):
+    cursor = raw_cursor(conn)
+    try:
+        cursor.execute('SELECT to_regclass(%s) IS NOT NULL', (table,))
+        return cursor.fetchone()[0]
+    finally:
+        cursor.close()
+
+
+def rebuild_vaccination_rollup(conn):
+    '''
+    Create patient_vaccination_progress and vaccination_daily from scratch.
+    '''
+    cursor = raw_cursor(conn)
+    try:
+        cursor.execute(CREATE_ROLLUP)
+        cursor.execute(PROGRESS.format(where=''))
+        cursor.execute(DAILY.format(first='', completed=''))
+        cursor.execute('ANALYZE patient_vaccination_progress; ANALYZE vaccination_daily')
+    finally:
+        cursor.close()
+
+
+def refresh_vaccination_rollup(conn, changes):
+    '''
+    Recompute the rollup for the patients whose vaccinations changed and
+    for the dates their first or completing doses were (or are) on.
+    Changes to events, batches or vaccine types can move doses of many
+    patients, so they rebuild the rollup.
+    '''
+    if any(len(changes.get(table, ())) for table in ['vaccination_event', 'batch', 'vaccine_type']):
+        rebuild_vaccination_rollup(conn)
+        return
+    if 'vaccine_patient' not in changes or not len(changes['vaccine_patient']):
+        return
+
+    params = {'patients': sorted(set(changes['vaccine_patient']['patient']))}
+    cursor = raw_cursor(conn)
+    try:
+        cursor.execute(AFFECTED_DATES, params)
+        dates = {date for date, in cursor.fetchall()}
+        cursor.execute('DELETE FROM patient_vaccination_progress WHERE patient = ANY(%(patients)s)', params)
+        cursor.execute(PROGRESS.format(where='WHERE vp.patient = ANY(%(patients)s)'), params)
+        cursor.execute(AFFECTED_DATES, params)
+        dates.update(date for date, in cursor.fetchall())
+
+        params = {'dates': sorted(dates)}
+        cursor.execute('DELETE FROM vaccination_daily WHERE date = ANY(%(dates)s::date[])', params)
+        cursor.execute(DAILY.format(first='WHERE first_date = ANY(%(dates)s::date[])',
+                                    completed='AND completed_date = ANY(%(dates)s::date[])'), params)
+    finally:
+        cursor.close()
+
+
+DERIVED_TABLES = [
+    DerivedTable('vaccination rollup', ['patient_vaccination_progress', 'vaccination_daily'],
+                 rebuild_vaccination_rollup, refresh_vaccination_rollup),
+    DerivedTable('dose reserve', ['event_participation', 'reserve_stats'],
+                 rebuild_reserve_stats, refresh_reserve_stats),
+    DerivedTable('patient status', ['patient_status'], rebuild_patient_status, refresh_patient_status),
+    DerivedTable('hospital inventory', ['hospital_inventory'], create_inventory_view, refresh_inventory_view),
+]
+
+
+def rebuild_all(conn):
+    '''
+    Rebuild every derived table (after a full load). Not committed.
+    '''
+    for derived in DERIVED_TABLES:
+        derived.rebuild(conn)
+
+
+def refresh_all(conn, changes):
+    '''
+    Bring the derived tables up to date after an incremental load. changes
+    is a dict of table name -> data frame of the changed primary keys (see
+    deltaLoader.apply_delta). Derived tables that don't exist yet are
+    built. Not committed.
+    '''
+    for derived in DERIVED_TABLES:
+        if all(table_exists(conn, table) for table in derived.tables):
+            derived.refresh(conn, changes)
+        else:
+            derived.rebuild(conn)
+
+
+def ensure_built(conn):
+    '''
+    Build (and commit) the derived tables that don't exist, e.g. after the
+    schema was created again.
+    '''
+    missing = [derived for derived in DERIVED_TABLES
+               if not all(table_exists(conn, table) for table in derived.tables)]
+    for derived in missing:
+        derived.rebuild(conn)
+    if missing:
+        getattr(conn, 'connection', conn).commit()
+
+
+def vaccination_curves(conn):
+    '''
+    Part 3 requirement 9: cumulative number of vaccinated patients and of
+    patients with a completed series per day, as two data frames indexed by
+    date (columns vaccinated and completed). The rollup must exist (see
+    ensure_built).
+    '''
+    cursor = raw_cursor(conn)
+    try:
+        cursor.execute(CURVES)
+        daily = pd.DataFrame(cursor.fetchall(), columns=['date', 'vaccinated', 'completed'])
+    finally:
+        cursor.close()
+    daily['date'] = pd.to_datetime(daily['date'])
+    daily = daily.set_index('date').astype('int64').cumsum()
+    completed = daily.loc[daily['completed'] > 0, ['completed']]
+    return daily[['vaccinated']], completed
+
+
+def plot_vaccination_curves(vaccinated, completed, path):
+    '''
+    Plot the curves of vaccination_curves into the image file at path. Uses
+    a matplotlib Figure directly, so no display (or pyplot) is needed.
+    '''
+    from matplotlib.figure import Figure
+
+    figure = Figure(figsize=(8, 5))
+    ax = figure.subplots()
+    vaccinated.plot(ax=ax)
+    completed.plot(ax=ax)
+    ax.set_ylabel('patients')
+    figure.savefig(path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Maintain the tables derived from the loaded data.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('rebuild', help='rebuild every derived table')
+    plot = commands.add_parser('plot', help='plot the cumulative vaccination curves (requirement 9)')
+    plot.add_argument('--out', default=str(Path(__file__).parent.parent / 'img' / 'part3_req9.png'),
+                      help='image file (default: %(default)s)')
+    dbConnection.add_arguments(parser)
+    args = parser.parse_args(argv)
+
+    engine = create_pool(args.database_url, pool_size=1, statement_timeout_ms=args.statement_timeout)
+    try:
+        with engine.connect() as conn:
+            if args.command == 'rebuild':
+                rebuild_all(conn)
+                conn.connection.commit()
+                print('Derived tables rebuilt')
+            else:
+                ensure_built(conn)
+                plot_vaccination_curves(*vaccination_curves(conn), args.out)
+                print(f'Plot written to {args.out}')
+    finally:
+        engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
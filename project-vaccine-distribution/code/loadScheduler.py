@@ -0,0 +1,80 @@
+'''
+Parallel loading of tables in foreign key order.
+
+The tables are grouped into dependency levels derived from the foreign keys
+of the schema (see sqlSchema.dependency_levels). All tables of one level are
+loaded at the same time, each over its own pooled connection and inside its
+own transaction. When every table of the level has been loaded the
+transactions are committed, so the next level sees its referenced rows.
+'''
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bulkLoader import DEFAULT_CHUNK_SIZE, load_dataframe
+from partitioning import create_partitions
+from profiling import stage
+from sqlSchema import dependency_levels
+
+# Number of tables loaded at the same time.
+DEFAULT_WORKERS = 4
+
+
+def _load_table(engine, table, df, method, chunk_size):
+    '''
+    Load one table over a new connection without committing.
+    Returns (connection, rows, seconds).
+    '''
+    conn = engine.connect()
+    try:
+        start = time.perf_counter()
+        with stage('load ' + table, rows_in=len(df)) as current:
+            rows = current.rows_out = load_dataframe(df, table, conn, method=method, chunk_size=chunk_size)
+        return conn, rows, time.perf_counter() - start
+    except Exception:
+        conn.close()
+        raise
+
+
+def load_tables(frames, engine, schema, workers=DEFAULT_WORKERS, method='copy',
+                chunk_size=DEFAULT_CHUNK_SIZE):
+    '''
+    Load the data frames in frames (table name -> data frame) into the
+    database, running independent tables in parallel on up to workers pooled
+    connections of engine. schema is the parsed schema from sqlSchema.
+
+    If loading a table fails, the whole level is rolled back and the error
+    is raised; levels committed before that stay in the database.
+    Returns a dict of table name -> (rows, seconds).
+    '''
+    stats = {}
+    # Partitions lock their parent table, so they are created up front
+    with engine.connect() as conn:
+        create_partitions(conn, frames, commit=True)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for level in dependency_levels(schema, list(frames)):
+            futures = {table: pool.submit(_load_table, engine, table, frames[table], method, chunk_size)
+                       for table in level}
+
+            loaded, error = {}, None
+            for table, future in futures.items():
+                try:
+                    loaded[table] = future.result()
+                except Exception as e:
+                    error = error or e
+
+            for table, (conn, rows, seconds) in loaded.items():
+                # COPY goes through the psycopg2 cursor directly, so the
+                # transaction is finished on the DBAPI connection.
+                if error is None:
+                    conn.connection.commit()
+                    stats[table] = (rows, seconds)
+                else:
+                    conn.connection.rollback()
+                conn.close()
+
+            if error is not None:
+                raise error
+            for table in level:
+                rows, seconds = stats[table]
+                print(f'Loaded {rows} rows into {table} in {seconds:.2f} s')
+    return stats
@@ -0,0 +1,165 @@
+'''
+Monthly range partitioning of the event tables.
+
+vaccination_event, vaccine_patient and diagnosis grow with every day of
+vaccinations and are mostly queried for a date window (query 1's single
+day, query 4's diagnoses after a date, requirement 10's ten days). With
+create_schema(conn, partitioned=True) they are created as tables partitioned
+by RANGE (date), with one partition per month (e.g. vaccine_patient_2021_05).
+Their primary keys already include the date, so the keys and foreign keys
+stay the same, and the indexes of sqlIndexes.sql are created on every
+partition.
+
+PostgreSQL routes the rows written into the parent table to the partition
+of their month; create_partitions creates the partitions a load needs
+before the rows are copied (loadScheduler, deltaLoader, dataGenerator). A
+query only reads the partitions of its window when the date column is
+compared with constants or parameters (date = '2021-05-10',
+date BETWEEN %(start)s AND %(end)s) and not wrapped in an expression.
+
+  python partitioning.py [--database-url URL]
+'''
+import argparse
+import re
+from pathlib import Path
+
+import pandas as pd
+
+import dbConnection
+from sqlRunner import read_statements, run_statements
+
+SCHEMA_FILE = Path(__file__).parent / 'sqlCreatingDatabase.sql'
+
+# table -> partition key (a DATE column that is part of the primary key)
+PARTITIONED_TABLES = {
+    'vaccination_event': 'date',
+    'vaccine_patient': 'date',
+    'diagnosis': 'date',
+}
+
+_CREATE_TABLE = re.compile(r'^CREATE\s+TABLE\s+(\w+)\s*\(', re.IGNORECASE)
+
+_PARTITIONED = """
+    SELECT c.relname
+    FROM pg_partitioned_table AS p
+    JOIN pg_class AS c ON c.oid = p.partrelid
+    WHERE c.relname = ANY(%s) AND pg_table_is_visible(c.oid)
+"""
+
+_PARTITIONS = """
+    SELECT c.relname
+    FROM pg_inherits AS i
+    JOIN pg_class AS c ON c.oid = i.inhrelid
+    WHERE i.inhparent = to_regclass(%s)
+    ORDER BY c.relname
+"""
+
+
+def schema_statements(file_path=SCHEMA_FILE, partitioned=False):
+    '''
+    Statements of the schema script; with partitioned=True the tables of
+    PARTITIONED_TABLES are created as partitioned tables (without any
+    partitions).
+    '''
+    statements = read_statements(file_path)
+    if not partitioned:
+        return statements
+    for i, sql in enumerate(statements):
+        match = _CREATE_TABLE.match(sql)
+        if match and match.group(1).lower() in PARTITIONED_TABLES:
+            statements[i] = '%s PARTITION BY RANGE (%s)' % (sql, PARTITIONED_TABLES[match.group(1).lower()])
+    return statements
+
+
+def create_schema(conn, file_path=SCHEMA_FILE, partitioned=False):
+    '''
+    (Re)create the tables in one transaction, see schema_statements. Raises
+    sqlRunner.SqlScriptError if a statement fails.
+    '''
+    return run_statements(schema_statements(file_path, partitioned), conn)
+
+
+def partition_name(table, month):
+    return '%s_%04d_%02d' % (table, month.year, month.month)
+
+
+def partitioned_tables(conn):
+    '''
+    The tables of PARTITIONED_TABLES that are partitioned in the database.
+    '''
+    cursor = getattr(conn, 'connection', conn).cursor()
+    try:
+        cursor.execute(_PARTITIONED, (list(PARTITIONED_TABLES),))
+        return {name for name, in cursor.fetchall()}
+    finally:
+        cursor.close()
+
+
+def partitions(conn, table):
+    '''
+    Names of the partitions of table.
+    '''
+    cursor = getattr(conn, 'connection', conn).cursor()
+    try:
+        cursor.execute(_PARTITIONS, (table,))
+        return [name for name, in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+
+def create_partitions(conn, frames, commit=False):
+    '''
+    Create the missing monthly partitions for the rows in frames (table name
+    -> data frame) of the tables that are partitioned in the database.
+    Nothing happens for unpartitioned tables. Creating a partition locks
+    the parent table, so loads over several connections create them first
+    (commit=True commits on conn).
+    Returns the names of the created partitions.
+    '''
+    tables = [table for table in PARTITIONED_TABLES if table in frames]
+    partitioned = partitioned_tables(conn) if tables else set()
+    raw = getattr(conn, 'connection', conn)
+    created = []
+    cursor = raw.cursor()
+    try:
+        for table in tables:
+            if table not in partitioned:
+                continue
+            dates = pd.to_datetime(frames[table][PARTITIONED_TABLES[table]]).dropna()
+            existing = set(partitions(conn, table))
+            for month in sorted(dates.dt.to_period('M').unique()):
+                name = partition_name(table, month)
+                if name in existing:
+                    continue
+                start = month.start_time.date()
+                end = (month + 1).start_time.date()
+                cursor.execute('CREATE TABLE "%s" PARTITION OF "%s" FOR VALUES FROM (%%s) TO (%%s)' % (name, table),
+                               (start, end))
+                created.append(name)
+        if commit:
+            raw.commit()
+    finally:
+        cursor.close()
+    return created
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Show the monthly partitions of the event tables.')
+    dbConnection.add_arguments(parser)
+    args = parser.parse_args(argv)
+
+    conn = dbConnection.connect(args.database_url, args.statement_timeout)
+    try:
+        partitioned = partitioned_tables(conn)
+        for table in PARTITIONED_TABLES:
+            if table not in partitioned:
+                print(f'{table}: not partitioned')
+                continue
+            names = partitions(conn, table)
+            print(f"{table}: {len(names)} partitions {', '.join(names)}")
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
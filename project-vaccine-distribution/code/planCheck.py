@@ -0,0 +1,195 @@
+'''
+EXPLAIN based plan regression check for the project's queries.
+
+Every query of sqlQueries.sql, the symptom frequencies of requirement 7
+(symptomFrequency.py), the event participations of requirement 8
+(reserveEstimator.py), the vaccination curves of requirement 9
+(derivedTables.py) and the contact tracing query of requirement 10 are run
+with EXPLAIN (ANALYZE, BUFFERS). The plan cost, execution time, buffer
+usage and sequential scans are stored as a baseline (JSON). Later runs are
+compared against the baseline and the check fails when
+  - a query reads a large table with a sequential scan,
+  - the estimated plan cost grew by more than the cost tolerance,
+  - the execution time grew by more than the time tolerance.
+Each query runs in its own transaction, which is rolled back afterwards.
+'''
+import argparse
+import hashlib
+import json
+import re
+import sys
+from pathlib import Path
+
+import contactTracing
+import dbConnection
+import derivedTables
+import reserveEstimator
+import symptomFrequency
+from sqlRunner import read_statements
+
+CODE_DIR = Path(__file__).parent
+DEFAULT_BASELINE = CODE_DIR.parent / 'database' / 'plan_baseline.json'
+
+_CREATE_VIEW = re.compile(r'^CREATE\s+(?:OR\s+REPLACE\s+)?VIEW\s+\S+\s+AS\s+(.*)$', re.IGNORECASE | re.DOTALL)
+
+
+def collect_queries():
+    '''
+    Dict of query name -> SQL (or (SQL, parameters)) of the queries to
+    check. CREATE VIEW statements are checked through the SELECT of the view.
+    '''
+    queries = {}
+    for i, sql in enumerate(read_statements(CODE_DIR / 'sqlQueries.sql'), start=1):
+        match = _CREATE_VIEW.match(sql)
+        queries['sqlQueries.sql #%d' % i] = match.group(1) if match else sql
+    queries['symptom_frequencies'] = (symptomFrequency.FREQUENCIES.strip(), symptomFrequency.query_params())
+    queries['event_participation'] = reserveEstimator.EVENT_PARTICIPATION.format(where='').strip()
+    queries['vaccination_curves'] = derivedTables.CURVES.strip()
+    queries['contact_tracing'] = (contactTracing.CONTACTS.strip(),
+                                  contactTracing.query_params(**contactTracing.REQUIREMENT_10))
+    return queries
+
+
+def _walk(node):
+    yield node
+    for child in node.get('Plans', []):
+        yield from _walk(child)
+
+
+def summarize(plan):
+    '''
+    The numbers of an EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) plan that are
+    compared against the baseline.
+    '''
+    root = plan['Plan']
+    seq_scans = {}
+    for node in _walk(root):
+        if node['Node Type'] == 'Seq Scan':
+            scanned = (node.get('Actual Rows', 0) + node.get('Rows Removed by Filter', 0)) * node.get('Actual Loops', 1)
+            relation = node['Relation Name']
+            seq_scans[relation] = seq_scans.get(relation, 0) + scanned
+    return {
+        'total_cost': root['Total Cost'],
+        'execution_ms': plan['Execution Time'],
+        'planning_ms': plan['Planning Time'],
+        'shared_hit_blocks': root.get('Shared Hit Blocks', 0),
+        'shared_read_blocks': root.get('Shared Read Blocks', 0),
+        'seq_scans': seq_scans,
+    }
+
+
+def explain(conn, sql, params=None):
+    '''
+    Run EXPLAIN (ANALYZE, BUFFERS) for sql (with the query parameters
+    params) over the psycopg2 connection conn and return the plan as a dict.
+    The transaction is rolled back.
+    '''
+    cursor = conn.cursor()
+    try:
+        cursor.execute('EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) ' + sql, params)
+        plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return plan[0]
+    finally:
+        cursor.close()
+        conn.rollback()
+
+
+def run(conn, queries):
+    '''
+    Explain every query. Returns a dict of query name -> result, where a
+    result holds the hash of the SQL, the summary and the full plan.
+    '''
+    results = {}
+    for name, sql in queries.items():
+        sql, params = sql if isinstance(sql, tuple) else (sql, None)
+        plan = explain(conn, sql, params)
+        results[name] = {
+            'sql_hash': hashlib.sha1(sql.encode('utf-8')).hexdigest(),
+            'summary': summarize(plan),
+            'plan': plan,
+        }
+    return results
+
+
+def check(results, baseline, cost_tolerance=0.2, time_tolerance=1.0, min_time_ms=5.0, seq_scan_rows=10000):
+    '''
+    Compare results against baseline (same format, may be empty).
+    Returns a list of (query name, problem) pairs.
+    '''
+    problems = []
+    for name, result in results.items():
+        summary = result['summary']
+        base = baseline.get(name)
+        comparable = base is not None and base['sql_hash'] == result['sql_hash']
+        base_scans = base['summary']['seq_scans'] if comparable else {}
+
+        for relation, rows in summary['seq_scans'].items():
+            if rows >= seq_scan_rows:
+                new = ' (new)' if comparable and relation not in base_scans else ''
+                problems.append((name, f'sequential scan of {relation} reading {rows:.0f} rows{new}'))
+
+        if not comparable:
+            continue
+        old = base['summary']
+        if summary['total_cost'] > old['total_cost'] * (1 + cost_tolerance):
+            problems.append((name, f"plan cost {old['total_cost']:.1f} -> {summary['total_cost']:.1f}"))
+        if summary['execution_ms'] > old['execution_ms'] * (1 + time_tolerance) \
+                and summary['execution_ms'] - old['execution_ms'] >= min_time_ms:
+            problems.append((name, f"execution time {old['execution_ms']:.2f} ms -> {summary['execution_ms']:.2f} ms"))
+    return problems
+
+
+def load_baseline(path):
+    path = Path(path)
+    if not path.exists():
+        return {}
+    with open(path, 'r') as file:
+        return json.load(file)
+
+
+def save_baseline(path, results):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w') as file:
+        json.dump(results, file, indent=2, sort_keys=True, default=str)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Check query plans against a stored baseline.')
+    parser.add_argument('--baseline', default=str(DEFAULT_BASELINE), help='baseline file (default: %(default)s)')
+    parser.add_argument('--update-baseline', action='store_true', help='store the plans of this run as the baseline')
+    parser.add_argument('--cost-tolerance', type=float, default=0.2,
+                        help='allowed relative growth of the plan cost (default: %(default)s)')
+    parser.add_argument('--time-tolerance', type=float, default=1.0,
+                        help='allowed relative growth of the execution time (default: %(default)s)')
+    parser.add_argument('--seq-scan-rows', type=int, default=10000,
+                        help='flag sequential scans reading at least this many rows (default: %(default)s)')
+    dbConnection.add_arguments(parser)
+    args = parser.parse_args(argv)
+
+    conn = dbConnection.connect(args.database_url, args.statement_timeout)
+    try:
+        results = run(conn, collect_queries())
+    finally:
+        conn.close()
+
+    for name, result in results.items():
+        summary = result['summary']
+        print(f"{name:<22} cost {summary['total_cost']:>12.1f}  time {summary['execution_ms']:>9.2f} ms  "
+              f"seq scans: {', '.join(sorted(summary['seq_scans'])) or '-'}")
+
+    problems = check(results, load_baseline(args.baseline), cost_tolerance=args.cost_tolerance,
+                     time_tolerance=args.time_tolerance, seq_scan_rows=args.seq_scan_rows)
+    for name, problem in problems:
+        print(f'REGRESSION {name}: {problem}')
+
+    if args.update_baseline:
+        save_baseline(args.baseline, results)
+        print(f'Baseline written to {args.baseline}')
+    return 1 if problems else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,423 @@
+'''
+Profiling of the load and analysis stages.
+
+The steps of sqlPython.py and databaseAnalysis.py are wrapped in stages:
+
+    with stage('read workbook') as current:
+        sheets = read_workbook(excel_file)
+        current.rows_out = sum(len(df) for df in sheets.values())
+
+or, for a function, @traced('name'). While a Profiler is active every stage
+records
+  - its wall time and the CPU time of its thread,
+  - the rows it got and produced (rows_in / rows_out, set by the caller;
+    @traced counts the rows of the result),
+  - the peak memory allocated by Python during the stage (tracemalloc; it
+    is one counter for the process, so stages running at the same time in
+    other threads are included),
+  - every SQL statement executed during the stage, with its round trip time
+    (through the cursors of instrumented connections, see
+    Profiler.instrument).
+Without an active profiler stages cost next to nothing. The records are
+written as JSON (write_json) or in the Chrome trace event format
+(write_trace, open in chrome://tracing or https://ui.perfetto.dev). With
+pg_stat_statements installed in the database the server side execution
+time of every statement of the run can be added (snapshot_statements /
+statement_deltas).
+'''
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import pandas as pd
+import psycopg2.extensions
+
+# Longest SQL text kept per statement
+MAX_SQL_LENGTH = 2000
+
+_active = None
+
+_PG_STAT_STATEMENTS = """
+    SELECT queryid, query, calls, total_exec_time, rows
+    FROM pg_stat_statements
+    WHERE dbid = (SELECT oid FROM pg_database WHERE datname = current_database())
+"""
+
+
+def count_rows(result):
+    '''
+    Number of rows of a result: data frames and series count their rows,
+    tuples, lists and dicts the rows of their items, anything else is None.
+    '''
+    if isinstance(result, (pd.DataFrame, pd.Series)):
+        return len(result)
+    if isinstance(result, (tuple, list)):
+        counts = [count_rows(r) for r in result]
+    elif isinstance(result, dict):
+        counts = [count_rows(r) for r in result.values()]
+    else:
+        return None
+    counts = [c for c in counts if c is not None]
+    return sum(counts) if counts else None
+
+
+class Stage:
+    '''
+    A running (or finished) stage. Callers set rows_in and rows_out.
+    '''
+
+    def __init__(self, name, rows_in=None, args=None):
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.args = args or {}
+        self.statements = []
+        self.child_peak = 0
+
+    def record(self, parent, start, wall, cpu, peak):
+        return {
+            'name': self.name,
+            'parent': parent,
+            'thread': threading.current_thread().name,
+            'pid': os.getpid(),
+            'start': start,
+            'wall': wall,
+            'cpu': cpu,
+            'rows_in': self.rows_in,
+            'rows_out': self.rows_out,
+            'peak_mb': None if peak is None else peak / 1024 ** 2,
+            'statements': self.statements,
+            'args': self.args,
+        }
+
+
+class Profiler:
+    '''
+    Collects the records of the stages run while it is active (with
+    profiler: ... or start() / stop()). Only one profiler is active at a
+    time.
+    '''
+
+    def __init__(self, trace_memory=True):
+        self.trace_memory = trace_memory
+        self.records = []
+        self.statements = []
+        self.started = None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def start(self):
+        global _active
+        self.started = time.time()
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        _active = self
+        return self
+
+    def stop(self):
+        global _active
+        if _active is self:
+            _active = None
+        if self.trace_memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def add(self, records):
+        '''
+        Add records measured elsewhere (e.g. in a worker process, see
+        run_profiled).
+        '''
+        with self._lock:
+            self.records.extend(records)
+
+    @contextmanager
+    def stage(self, name, rows_in=None, **args):
+        stack = self._stack()
+        current = Stage(name, rows_in, args)
+        parent = stack[-1].name if stack else None
+        if self.trace_memory and tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        stack.append(current)
+        start, wall, cpu = time.time(), time.perf_counter(), time.thread_time()
+        try:
+            yield current
+        finally:
+            wall, cpu = time.perf_counter() - wall, time.thread_time() - cpu
+            stack.pop()
+            peak = None
+            if self.trace_memory and tracemalloc.is_tracing():
+                # The peak counter was reset by the nested stages, which
+                # pass their peaks up
+                peak = max(tracemalloc.get_traced_memory()[1], current.child_peak)
+                if stack:
+                    stack[-1].child_peak = max(stack[-1].child_peak, peak)
+            self.add([current.record(parent, start, wall, cpu, peak)])
+
+    def statement(self, sql, seconds, rows):
+        '''
+        Record a statement executed by an instrumented cursor in the current
+        stage of this thread.
+        '''
+        if isinstance(sql, bytes):
+            sql = sql.decode('utf-8', 'replace')
+        entry = {'sql': ' '.join(str(sql).split())[:MAX_SQL_LENGTH], 'seconds': seconds, 'rows': rows,
+                 'end': time.time()}
+        stack = self._stack()
+        if stack:
+            stack[-1].statements.append(entry)
+        else:
+            with self._lock:
+                self.statements.append(entry)
+
+    def instrument(self, target):
+        '''
+        Record the statements of target: a psycopg2 connection, or a
+        SQLAlchemy engine (all of its new connections). Cursors created
+        through SQLAlchemy, pandas or directly on the DBAPI connection are
+        all covered.
+        '''
+        if isinstance(target, psycopg2.extensions.connection):
+            target.cursor_factory = TracingCursor
+            return target
+        from sqlalchemy import event
+
+        @event.listens_for(target, 'connect')
+        def _connect(dbapi_connection, connection_record):
+            dbapi_connection.cursor_factory = TracingCursor
+        return target
+
+    def summary(self):
+        '''
+        One line per stage in the order they finished.
+        '''
+        lines = [f"{'stage':<36} {'wall s':>9} {'cpu s':>9} {'rows in':>9} {'rows out':>9} "
+                 f"{'peak MB':>8} {'sql':>5} {'sql s':>8}"]
+        for r in sorted(self.records, key=lambda r: r['start'] + r['wall']):
+            sql_seconds = sum(s['seconds'] for s in r['statements'])
+            lines.append(f"{r['name'][:36]:<36} {r['wall']:>9.3f} {r['cpu']:>9.3f} "
+                         f"{_count(r['rows_in']):>9} {_count(r['rows_out']):>9} "
+                         f"{'' if r['peak_mb'] is None else format(r['peak_mb'], '.1f'):>8} "
+                         f"{len(r['statements']):>5} {sql_seconds:>8.3f}")
+        return '\n'.join(lines)
+
+    def to_dict(self, pg_stat_statements=None):
+        return {
+            'started': self.started,
+            'stages': self.records,
+            'statements': self.statements,
+            'pg_stat_statements': pg_stat_statements,
+        }
+
+    def write_json(self, path, pg_stat_statements=None):
+        with open(path, 'w') as file:
+            json.dump(self.to_dict(pg_stat_statements), file, indent=2, default=str)
+
+    def trace_events(self):
+        '''
+        The stages and their statements as Chrome trace events (complete
+        events, times in microseconds from the start of the profiler).
+        '''
+        origin = self.started or min((r['start'] for r in self.records), default=0)
+        threads = {}
+        events = []
+        for r in self.records:
+            tid = threads.setdefault((r['pid'], r['thread']), len(threads) + 1)
+            args = {key: r[key] for key in ['rows_in', 'rows_out', 'peak_mb', 'cpu'] if r[key] is not None}
+            args.update(r['args'])
+            events.append({'name': r['name'], 'cat': 'stage', 'ph': 'X', 'pid': r['pid'], 'tid': tid,
+                           'ts': (r['start'] - origin) * 1e6, 'dur': r['wall'] * 1e6, 'args': args})
+            for s in r['statements']:
+                events.append({'name': s['sql'][:60], 'cat': 'sql', 'ph': 'X', 'pid': r['pid'], 'tid': tid,
+                               'ts': (s['end'] - s['seconds'] - origin) * 1e6, 'dur': s['seconds'] * 1e6,
+                               'args': {'sql': s['sql'], 'rows': s['rows']}})
+        for (pid, thread), tid in threads.items():
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': thread}})
+        return events
+
+    def write_trace(self, path):
+        with open(path, 'w') as file:
+            json.dump({'traceEvents': self.trace_events(), 'displayTimeUnit': 'ms'}, file, default=str)
+
+
+def _count(rows):
+    return '' if rows is None else rows
+
+
+class TracingCursor(psycopg2.extensions.cursor):
+    '''
+    psycopg2 cursor that reports every statement to the active profiler.
+    '''
+
+    def _traced(self, sql, call):
+        profiler = _active
+        if profiler is None:
+            return call()
+        start = time.perf_counter()
+        try:
+            return call()
+        finally:
+            profiler.statement(sql, time.perf_counter() - start, self.rowcount)
+
+    def execute(self, query, vars=None):
+        return self._traced(query, lambda: super(TracingCursor, self).execute(query, vars))
+
+    def executemany(self, query, vars_list):
+        return self._traced(query, lambda: super(TracingCursor, self).executemany(query, vars_list))
+
+    def copy_expert(self, sql, file, size=8192):
+        return self._traced(sql, lambda: super(TracingCursor, self).copy_expert(sql, file, size))
+
+
+def active():
+    '''
+    The active profiler or None.
+    '''
+    return _active
+
+
+@contextmanager
+def stage(name, rows_in=None, **args):
+    '''
+    A stage of the active profiler; without one the stage is not recorded.
+    Yields the Stage, on which the caller can set rows_in and rows_out.
+    '''
+    profiler = _active
+    if profiler is None:
+        yield Stage(name, rows_in, args)
+        return
+    with profiler.stage(name, rows_in, **args) as current:
+        yield current
+
+
+def traced(name=None):
+    '''
+    Decorator running the function in a stage (default: its name) whose
+    rows_out are the rows of the result.
+    '''
+    def decorator(function):
+        def wrapper(*args, **kwargs):
+            with stage(name or function.__name__) as current:
+                result = function(*args, **kwargs)
+                current.rows_out = count_rows(result)
+                return result
+        wrapper.__name__ = function.__name__
+        wrapper.__qualname__ = function.__qualname__
+        wrapper.__doc__ = function.__doc__
+        wrapper.__wrapped__ = function
+        return wrapper
+    return decorator
+
+
+def run_profiled(name, profile, function, *args, **kwargs):
+    '''
+    Run function in stage name of a new profiler, for a worker process
+    where the profiler of the parent is not active. profile is None (not
+    profiling) or the trace_memory setting of the parent's profiler.
+    Returns (result, records); the parent adds the records with
+    Profiler.add.
+    '''
+    if profile is None:
+        return function(*args, **kwargs), []
+    with Profiler(trace_memory=profile) as profiler:
+        with profiler.stage(name) as current:
+            result = function(*args, **kwargs)
+            current.rows_out = count_rows(result)
+    return result, profiler.records
+
+
+def add_arguments(parser):
+    '''
+    The profiling options of the command line scripts.
+    '''
+    group = parser.add_argument_group('profiling')
+    group.add_argument('--profile', metavar='FILE', help='write the stages and their statements as JSON')
+    group.add_argument('--trace', metavar='FILE', help='write the stages as a Chrome trace (chrome://tracing)')
+    group.add_argument('--pg-stat-statements', action='store_true',
+                       help='add the server time of the statements of the run from pg_stat_statements')
+    group.add_argument('--no-memory', action='store_true', help="don't trace memory (tracemalloc is slow)")
+
+
+def from_args(args):
+    '''
+    A started Profiler if any profiling option is set, otherwise None.
+    '''
+    if not (args.profile or args.trace or args.pg_stat_statements):
+        return None
+    return Profiler(trace_memory=not args.no_memory).start()
+
+
+def finish(profiler, args, conn=None, before=None):
+    '''
+    Stop profiler, print its summary and write the files of args. With
+    --pg-stat-statements the statements since the snapshot before are read
+    over conn.
+    '''
+    profiler.stop()
+    deltas = None
+    if args.pg_stat_statements and conn is not None:
+        deltas = statement_deltas(before, snapshot_statements(conn))
+        if deltas is None:
+            print('pg_stat_statements is not available in this database')
+    print('\nProfile:')
+    print(profiler.summary())
+    for delta in (deltas or [])[:10]:
+        print(f"{delta['total_exec_ms']:>10.2f} ms {delta['calls']:>6} calls  {delta['query'][:80]}")
+    if args.profile:
+        profiler.write_json(args.profile, deltas)
+        print(f'Profile written to {args.profile}')
+    if args.trace:
+        profiler.write_trace(args.trace)
+        print(f'Trace written to {args.trace}')
+
+
+def snapshot_statements(conn):
+    '''
+    Counters of pg_stat_statements for the current database: dict of
+    queryid -> (query, calls, total_exec_time in ms, rows), or None if the
+    extension is not available. conn is a psycopg2 or SQLAlchemy
+    connection; the snapshot is taken in its own transaction.
+    '''
+    raw = getattr(conn, 'connection', conn)
+    cursor = raw.cursor()
+    try:
+        cursor.execute("SELECT to_regclass('pg_stat_statements') IS NOT NULL")
+        if not cursor.fetchone()[0]:
+            return None
+        cursor.execute(_PG_STAT_STATEMENTS)
+        return {queryid: tuple(rest) for queryid, *rest in cursor.fetchall()}
+    except psycopg2.Error:
+        return None
+    finally:
+        cursor.close()
+        raw.rollback()
+
+
+def statement_deltas(before, after, limit=50):
+    '''
+    Statements that ran between the snapshots before and after, with their
+    calls, server time (ms) and rows in between, the slowest first.
+    '''
+    if before is None or after is None:
+        return None
+    deltas = []
+    for queryid, (query, calls, total_ms, rows) in after.items():
+        old_calls, old_ms, old_rows = before.get(queryid, (None, 0, 0.0, 0))[1:]
+        if calls > old_calls:
+            deltas.append({'queryid': queryid, 'query': ' '.join(query.split())[:MAX_SQL_LENGTH],
+                           'calls': calls - old_calls, 'total_exec_ms': total_ms - old_ms,
+                           'rows': rows - old_rows})
+    deltas.sort(key=lambda d: d['total_exec_ms'], reverse=True)
+    return deltas[:limit]
@@ -0,0 +1,350 @@
+'''
+Streaming estimate of the doses to reserve for a vaccination event, a
+generalization of Part 3 requirement 8.
+
+The participation of a vaccination event is the number of vaccinated
+patients in percent of the batch size (rounded to two decimals, as in
+requirement 8). The participations are summarized per hospital, vaccine
+type and weekday in reserve_stats:
+  - the number of events, the mean and the sum of squared deviations (m2),
+    which are updated with Welford's (Chan's) formulas: a set of added
+    events is merged in and a set of removed events is taken out without
+    looking at the other events,
+  - a histogram of the participations (HISTOGRAM_BINS bins of one
+    percentage point, the last one holds everything from 300 % up, as more
+    patients than the batch size can come), from which quantiles are
+    estimated.
+The participation of every event is kept in event_participation, so that an
+event whose patients changed can be taken out with its old value before its
+new value is added.
+
+The loader keeps both tables up to date (see derivedTables.py): a change of
+vaccine_patient or vaccination_event only recomputes the events on the
+changed dates. The recommended reserve of a hospital, vaccine type and
+weekday (mean + standard deviation, or a quantile) is a primary key lookup,
+and the overall value of requirement 8 combines the few rows of
+reserve_stats instead of scanning all events.
+
+  python reserveEstimator.py [--database-url URL] [--hospital H] [--vaccine-type V01] [--weekday Monday] [--quantile 0.9]
+'''
+import argparse
+import math
+
+import numpy as np
+import pandas as pd
+
+import dbConnection
+from dbConnection import create_pool, raw_cursor
+
+# Histogram of the participations: one bin per percentage point, the last
+# bin holds 300 % and more. Stored histograms keep their size, so changing
+# this needs a rebuild (python derivedTables.py rebuild).
+HISTOGRAM_BINS = 301
+
+STATS_KEY = ['hospital', 'vaccine_type', 'weekday']
+
+CREATE_TABLES = """
+    DROP TABLE IF EXISTS event_participation, reserve_stats;
+
+    CREATE TABLE event_participation (
+        date          DATE NOT NULL,
+        hospital      TEXT NOT NULL,
+        vaccine_type  TEXT NOT NULL,
+        weekday       TEXT NOT NULL,
+        patients      INT NOT NULL,
+        num_of_vacc   INT NOT NULL,
+        participation DOUBLE PRECISION NOT NULL,
+
+        PRIMARY KEY(date, hospital)
+    );
+
+    CREATE TABLE reserve_stats (
+        hospital     TEXT NOT NULL,
+        vaccine_type TEXT NOT NULL,
+        weekday      TEXT NOT NULL,
+        events       INT NOT NULL,
+        mean         DOUBLE PRECISION NOT NULL,
+        m2           DOUBLE PRECISION NOT NULL,
+        histogram    INT[] NOT NULL,
+
+        PRIMARY KEY(hospital, vaccine_type, weekday)
+    )
+"""
+
+# Participation of the events with at least one patient, {where} limits the
+# events. Weekdays are named like in vaccination_shift.
+EVENT_PARTICIPATION = """
+    SELECT ve.date, ve.hospital, batch.vaccine_type, TO_CHAR(ve.date, 'FMDay') AS weekday,
+        COUNT(*) AS patients, batch.num_of_vacc,
+        ROUND(100.0 * COUNT(*) / batch.num_of_vacc, 2) AS participation
+    FROM vaccination_event AS ve
+    JOIN vaccine_patient AS vp ON vp.date = ve.date AND vp.hospital = ve.hospital
+    JOIN batch ON batch.id = ve.batch
+    {where}
+    GROUP BY ve.date, ve.hospital, batch.vaccine_type, batch.num_of_vacc
+"""
+
+PARTICIPATION = ('INSERT INTO event_participation' + EVENT_PARTICIPATION
+                 + 'RETURNING hospital, vaccine_type, weekday, participation')
+
+STATS_COLUMNS = STATS_KEY + ['events', 'mean', 'm2', 'histogram']
+
+UPSERT_STATS = """
+    INSERT INTO reserve_stats (hospital, vaccine_type, weekday, events, mean, m2, histogram)
+    VALUES (%s, %s, %s, %s, %s, %s, %s)
+    ON CONFLICT (hospital, vaccine_type, weekday) DO UPDATE
+    SET events = EXCLUDED.events, mean = EXCLUDED.mean, m2 = EXCLUDED.m2, histogram = EXCLUDED.histogram
+"""
+
+
+def _frame(cursor, columns):
+    return pd.DataFrame(cursor.fetchall(), columns=columns)
+
+
+def histogram(participations):
+    '''
+    Counts of participations in the bins of HISTOGRAM_BINS.
+    '''
+    bins = np.clip(np.floor(np.asarray(participations, dtype=float)), 0, HISTOGRAM_BINS - 1).astype(np.int64)
+    return np.bincount(bins, minlength=HISTOGRAM_BINS)
+
+
+def merge(stats, other):
+    '''
+    (events, mean, m2) of the union of two sets of events with the
+    (events, mean, m2) stats and other.
+    '''
+    n_a, mean_a, m2_a = stats
+    n_b, mean_b, m2_b = other
+    n = n_a + n_b
+    if n == 0:
+        return 0, 0.0, 0.0
+    delta = mean_b - mean_a
+    return n, mean_a + delta * n_b / n, m2_a + m2_b + delta * delta * n_a * n_b / n
+
+
+def remove(stats, other):
+    '''
+    (events, mean, m2) of stats without the events of other (a subset of
+    them), the inverse of merge.
+    '''
+    n, mean, m2 = stats
+    n_b, mean_b, m2_b = other
+    n_a = n - n_b
+    if n_a <= 0:
+        return 0, 0.0, 0.0
+    mean_a = (n * mean - n_b * mean_b) / n_a
+    delta = mean_b - mean_a
+    return n_a, mean_a, max(m2 - m2_b - delta * delta * n_a * n_b / n, 0.0)
+
+
+def _summarize(participations):
+    '''
+    (events, mean, m2) and histogram of every key of the data frame
+    participations (columns STATS_KEY and participation).
+    '''
+    summary = {}
+    for key, values in participations.groupby(STATS_KEY)['participation']:
+        values = values.to_numpy(dtype=float)
+        mean = values.mean()
+        summary[key] = ((len(values), mean, float(((values - mean) ** 2).sum())), histogram(values))
+    return summary
+
+
+def _update_stats(cursor, added, removed):
+    '''
+    Merge the participations added into reserve_stats and take the
+    participations removed out of it.
+    '''
+    added, removed = _summarize(added), _summarize(removed)
+    keys = sorted(set(added) | set(removed))
+    if not keys:
+        return
+    hospitals, vaccine_types, weekdays = (list(column) for column in zip(*keys))
+    cursor.execute("""
+        SELECT s.hospital, s.vaccine_type, s.weekday, s.events, s.mean, s.m2, s.histogram
+        FROM reserve_stats AS s
+        JOIN unnest(%s::text[], %s::text[], %s::text[]) AS k (hospital, vaccine_type, weekday)
+            USING (hospital, vaccine_type, weekday)
+    """, (hospitals, vaccine_types, weekdays))
+    current = {tuple(row[:3]): (tuple(row[3:6]), np.asarray(row[6], dtype=np.int64)) for row in cursor.fetchall()}
+
+    empty = ((0, 0.0, 0.0), np.zeros(HISTOGRAM_BINS, dtype=np.int64))
+    emptied = []
+    for key in keys:
+        stats, counts = current.get(key, empty)
+        if key in removed:
+            stats, counts = remove(stats, removed[key][0]), counts - removed[key][1]
+        if key in added:
+            stats, counts = merge(stats, added[key][0]), counts + added[key][1]
+        if stats[0] == 0:
+            emptied.append(key)
+        else:
+            cursor.execute(UPSERT_STATS, key + (int(stats[0]), float(stats[1]), float(stats[2]),
+                                                [int(count) for count in counts]))
+    for key in emptied:
+        cursor.execute('DELETE FROM reserve_stats WHERE hospital = %s AND vaccine_type = %s AND weekday = %s', key)
+
+
+def rebuild_reserve_stats(conn):
+    '''
+    Create event_participation and reserve_stats from scratch.
+    '''
+    cursor = raw_cursor(conn)
+    try:
+        cursor.execute(CREATE_TABLES)
+        cursor.execute(PARTICIPATION.format(where=''))
+        added = _frame(cursor, STATS_KEY + ['participation'])
+        _update_stats(cursor, added, added.iloc[:0])
+        cursor.execute('ANALYZE event_participation; ANALYZE reserve_stats')
+    finally:
+        cursor.close()
+
+
+def refresh_reserve_stats(conn, changes):
+    '''
+    Recompute the participation of the events on the dates of the changed
+    vaccine_patient and vaccination_event rows and update reserve_stats
+    with the difference. Changes to batches (batch sizes and vaccine types)
+    rebuild the tables.
+    '''
+    if len(changes.get('batch', ())):
+        rebuild_reserve_stats(conn)
+        return
+    dates = set()
+    for table in ['vaccine_patient', 'vaccination_event']:
+        if table in changes:
+            dates.update(pd.to_datetime(changes[table]['date']).dt.date)
+    if not dates:
+        return
+
+    params = {'dates': sorted(dates)}
+    cursor = raw_cursor(conn)
+    try:
+        cursor.execute('DELETE FROM event_participation WHERE date = ANY(%(dates)s::date[]) '
+                       'RETURNING hospital, vaccine_type, weekday, participation', params)
+        removed = _frame(cursor, STATS_KEY + ['participation'])
+        cursor.execute(PARTICIPATION.format(where='WHERE ve.date = ANY(%(dates)s::date[])'), params)
+        added = _frame(cursor, STATS_KEY + ['participation'])
+        _update_stats(cursor, added, removed)
+    finally:
+        cursor.close()
+
+
+def _std(events, m2):
+    # Sample standard deviation, like pandas
+    return math.sqrt(m2 / (events - 1)) if events > 1 else float('nan')
+
+
+def quantile(counts, q):
+    '''
+    Estimate of the q quantile (0 <= q <= 1) of the participations
+    counted in the histogram counts, interpolated within the bin.
+    '''
+    counts = np.asarray(counts, dtype=float)
+    cumulative = np.cumsum(counts)
+    if not len(cumulative) or cumulative[-1] == 0:
+        return float('nan')
+    target = q * cumulative[-1]
+    index = min(int(np.searchsorted(cumulative, target)), len(counts) - 1)
+    before = cumulative[index - 1] if index else 0.0
+    return index + (target - before) / counts[index] if counts[index] else float(index)
+
+
+def reserve_of(events, mean, m2, counts=None, q=None):
+    '''
+    Recommended reserve in percent of the batch size for the summary
+    (events, mean, m2, histogram counts): mean + standard deviation (as in
+    requirement 8), or the q quantile of the participation.
+    '''
+    if q is not None:
+        return round(quantile(counts, q), 2)
+    return round(mean, 2) + round(_std(events, m2), 2)
+
+
+def recommended_reserve(conn, hospital, vaccine_type, weekday, q=None):
+    '''
+    Recommended reserve of the events of vaccine_type at hospital on
+    weekday (e.g. 'Monday'), see reserve_of. None if there were no such
+    events.
+    '''
+    cursor = raw_cursor(conn)
+    try:
+        cursor.execute('SELECT events, mean, m2, histogram FROM reserve_stats '
+                       'WHERE hospital = %s AND vaccine_type = %s AND weekday = %s',
+                       (hospital, vaccine_type, weekday))
+        row = cursor.fetchone()
+    finally:
+        cursor.close()
+    return reserve_of(*row, q=q) if row else None
+
+
+def reserve_table(conn, q=None):
+    '''
+    reserve_stats with the recommended reserve (column reserve) of every
+    hospital, vaccine type and weekday.
+    '''
+    cursor = raw_cursor(conn)
+    try:
+        cursor.execute('SELECT %s FROM reserve_stats ORDER BY hospital, vaccine_type, weekday'
+                       % ', '.join(STATS_COLUMNS))
+        stats = _frame(cursor, STATS_COLUMNS)
+    finally:
+        cursor.close()
+    stats['reserve'] = [reserve_of(row.events, row.mean, row.m2, row.histogram, q)
+                        for row in stats.itertuples()]
+    return stats.drop(columns='histogram')
+
+
+def overall_reserve(conn, q=None):
+    '''
+    Part 3 requirement 8: recommended reserve over all events, combined
+    from the rows of reserve_stats.
+    '''
+    cursor = raw_cursor(conn)
+    try:
+        cursor.execute('SELECT events, mean, m2, histogram FROM reserve_stats')
+        rows = cursor.fetchall()
+    finally:
+        cursor.close()
+    stats = (0, 0.0, 0.0)
+    counts = np.zeros(HISTOGRAM_BINS, dtype=np.int64)
+    for events, mean, m2, row_counts in rows:
+        stats = merge(stats, (events, mean, m2))
+        counts += np.asarray(row_counts, dtype=np.int64)
+    return reserve_of(*stats, counts=counts, q=q)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Recommended reserves of doses per hospital, vaccine type and weekday.')
+    parser.add_argument('--hospital', help='only this hospital')
+    parser.add_argument('--vaccine-type', help='only this vaccine type')
+    parser.add_argument('--weekday', help='only this weekday, e.g. Monday')
+    parser.add_argument('--quantile', type=float,
+                        help='recommend this quantile of the participation (e.g. 0.9) instead of mean + std')
+    dbConnection.add_arguments(parser)
+    args = parser.parse_args(argv)
+
+    engine = create_pool(args.database_url, pool_size=1, statement_timeout_ms=args.statement_timeout)
+    try:
+        with engine.connect() as conn:
+            if args.hospital and args.vaccine_type and args.weekday:
+                reserve = recommended_reserve(conn, args.hospital, args.vaccine_type, args.weekday, args.quantile)
+                print(f'{reserve}%' if reserve is not None else 'No events')
+                return
+            stats = reserve_table(conn, args.quantile)
+            overall = overall_reserve(conn, args.quantile)
+    finally:
+        engine.dispose()
+
+    for column in ['hospital', 'vaccine_type', 'weekday']:
+        value = getattr(args, column)
+        if value:
+            stats = stats[stats[column] == value]
+    with pd.option_context('display.max_rows', None, 'display.width', 200):
+        print(stats.reset_index(drop=True))
+    print(f'\nOverall: {overall}%')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,291 @@
+'''
+Persistent cache for analysis results, keyed by the versions of the tables
+they were computed from.
+
+Every table gets a fingerprint:
+  - if the version triggers are installed (install_version_triggers), a
+    counter in the table_version table that every INSERT, UPDATE, DELETE or
+    TRUNCATE statement increments, which costs one indexed lookup,
+  - otherwise the relfilenode (which TRUNCATE changes) and the numbers of
+    inserted, updated and deleted rows of the statistics collector
+    (pg_stat_user_tables) of the table, or of every partition of a
+    partitioned table, which are read from memory without touching the
+    table. A session flushes its statistics when it ends and otherwise
+    after up to a few seconds, so a change made by a session that stays
+    connected can go unnoticed for that long; the triggers count it at
+    once.
+Both include the oid of the table, so a table that was dropped and created
+again (a full reload) never matches an old fingerprint. A table that doesn't
+exist, or has neither a version nor statistics (track_counts off), has no
+fingerprint (None) and the results depending on it are not cached.
+
+The key of a result is a hash of the task name, the source of the module of
+its function and of the modules of this directory that module uses (so
+editing e.g. symptomFrequency.py or cohorts.py invalidates the results that
+delegate to them), its parameters and the fingerprints of all tables it
+depends on. Results are pickled into data/.cache/results; when the directory grows
+beyond its size limit, the least recently used files are removed.
+
+  python resultCache.py info
+  python resultCache.py invalidate [--task NAME]
+  python resultCache.py install-triggers [--database-url URL]
+'''
+import argparse
+import hashlib
+import inspect
+import os
+import pickle
+from pathlib import Path
+
+import dbConnection
+
+CODE_DIR = Path(__file__).resolve().parent
+DEFAULT_CACHE_DIR = Path(__file__).parent.parent / 'data' / '.cache' / 'results'
+DEFAULT_MAX_BYTES = 256 * 1024 ** 2
+
+VERSION_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS table_version (
+        relid   OID PRIMARY KEY,
+        version BIGINT NOT NULL
+    );
+
+    CREATE OR REPLACE FUNCTION bump_table_version() RETURNS TRIGGER AS $$
+    BEGIN
+        INSERT INTO table_version (relid, version) VALUES (TG_RELID, 1)
+        ON CONFLICT (relid) DO UPDATE SET version = table_version.version + 1;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+"""
+
+VERSION_TRIGGER_SQL = """
+    CREATE OR REPLACE TRIGGER {table}_version
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON "{table}"
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version()
+"""
+
+_VERSION = """
+    SELECT c.oid, v.version
+    FROM pg_class AS c
+    LEFT JOIN table_version AS v ON v.relid = c.oid
+    WHERE c.oid = to_regclass(%s)
+"""
+
+# The leaf partitions of a partitioned table, the table itself otherwise
+_STATISTICS = """
+    SELECT to_regclass(%(table)s)::oid,
+        ARRAY_AGG(ARRAY[p.oid::BIGINT, p.relfilenode::BIGINT, s.n_tup_ins, s.n_tup_upd, s.n_tup_del]
+                  ORDER BY p.oid)
+    FROM pg_class AS p
+    LEFT JOIN pg_stat_user_tables AS s ON s.relid = p.oid
+    WHERE (p.oid = to_regclass(%(table)s) AND p.relkind = 'r')
+        OR p.oid IN (SELECT relid FROM pg_partition_tree(to_regclass(%(table)s)) WHERE isleaf)
+"""
+
+
+def install_version_triggers(conn, tables):
+    '''
+    Create the table_version table and a statement level trigger counting
+    the changes of every table in tables. conn is a SQLAlchemy or psycopg2
+    connection; the change is committed.
+    '''
+    raw = getattr(conn, 'connection', conn)
+    cursor = raw.cursor()
+    try:
+        cursor.execute(VERSION_TABLE_SQL)
+        for table in tables:
+            cursor.execute(VERSION_TRIGGER_SQL.format(table=table))
+        raw.commit()
+    except Exception:
+        raw.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def table_fingerprints(conn, tables):
+    '''
+    Dict of table name -> fingerprint (a tuple) for tables, None for the
+    tables that don't exist.
+    '''
+    raw = getattr(conn, 'connection', conn)
+    cursor = raw.cursor()
+    try:
+        cursor.execute("SELECT to_regclass('table_version') IS NOT NULL, current_setting('track_counts')::BOOLEAN")
+        versioned, counted = cursor.fetchone()
+        fingerprints = {}
+        for table in sorted(tables):
+            if versioned:
+                cursor.execute(_VERSION, (table,))
+                row = cursor.fetchone()
+                if row is not None and row[1] is not None:
+                    fingerprints[table] = ('version',) + tuple(row)
+                    continue
+            cursor.execute(_STATISTICS, {'table': table})
+            oid, partitions = cursor.fetchone()
+            if oid is None or not counted:
+                fingerprints[table] = None
+                continue
+            fingerprints[table] = ('statistics', oid, tuple(tuple(partition) for partition in partitions or ()))
+        return fingerprints
+    finally:
+        cursor.close()
+
+
+def _project_modules(module):
+    '''
+    module and the modules of this directory it uses, directly or through
+    other modules: the modules themselves and the modules of the functions
+    and classes they import.
+    '''
+    found, pending = {}, [module]
+    while pending:
+        module = pending.pop()
+        path = getattr(module, '__file__', None)
+        if module is None or module.__name__ in found or path is None \
+                or Path(path).resolve().parent != CODE_DIR:
+            continue
+        found[module.__name__] = module
+        pending += [inspect.getmodule(value) for value in vars(module).values()
+                    if inspect.ismodule(value) or inspect.isfunction(value) or inspect.isclass(value)]
+    return [found[name] for name in sorted(found)]
+
+
+def _source(function):
+    '''
+    Name of function and the source and string constants of its module and
+    of the modules of this directory it uses (see _project_modules). The
+    source has the SQL constants and the functions it delegates to; the
+    values of the constants cover SQL read from files, e.g. the Query 7 of
+    sqlQueries.sql that symptomFrequency.FREQUENCIES is made of.
+    '''
+    name = getattr(function, '__qualname__', repr(function))
+    try:
+        modules = _project_modules(inspect.getmodule(function))
+        return name + ''.join(inspect.getsource(module) for module in modules) + repr([
+            sorted((key, value) for key, value in vars(module).items() if key.isupper() and isinstance(value, str))
+            for module in modules])
+    except (OSError, TypeError):
+        return name
+
+
+def result_key(name, function, params, fingerprints):
+    '''
+    Cache key of the result of task name computed by function with params
+    from tables with the given fingerprints.
+    '''
+    sha = hashlib.sha1()
+    for part in [name, _source(function), sorted((k, repr(v)) for k, v in params.items()),
+                 sorted(fingerprints.items())]:
+        sha.update(repr(part).encode('utf-8'))
+    return '%s-%s' % (name, sha.hexdigest()[:20])
+
+
+class ResultCache:
+    '''
+    Pickled results in a directory, at most max_bytes in total. The
+    modification time of a file is its last use.
+    '''
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+
+    def _path(self, key):
+        return self.directory / (key + '.pkl')
+
+    def get(self, key):
+        '''
+        (True, result) if key is cached, otherwise (False, None).
+        '''
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as file:
+                result = pickle.load(file)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return False, None
+        os.utime(path)
+        return True, result
+
+    def put(self, key, result):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self._path(key)
+        tmp_path = path.with_suffix('.tmp')
+        with open(tmp_path, 'wb') as file:
+            pickle.dump(result, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        # Results of a task computed from older table versions are useless
+        task = key.rsplit('-', 1)[0]
+        for old in self.directory.glob(task + '-*.pkl'):
+            if old != path and old.name.rsplit('-', 1)[0] == task:
+                old.unlink(missing_ok=True)
+        self.evict()
+
+    def entries(self):
+        '''
+        List of (path, size, last use) from the least recently used.
+        '''
+        if not self.directory.exists():
+            return []
+        entries = []
+        for path in self.directory.glob('*.pkl'):
+            stat = path.stat()
+            entries.append((path, stat.st_size, stat.st_mtime))
+        return sorted(entries, key=lambda entry: entry[2])
+
+    def evict(self):
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+
+    def invalidate(self, task=None):
+        '''
+        Remove the cached results of task, or all of them. Returns the
+        number of removed files.
+        '''
+        removed = 0
+        for path, _, _ in self.entries():
+            if task is None or path.name.rsplit('-', 1)[0] == task:
+                path.unlink(missing_ok=True)
+                removed += 1
+        return removed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Manage the cache of analysis results.')
+    parser.add_argument('--dir', default=str(DEFAULT_CACHE_DIR), help='cache directory (default: %(default)s)')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('info', help='list the cached results')
+    invalidate = commands.add_parser('invalidate', help='remove cached results')
+    invalidate.add_argument('--task', help='only remove the results of this task')
+    triggers = commands.add_parser('install-triggers',
+                                   help='keep table versions with triggers instead of scanning tables')
+    dbConnection.add_arguments(triggers)
+    args = parser.parse_args(argv)
+
+    cache = ResultCache(args.dir)
+    if args.command == 'info':
+        entries = cache.entries()
+        for path, size, _ in entries:
+            print(f'{path.stem:<48} {size / 1024:>10.1f} kB')
+        print(f'{len(entries)} results, {sum(size for _, size, _ in entries) / 1024 ** 2:.1f} MB')
+    elif args.command == 'invalidate':
+        print(f'Removed {cache.invalidate(args.task)} cached results')
+    else:
+        from sqlSchema import read_schema
+
+        conn = dbConnection.connect(args.database_url, args.statement_timeout)
+        try:
+            tables = list(read_schema(Path(__file__).parent / 'sqlCreatingDatabase.sql'))
+            install_version_triggers(conn, tables)
+        finally:
+            conn.close()
+        print(f'Version triggers installed on {len(tables)} tables')
+
+
+if __name__ == '__main__':
+    main()
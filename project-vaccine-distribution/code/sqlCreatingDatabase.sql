@@ -1,12 +1,28 @@
+-- patient_status was a view (query 5) before it became a derived table
+DO $$
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = to_regclass('patient_status')) = 'v' THEN
+        DROP VIEW patient_status;
+    END IF;
+END
+$$;
+
 DROP TABLE IF EXISTS
     batch,
+    batch_location,
     diagnosis,
+    event_participation,
     hospital,
+    hospital_stock,
     manufacturer,
     patient,
+    patient_status,
+    patient_vaccination_progress,
+    reserve_stats,
     staff,
     symptoms,
     transport_log,
+    vaccination_daily,
     vaccination_event,
     vaccination_shift,
     vaccine_patient,
@@ -144,3 +160,177 @@ CREATE TABLE diagnosis (
     FOREIGN KEY(patient) REFERENCES patient(ssn),
     FOREIGN KEY(symptom) REFERENCES symptoms(name)
 );
+
+-- Current location of every batch: the last transport (latest departure) of
+-- the batch in transport_log and whether it ended somewhere else than the
+-- hospital of the batch. Kept up to date by the triggers below, so location
+-- queries don't have to scan and group the whole transport log.
+CREATE TABLE batch_location (
+    batch     TEXT NOT NULL,
+    dep_hos   TEXT NOT NULL,
+    arr_hos   TEXT NOT NULL,
+    dep_date  TIMESTAMP NOT NULL,
+    arr_date  TIMESTAMP NOT NULL,
+    misplaced BOOL NOT NULL,
+
+    PRIMARY KEY(batch),
+    FOREIGN KEY(batch) REFERENCES batch(id) ON DELETE CASCADE
+);
+
+CREATE INDEX batch_location_misplaced ON batch_location (batch) WHERE misplaced;
+
+-- Recompute the location of the given batches (index lookups on
+-- transport_log(batch, dep_date DESC)).
+CREATE OR REPLACE FUNCTION refresh_batch_location(batches TEXT[]) RETURNS VOID AS $$
+    DELETE FROM batch_location WHERE batch = ANY(batches);
+
+    INSERT INTO batch_location (batch, dep_hos, arr_hos, dep_date, arr_date, misplaced)
+    SELECT DISTINCT ON (log.batch)
+        log.batch, log.dep_hos, log.arr_hos, log.dep_date, log.arr_date, log.arr_hos <> batch.hospital
+    FROM transport_log AS log
+    JOIN batch ON batch.id = log.batch
+    WHERE log.batch = ANY(batches)
+    ORDER BY log.batch, log.dep_date DESC, log.arr_date DESC, log.arr_hos;
+$$ LANGUAGE sql;
+
+-- Statement level triggers: one refresh per statement (or COPY) for all the
+-- batches it touched, read from the transition tables.
+CREATE OR REPLACE FUNCTION transport_log_inserted() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM refresh_batch_location(ARRAY(SELECT DISTINCT batch FROM new_rows));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION transport_log_updated() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM refresh_batch_location(ARRAY(SELECT batch FROM old_rows UNION SELECT batch FROM new_rows));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION transport_log_deleted() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM refresh_batch_location(ARRAY(SELECT DISTINCT batch FROM old_rows));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION transport_log_truncated() RETURNS TRIGGER AS $$
+BEGIN
+    DELETE FROM batch_location;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- A batch assigned to another hospital may become (or stop being) misplaced
+CREATE OR REPLACE FUNCTION batch_updated() RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE batch_location
+    SET misplaced = batch_location.arr_hos <> new_rows.hospital
+    FROM new_rows
+    WHERE batch_location.batch = new_rows.id
+    AND batch_location.misplaced <> (batch_location.arr_hos <> new_rows.hospital);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER transport_log_insert AFTER INSERT ON transport_log
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION transport_log_inserted();
+
+CREATE TRIGGER transport_log_update AFTER UPDATE ON transport_log
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION transport_log_updated();
+
+CREATE TRIGGER transport_log_delete AFTER DELETE ON transport_log
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION transport_log_deleted();
+
+CREATE TRIGGER transport_log_truncate AFTER TRUNCATE ON transport_log
+    FOR EACH STATEMENT EXECUTE FUNCTION transport_log_truncated();
+
+CREATE TRIGGER batch_update AFTER UPDATE ON batch
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION batch_updated();
+
+-- Doses stored at every hospital per vaccine type (query 6): the number of
+-- batches and the sum of their sizes. Kept up to date by the triggers below,
+-- which add the inserted batches and subtract the deleted ones (an update is
+-- both), so only the hospitals and vaccine types of the changed batches are
+-- touched. The pivot with a column per vaccine type is the view
+-- hospital_inventory, generated from vaccine_type (see summaryTables.py).
+CREATE TABLE hospital_stock (
+    hospital     TEXT NOT NULL,
+    vaccine_type TEXT NOT NULL,
+    batches      INT NOT NULL,
+    amount       BIGINT NOT NULL,
+
+    PRIMARY KEY(hospital, vaccine_type)
+);
+
+CREATE OR REPLACE FUNCTION batch_stock_inserted() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO hospital_stock AS s (hospital, vaccine_type, batches, amount)
+    SELECT hospital, vaccine_type, COUNT(*), SUM(num_of_vacc)
+    FROM new_rows
+    GROUP BY hospital, vaccine_type
+    ON CONFLICT (hospital, vaccine_type) DO UPDATE
+    SET batches = s.batches + EXCLUDED.batches, amount = s.amount + EXCLUDED.amount;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION batch_stock_updated() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO hospital_stock AS s (hospital, vaccine_type, batches, amount)
+    SELECT hospital, vaccine_type, SUM(batches), SUM(amount)
+    FROM (
+        SELECT hospital, vaccine_type, 1 AS batches, num_of_vacc AS amount FROM new_rows
+        UNION ALL
+        SELECT hospital, vaccine_type, -1, -num_of_vacc FROM old_rows
+    ) AS changes
+    GROUP BY hospital, vaccine_type
+    ON CONFLICT (hospital, vaccine_type) DO UPDATE
+    SET batches = s.batches + EXCLUDED.batches, amount = s.amount + EXCLUDED.amount;
+    DELETE FROM hospital_stock WHERE batches = 0;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION batch_stock_deleted() RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE hospital_stock AS s
+    SET batches = s.batches - d.batches, amount = s.amount - d.amount
+    FROM (
+        SELECT hospital, vaccine_type, COUNT(*) AS batches, SUM(num_of_vacc) AS amount
+        FROM old_rows
+        GROUP BY hospital, vaccine_type
+    ) AS d
+    WHERE s.hospital = d.hospital AND s.vaccine_type = d.vaccine_type;
+    DELETE FROM hospital_stock WHERE batches = 0;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION batch_stock_truncated() RETURNS TRIGGER AS $$
+BEGIN
+    DELETE FROM hospital_stock;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER batch_stock_insert AFTER INSERT ON batch
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION batch_stock_inserted();
+
+CREATE TRIGGER batch_stock_update AFTER UPDATE ON batch
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION batch_stock_updated();
+
+CREATE TRIGGER batch_stock_delete AFTER DELETE ON batch
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION batch_stock_deleted();
+
+CREATE TRIGGER batch_stock_truncate AFTER TRUNCATE ON batch
+    FOR EACH STATEMENT EXECUTE FUNCTION batch_stock_truncated();
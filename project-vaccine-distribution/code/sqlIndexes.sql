@@ -0,0 +1,37 @@
+-- Secondary indexes for the joins and filters of sqlQueries.sql and
+-- databaseAnalysis.py. The primary keys already cover lookups on their
+-- leading columns, e.g. diagnosis(patient) and vaccine_patient(patient).
+-- Safe to run again: existing indexes are kept.
+
+-- vaccine_patient -> vaccination_event (requirements 2, 7, 8, queries 4, 5, 7)
+CREATE INDEX IF NOT EXISTS vaccine_patient_date_hospital_idx
+    ON vaccine_patient (date, hospital);
+
+-- vaccination_event -> batch (queries 4, 5, 7, requirements 2, 7, 8)
+CREATE INDEX IF NOT EXISTS vaccination_event_batch_idx
+    ON vaccination_event (batch);
+
+-- Events of one hospital in a date window (requirement 10)
+CREATE INDEX IF NOT EXISTS vaccination_event_hospital_date_idx
+    ON vaccination_event (hospital, date);
+
+-- Diagnoses after a date (query 4) and per symptom
+CREATE INDEX IF NOT EXISTS diagnosis_date_idx
+    ON diagnosis (date);
+CREATE INDEX IF NOT EXISTS diagnosis_symptom_idx
+    ON diagnosis (symptom);
+
+-- Latest transport of every batch (query 3)
+CREATE INDEX IF NOT EXISTS transport_log_batch_dep_date_idx
+    ON transport_log (batch, dep_date DESC);
+
+-- Workers of a hospital on a weekday (query 1, 2, requirement 10)
+CREATE INDEX IF NOT EXISTS vaccination_shift_hospital_weekday_idx
+    ON vaccination_shift (hospital, weekday);
+
+-- Batches stored at a hospital (query 6)
+CREATE INDEX IF NOT EXISTS batch_hospital_idx
+    ON batch (hospital);
+
+-- Planner statistics for the freshly loaded tables
+ANALYZE;
@@ -22,211 +22,275 @@ ADDITIONAL source for PostgreSQL
     https://medium.com/analytics-vidhya/pandas-dataframe-to-postgresql-using-python-part-2-3ddb41f473bd
 
 '''
-import psycopg2
+import argparse
 from psycopg2 import Error
-from sqlalchemy import create_engine, text
 import pandas as pd
-import numpy as np
 from pathlib import Path
-import datetime
-import openpyxl
-import matplotlib.pyplot as plt
+from bulkLoader import DEFAULT_CHUNK_SIZE
+from deltaLoader import apply_delta, tables_exist
+from derivedTables import rebuild_all, refresh_all
+from loadScheduler import DEFAULT_WORKERS, load_tables
+from partitioning import create_schema
+import dbConnection
+from dbConnection import create_pool, describe
+import profiling
+from profiling import stage
+from sqlRunner import SqlScriptError, run_sql_from_file
+from sqlSchema import read_schema
+from validation import rejected_keys, validate_tables, write_quarantine
+from workbookReader import read_workbook
 
 
 # NOTE TO GRADER: IF YOU WANT TO RUN THIS FILE, DON'T FORGET TO INSTALL requirements.txt.
 # We added new requirements there and this file might not work without them.
 
-def run_sql_from_file(file_path, conn):
+# How the sheets are pushed into the database: 'copy' streams them with
+# COPY ... FROM STDIN, 'insert' uses the old DataFrame.to_sql INSERTs.
+LOAD_METHOD = 'copy'
+# Number of rows sent to the server in one COPY buffer.
+COPY_CHUNK_SIZE = DEFAULT_CHUNK_SIZE
+# Number of tables loaded in parallel (and size of the connection pool).
+LOAD_WORKERS = DEFAULT_WORKERS
+
+
+def prepare_tables(sheets):
     '''
-    Read and run SQL queries from a file at file_path.
+    Clean the workbook sheets and rename their columns to match the database.
+    Returns a dict of table name -> data frame.
     '''
-    ok = True
-    with open(file_path, 'r') as file:
-        sql_cmd = ''
-        for line in file:
-            i = line.find('--')
-            if i != -1:
-                line = line[:i]
-            line = line.strip()
-            if line == '':
-                # Empty or comment-only line
-                continue
-
-            sql_cmd += ' ' + line
-            if line.endswith(';'):
-                try:
-                    conn.execute(text(sql_cmd))
-                except Exception as e:
-                    print(f'\nError while executing SQL:\n{e}\n')
-                    ok = False
-                sql_cmd = ''
-    return ok
-
-
-def main():
+    # NOTE: For some reason, the code for executing queries from an sql file ignores the case,
+    # so all tables and attributes in the DB are lower-cased.
+    # So, until this is fixed, all columns in dataframes need to be lowercased.
+    tables = {}
+
+    # Populate VaccineType -> vaccine_type
+    dfVaccType = sheets['VaccineType']
+    dfVaccType = dfVaccType.rename(columns={
+        'tempMin': 'temp_min',
+        'tempMax': 'temp_max'})
+    dfVaccType = dfVaccType.rename(str.lower, axis='columns')
+    tables['vaccine_type'] = dfVaccType
+
+    # Populating Manufacturer -> manufacturer
+    dfManuf = sheets['Manufacturer']
+    dfManuf = dfManuf.rename(columns={
+        'id': 'id',
+        'country': 'origin',
+        'vaccine': 'vaccine_type'})
+    dfManuf = dfManuf.rename(str.lower, axis='columns')
+    tables['manufacturer'] = dfManuf
+
+    # Populating VaccinationStations -> hospital
+    dfHospital = sheets['VaccinationStations']
+    dfHospital = dfHospital.rename(str.lower, axis='columns')
+    tables['hospital'] = dfHospital
+
+    # Populating VaccineBatch -> batch
+    dfBatch = sheets['VaccineBatch']
+    dfBatch = dfBatch.rename(columns={
+        'batchID': 'id',
+        'amount': 'num_of_vacc',
+        'type': 'vaccine_type',
+        'manufDate': 'prod_date',
+        'expiration': 'exp_date',
+        'location': 'hospital'})
+    dfBatch = dfBatch.rename(str.lower, axis='columns')
+    tables['batch'] = dfBatch
+
+    # Populating Transportation log -> transport_log
+    dfLog = sheets['Transportation log']
+    dfLog = dfLog.rename(columns={
+        'batchID': 'batch',
+        'departure ': 'dep_hos',
+        'arrival': 'arr_hos',
+        'dateArr': 'arr_date',
+        'dateDep': 'dep_date'})
+    dfLog = dfLog.rename(str.lower, axis='columns')
+    tables['transport_log'] = dfLog
+
+    # Populating StaffMembers -> staff
+    dfStaff = sheets['StaffMembers']
+    dfStaff = dfStaff.rename(columns={
+        'social security number': 'ssn',
+        'date of birth': 'birthday',
+        'vaccination status': 'vacc_status'})
+    dfStaff['vacc_status'] = dfStaff['vacc_status'].astype('bool')
+    dfStaff = dfStaff.rename(str.lower, axis='columns')
+    tables['staff'] = dfStaff
+
+    # Populating Shifts -> vaccination_shift
+    dfVaccShift = sheets['Shifts']
+    dfVaccShift = dfVaccShift.rename(columns={'station': 'hospital'})
+    dfVaccShift = dfVaccShift.rename(str.lower, axis='columns')
+    tables['vaccination_shift'] = dfVaccShift
+
+    # Populating Vaccinations -> vaccination_event
+    vaccine_df = sheets['Vaccinations']
+    vaccine_df['date'] = pd.to_datetime(vaccine_df['date'])
+    vaccine_df.columns = vaccine_df.columns.str.strip()
+    vaccine_df = vaccine_df.rename(columns={
+        'batchID': 'batch',
+        'location': 'hospital'})
+    vaccine_df = vaccine_df.rename(str.lower, axis='columns')
+    tables['vaccination_event'] = vaccine_df
+
+    # Populating Patients -> patient
+    dfPatient = sheets['Patients']
+    dfPatient = dfPatient.rename(columns={
+        'ssNo': 'ssn',
+        'date of birth': 'birthday'})
+    dfPatient = dfPatient.rename(str.lower, axis='columns')
+    tables['patient'] = dfPatient
+
+    # Populating VaccinePatients -> vaccine_patient
+    vacc_patient_df = sheets['VaccinePatients']
+    vacc_patient_df['date'] = pd.to_datetime(vacc_patient_df['date'])
+    vacc_patient_df.columns = vacc_patient_df.columns.str.strip()
+    vacc_patient_df = vacc_patient_df.rename(columns={
+        'patientSsNo': 'patient',
+        'location': 'hospital'})
+    vacc_patient_df = vacc_patient_df.rename(str.lower, axis='columns')
+
+    tables['vaccine_patient'] = vacc_patient_df
+
+    # Populating Symptoms -> symptoms
+    dfSymptoms = sheets['Symptoms']
+    dfSymptoms = dfSymptoms.rename(columns={'criticality': 'critical'})
+    dfSymptoms = dfSymptoms.rename(str.lower, axis='columns')
+    dfSymptoms['critical'] = dfSymptoms['critical'].astype('bool')
+    tables['symptoms'] = dfSymptoms
+
+    # Populating Diagnosis -> diagnosis
+    # Rows with invalid dates are rejected by validate_tables
+    dfDiagnosis = sheets['Diagnosis']
+    dfDiagnosis = dfDiagnosis.rename(str.lower, axis='columns')
+    tables['diagnosis'] = dfDiagnosis
+
+    return tables
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Create the vaccine distribution database and load the workbook into it.')
+    parser.add_argument('--incremental', action='store_true',
+                        help='keep the existing tables and only apply inserted, updated and deleted rows')
+    parser.add_argument('--method', choices=['copy', 'insert'], default=LOAD_METHOD,
+                        help='COPY the rows or INSERT them with DataFrame.to_sql (default: %(default)s)')
+    parser.add_argument('--chunk-size', type=int, default=COPY_CHUNK_SIZE,
+                        help='rows per COPY buffer (default: %(default)s)')
+    parser.add_argument('--workers', type=int, default=LOAD_WORKERS,
+                        help='tables loaded in parallel (default: %(default)s)')
+    parser.add_argument('--partitioned', action='store_true',
+                        help='create vaccination_event, vaccine_patient and diagnosis partitioned by month')
+    parser.add_argument('--quarantine', default=str(Path(__file__).parent.parent / 'data' / 'quarantine.csv'),
+                        help='CSV file for the rows that fail validation (default: data/quarantine.csv)')
+    dbConnection.add_arguments(parser)
+    profiling.add_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # Stages and statements are recorded with --profile / --trace
+    profiler = profiling.from_args(args)
+    before = None
     DATADIR = str(Path(__file__).parent.parent)  # for relative path
     print("Data directory: ", DATADIR)
 
-    # In postgres=# shell: CREATE ROLE [role_name] WITH CREATEDB LOGIN PASSWORD '[pssword]'; 
-    # https://www.postgresql.org/docs/current/sql-createrole.html
-
-    database = "grp10_vaccinedist"
-    user = 'grp10'
-    password = 'VeKQ^hLf'
-    host = 'dbcourse2022.cs.aalto.fi'
-    # use connect function to establish the connection
+    # The database is given by --database-url, $VACCINEDIST_DATABASE_URL or the
+    # libpq environment (PGHOST, PGDATABASE, PGUSER, PGPASSWORD), see dbConnection.py
+    engine = psql_conn = None
     try:
-        # Connect the postgres database from your local machine using psycopg2
-        connection = psycopg2.connect(
-            database=database,
-            user=user,
-            password=password,
-            host=host
-        )
-
-        # Create a cursor to perform database operations
-        cursor = connection.cursor()
-
+        # One pool of connections for everything
+        engine = create_pool(args.database_url, pool_size=args.workers, statement_timeout_ms=args.statement_timeout)
+        if profiler:
+            profiler.instrument(engine)
+        url, version = describe(engine)
         print("PostgreSQL server information")
-        print(connection.get_dsn_parameters(), "\n")
-        cursor.execute("SELECT version();")
-        record = cursor.fetchone()
-        print("You are connected to - ", record, "\n")
+        print(url, "\n")
+        print("You are connected to - ", version, "\n")
 
-        # Population of DB with tables:
-
-        # Step 1: Connect to db using SQLAlchemy create_engine
-        DIALECT = 'postgresql+psycopg2://'
-        db_uri = "%s:%s@%s/%s" % (user, password, host, database)
-        print(DIALECT + db_uri)
-
-        engine = create_engine(DIALECT + db_uri)
         psql_conn = engine.connect()
-
-        # Read SQL files for CREATE TABLE
-        if not run_sql_from_file(DATADIR + '/code/sqlCreatingDatabase.sql', psql_conn):
-            return
+        if profiler and args.pg_stat_statements:
+            before = profiling.snapshot_statements(psql_conn)
+
+        schema = read_schema(DATADIR + '/code/sqlCreatingDatabase.sql')
+        # Incremental mode keeps the existing tables (if there are any) and
+        # only writes the rows that changed.
+        incremental = args.incremental and tables_exist(psql_conn, schema)
+
+        if not incremental:
+            # Read SQL files for CREATE TABLE (optionally with the event
+            # tables partitioned by month)
+            try:
+                with stage('create schema'):
+                    create_schema(psql_conn, DATADIR + '/code/sqlCreatingDatabase.sql', partitioned=args.partitioned)
+            except SqlScriptError as e:
+                print(f'\nError while executing SQL:\n{e}\n')
+                return
 
         # Read excel file and insert into DB.
 
-        # NOTE: For some reason, the code for executing queries from an sql file ignores the case,
-        # so all tables and attributes in the DB are lower-cased.
-        # So, until this is fixed, all columns in dataframes need to be lowercased.
-
         # Excel file location
         excel_file = DATADIR + '/data/vaccine-distribution-data.xlsx'
-
-        # Populate VaccineType -> vaccine_type
-        dfVaccType = pd.read_excel(excel_file, sheet_name='VaccineType')
-        dfVaccType = dfVaccType.rename(columns={
-            'tempMin': 'temp_min',
-            'tempMax': 'temp_max'})
-        dfVaccType = dfVaccType.rename(str.lower, axis='columns')
-        dfVaccType.to_sql('vaccine_type', con=psql_conn, if_exists='append', index=False)
-
-        # Populating Manufacturer -> manufacturer
-        dfManuf = pd.read_excel(excel_file, sheet_name='Manufacturer')
-        dfManuf = dfManuf.rename(columns={
-            'id': 'id',
-            'country': 'origin',
-            'vaccine': 'vaccine_type'})
-        dfManuf = dfManuf.rename(str.lower, axis='columns')
-        dfManuf.to_sql('manufacturer', con=psql_conn, if_exists='append', index=False)
-
-        # Populating VaccinationStations -> hospital
-        dfHospital = pd.read_excel(excel_file, sheet_name='VaccinationStations')
-        dfHospital = dfHospital.rename(str.lower, axis='columns')
-        dfHospital.to_sql('hospital', con=psql_conn, if_exists='append', index=False)
-
-        # Populating VaccineBatch -> batch
-        dfBatch = pd.read_excel(excel_file, sheet_name='VaccineBatch')
-        dfBatch = dfBatch.rename(columns={
-            'batchID': 'id',
-            'amount': 'num_of_vacc',
-            'type': 'vaccine_type',
-            'manufDate': 'prod_date',
-            'expiration': 'exp_date',
-            'location': 'hospital'})
-        dfBatch = dfBatch.rename(str.lower, axis='columns')
-        dfBatch.to_sql('batch', con=psql_conn, if_exists='append', index=False)
-
-        # Populating Transportation log -> transport_log
-        dfLog = pd.read_excel(excel_file, sheet_name='Transportation log')
-        dfLog = dfLog.rename(columns={
-            'batchID': 'batch',
-            'departure ': 'dep_hos',
-            'arrival': 'arr_hos',
-            'dateArr': 'arr_date',
-            'dateDep': 'dep_date'})
-        dfLog = dfLog.rename(str.lower, axis='columns')
-        dfLog.to_sql('transport_log', con=psql_conn, if_exists='append', index=False)
-
-        # Populating StaffMembers -> staff
-        dfStaff = pd.read_excel(excel_file, sheet_name='StaffMembers')
-        dfStaff = dfStaff.rename(columns={
-            'social security number': 'ssn',
-            'date of birth': 'birthday',
-            'vaccination status': 'vacc_status'})
-        dfStaff['vacc_status'] = dfStaff['vacc_status'].astype('bool')
-        dfStaff = dfStaff.rename(str.lower, axis='columns')
-        dfStaff.to_sql('staff', con=psql_conn, if_exists='append', index=False)
-
-        # Populating Shifts -> vaccination_shift
-        dfVaccShift = pd.read_excel(excel_file, sheet_name='Shifts')
-        dfVaccShift = dfVaccShift.rename(columns={'station': 'hospital'})
-        dfVaccShift = dfVaccShift.rename(str.lower, axis='columns')
-        dfVaccShift.to_sql('vaccination_shift', con=psql_conn, if_exists='append', index=False)
-
-        # Populating Vaccinations -> vaccination_event
-        vaccine_df = pd.read_excel(excel_file, sheet_name='Vaccinations')
-        vaccine_df['date'] = pd.to_datetime(vaccine_df['date'])
-        vaccine_df.columns = vaccine_df.columns.str.strip()
-        vaccine_df = vaccine_df.rename(columns={
-            'batchID': 'batch',
-            'location': 'hospital'})
-        vaccine_df = vaccine_df.rename(str.lower, axis='columns')
-        vaccine_df.to_sql('vaccination_event', con=psql_conn, if_exists='append', index=False)
-
-        # Populating Patients -> patient
-        dfPatient = pd.read_excel(excel_file, sheet_name='Patients')
-        dfPatient = dfPatient.rename(columns={
-            'ssNo': 'ssn',
-            'date of birth': 'birthday'})
-        dfPatient = dfPatient.rename(str.lower, axis='columns')
-        dfPatient.to_sql('patient', con=psql_conn, if_exists='append', index=False)
-
-        # Populating VaccinePatients -> vaccine_patient
-        vacc_patient_df = pd.read_excel(excel_file, sheet_name='VaccinePatients')
-        vacc_patient_df['date'] = pd.to_datetime(vacc_patient_df['date'])
-        vacc_patient_df.columns = vacc_patient_df.columns.str.strip()
-        vacc_patient_df = vacc_patient_df.rename(columns={
-            'patientSsNo': 'patient',
-            'location': 'hospital'})
-        vacc_patient_df = vacc_patient_df.rename(str.lower, axis='columns')
-
-        vacc_patient_df.to_sql('vaccine_patient', con=psql_conn, if_exists='append', index=False)
-
-        # Populating Symptoms -> symptoms
-        dfSymptoms = pd.read_excel(excel_file, sheet_name='Symptoms')
-        dfSymptoms = dfSymptoms.rename(columns={'criticality': 'critical'})
-        dfSymptoms = dfSymptoms.rename(str.lower, axis='columns')
-        dfSymptoms['critical'] = dfSymptoms['critical'].astype('bool')
-        dfSymptoms.to_sql('symptoms', con=psql_conn, if_exists='append', index=False)
-
-        # Populating Diagnosis -> diagnosis
-        dfDiagnosis = pd.read_excel(excel_file, sheet_name='Diagnosis')
-        dfDiagnosis = dfDiagnosis.drop(
-            dfDiagnosis[dfDiagnosis['date'].map(lambda x: not isinstance(x, datetime.datetime))].index)
-        dfDiagnosis = dfDiagnosis.rename(str.lower, axis='columns')
-        dfDiagnosis.to_sql('diagnosis', con=psql_conn, if_exists='append', index=False)
+        # All sheets are parsed in one pass (or taken from the cache when the
+        # workbook has not changed since the last run).
+        with stage('read workbook') as current:
+            sheets = read_workbook(excel_file)
+            current.rows_out = sum(len(df) for df in sheets.values())
+        with stage('prepare tables', rows_in=current.rows_out) as current:
+            tables = prepare_tables(sheets)
+            current.rows_out = sum(len(df) for df in tables.values())
+        # Rows that would violate a constraint of the schema are set aside
+        # instead of failing the load.
+        with stage('validate tables', rows_in=current.rows_out) as current:
+            valid, rejected = validate_tables(tables, schema)
+            # The rows already in the database under these keys are left alone
+            kept = rejected_keys(tables, rejected, schema)
+            tables = valid
+            current.rows_out = sum(len(df) for df in tables.values())
+        # Written on every run, so that it never lists the rows of an older one
+        write_quarantine(rejected, args.quarantine)
+        if len(rejected):
+            print("%d rows failed validation, see %s" % (len(rejected), args.quarantine))
+        rows = current.rows_out
+
+        if incremental:
+            # The derived tables are updated for the changed keys only, in
+            # the same transaction.
+            with stage('apply delta', rows_in=rows) as current:
+                stats = apply_delta(tables, psql_conn, schema, chunk_size=args.chunk_size, on_changes=refresh_all,
+                                    keep=kept)
+                current.rows_out = sum(sum(changes) for changes in stats.values())
+        else:
+            # Tables that don't reference each other are loaded in parallel,
+            # each over its own connection from the engine's pool.
+            with stage('load tables', rows_in=rows) as current:
+                stats = load_tables(tables, engine, schema, workers=args.workers,
+                                    method=args.method, chunk_size=args.chunk_size)
+                current.rows_out = sum(loaded for loaded, _ in stats.values())
+
+        # Indexes are built after loading, which is faster than keeping
+        # them up to date row by row.
+        with stage('create indexes'):
+            run_sql_from_file(DATADIR + '/code/sqlIndexes.sql', psql_conn)
+
+        if not incremental:
+            # Tables derived from the data (e.g. the daily vaccination rollup)
+            with stage('rebuild derived tables'):
+                rebuild_all(psql_conn)
+                psql_conn.connection.commit()
 
     except (Exception, Error) as error:
         print("Error while connecting to PostgreSQL", error)
     finally:
-        if (connection):
+        if profiler:
+            profiling.finish(profiler, args, psql_conn, before)
+        if psql_conn is not None:
             psql_conn.close()
-            connection.close()
+        if engine is not None:
+            engine.dispose()
             print("PostgreSQL connection is closed")
 
 
-main()
+if __name__ == '__main__':
+    main()
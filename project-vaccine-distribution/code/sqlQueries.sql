@@ -14,33 +14,24 @@ WHERE hospital.address LIKE '%HELSINKI'
 ORDER BY ssn ASC;
 
 -- Query 3
+-- The last transport of every batch is kept in BATCH_LOCATION (see
+-- sqlCreatingDatabase.sql), so both parts are lookups instead of a scan and
+-- GROUP BY of the whole transport log.
 --Query 3 part one
-WITH LAST_LOG AS
-	(SELECT BATCH, MAX(DEP_DATE) AS LAST_DATE
-		FROM TRANSPORT_LOG
-		GROUP BY BATCH)
-SELECT LOG.BATCH,
-	LOG.DEP_HOS AS LAST_LOCATION,
-	LOG.ARR_HOS AS CURRENT_LOCATION
-FROM TRANSPORT_LOG AS LOG
-JOIN LAST_LOG ON LOG.BATCH = LAST_LOG.BATCH
-AND LOG.DEP_DATE = LAST_LOG.LAST_DATE;
+SELECT BATCH,
+	DEP_HOS AS LAST_LOCATION,
+	ARR_HOS AS CURRENT_LOCATION
+FROM BATCH_LOCATION;
 ---------------------------------
 --Query 3 part two
-WITH LAST_LOG AS
-	(SELECT BATCH, MAX(DEP_DATE) AS LAST_DATE
-		FROM TRANSPORT_LOG
-		GROUP BY BATCH)
-SELECT LOG.BATCH,
-	LOG.ARR_HOS AS LOG_LOCATION,
+SELECT LOC.BATCH,
+	LOC.ARR_HOS AS LOG_LOCATION,
 	BATCH.HOSPITAL AS CORRECT_LOCATION,
 	HOSPITAL.PHONE
-FROM TRANSPORT_LOG AS LOG
-JOIN LAST_LOG ON LOG.BATCH = LAST_LOG.BATCH
-AND LOG.DEP_DATE = LAST_LOG.LAST_DATE
-JOIN BATCH ON BATCH.ID = LAST_LOG.BATCH
+FROM BATCH_LOCATION AS LOC
+JOIN BATCH ON BATCH.ID = LOC.BATCH
 JOIN HOSPITAL ON HOSPITAL.NAME = BATCH.HOSPITAL
-WHERE LOG.ARR_HOS != BATCH.HOSPITAL;
+WHERE LOC.MISPLACED;
 
 -- Query 4
 WITH CRITICAL_PATIENTS AS
@@ -57,55 +48,44 @@ SELECT CRITICAL_PATIENTS.SSN,
 	VACCINATION_EVENT.HOSPITAL
 FROM CRITICAL_PATIENTS
 JOIN VACCINE_PATIENT ON VACCINE_PATIENT.PATIENT = CRITICAL_PATIENTS.SSN
-JOIN VACCINATION_EVENT ON VACCINATION_EVENT.HOSPITAL = VACCINE_PATIENT.HOSPITAL
+JOIN VACCINATION_EVENT ON VACCINATION_EVENT.DATE = VACCINE_PATIENT.DATE
+AND VACCINATION_EVENT.HOSPITAL = VACCINE_PATIENT.HOSPITAL
 JOIN BATCH ON BATCH.ID = VACCINATION_EVENT.BATCH
 ORDER BY SSN;
 
 -- Query 5
-CREATE VIEW patient_status AS
-SELECT patient.*, COALESCE((COUNT(patient.ssn) >= MIN(vt.doses))::INT, 0) as "vaccinationStatus"
-FROM patient
-LEFT JOIN vaccine_patient as vp
-ON vp.patient = patient.ssn
-LEFT JOIN vaccination_event as ve
-ON ve.date = vp.date AND ve.hospital = vp.hospital
-LEFT JOIN batch
-ON batch.id = ve.batch
-LEFT JOIN vaccine_type as vt
-ON vt.id = batch.vaccine_type
-GROUP BY patient.ssn
-ORDER BY patient.ssn;
+-- patient_status is kept up to date by the loader (see summaryTables.py)
+SELECT ssn, name, birthday, gender, "vaccinationStatus"
+FROM patient_status
+ORDER BY ssn;
 
 -- Query 6
-SELECT hospital.name AS hospital_name, SUM(batch.num_of_vacc) AS total_vaccines, 
-SUM(case when vaccine_type='V01' then batch.num_of_vacc else 0 end) as "V01_amount",
-SUM(case when vaccine_type='V02' then batch.num_of_vacc else 0 end) as "V02_amount",
-SUM(case when vaccine_type='V03' then batch.num_of_vacc else 0 end) as "V03_amount"
-FROM batch, hospital
-WHERE hospital.name = batch.hospital
-GROUP BY hospital.name;
-
+-- hospital_inventory has a column per vaccine type and reads the stock kept
+-- in hospital_stock (see sqlCreatingDatabase.sql and summaryTables.py)
+SELECT *
+FROM hospital_inventory;
 
 -- Query 7
-SELECT total_nums.name, symptom, ROUND( CAST(num_of_symptom AS Numeric)/num_of_patients, 2) AS frequency
-FROM (
-    SELECT vaccine_type.name, COUNT(DISTINCT vaccine_patient.patient) AS num_of_patients
-    FROM vaccine_type, vaccine_patient, vaccination_event, batch
-    WHERE vaccine_patient.date = vaccination_event.date
-    AND vaccine_patient.hospital = vaccination_event.hospital
-    AND batch.id = vaccination_event.batch
-    AND batch.vaccine_type = vaccine_type.id
-    GROUP BY vaccine_type.name
-) AS total_nums, 
-(
-    SELECT vaccine_type.name, diagnosis.symptom, COUNT(DISTINCT vaccine_patient.patient) AS num_of_symptom
-    FROM diagnosis, patient, vaccination_event, vaccine_patient, batch, vaccine_type
-    WHERE diagnosis.patient = vaccine_patient.patient
-    AND vaccine_patient.date = vaccination_event.date -- DISTINCT at some point? subquery?
-    AND vaccine_patient.date <= diagnosis.date
-    AND vaccine_patient.hospital = vaccination_event.hospital
-    AND batch.id = vaccination_event.batch
-    AND (batch.vaccine_type = vaccine_type.id)
-    GROUP BY vaccine_type.name, diagnosis.symptom
-) AS symptom_nums
-WHERE total_nums.name = symptom_nums.name;
+-- Frequency of every symptom among the diagnoses made after a dose of each
+-- vaccine type: every diagnosis counts for the vaccine type of the latest
+-- earlier dose of the patient. symptomFrequency.py runs this query with
+-- its date window in place of the infinite one and labels the frequencies.
+WITH assigned AS (
+	SELECT diagnosis.symptom, latest.vaccine_type
+	FROM diagnosis
+	CROSS JOIN LATERAL (
+		SELECT batch.vaccine_type
+		FROM vaccine_patient AS vp
+		JOIN vaccination_event AS ve ON ve.date = vp.date AND ve.hospital = vp.hospital
+		JOIN batch ON batch.id = ve.batch
+		WHERE vp.patient = diagnosis.patient AND vp.date < diagnosis.date
+		ORDER BY vp.date DESC
+		LIMIT 1
+	) AS latest
+	WHERE diagnosis.date BETWEEN '-infinity' AND 'infinity'
+)
+SELECT vaccine_type, symptom, COUNT(*) AS count,
+	COUNT(*)::DOUBLE PRECISION / SUM(COUNT(*)) OVER (PARTITION BY vaccine_type) AS frequency
+FROM assigned
+GROUP BY vaccine_type, symptom
+ORDER BY vaccine_type, symptom;
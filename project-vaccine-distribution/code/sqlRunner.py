@@ -0,0 +1,239 @@
+'''
+Running SQL scripts (sqlCreatingDatabase.sql, sqlQueries.sql, ...).
+
+The script is split into statements by a small tokenizer that understands
+quoted strings ('...', E'...'), quoted identifiers, dollar-quoted bodies
+($$...$$, $tag$...$tag$), -- line comments and nested /* */ comments, so
+semicolons or comment markers inside them don't break statements apart.
+The parsed statement list is cached by the hash of the file.
+
+A script runs in one transaction by default: either every statement is
+applied or none. Statements can be sent to the server in batches (several
+statements per round trip), and the time of every batch is reported.
+'''
+import argparse
+import hashlib
+import re
+import time
+from collections import namedtuple
+
+import dbConnection
+
+StatementTiming = namedtuple('StatementTiming', ['index', 'sql', 'seconds', 'rowcount'])
+
+_DOLLAR_QUOTE = re.compile(r'\$([A-Za-z_][A-Za-z_0-9]*)?\$')
+_QUERY_HEADER = re.compile(r'^--\s*Query\s+(\d+)\s*$', re.MULTILINE | re.IGNORECASE)
+
+# file hash -> list of statements
+_statement_cache = {}
+
+
+class SqlScriptError(Exception):
+    '''
+    A statement of a script failed. index is the position of the (first)
+    statement of the failing batch, sql its text.
+    '''
+
+    def __init__(self, index, sql, error):
+        super().__init__(f'Statement {index + 1} failed: {error}\n{sql}')
+        self.index = index
+        self.sql = sql
+        self.error = error
+
+
+def split_statements(sql):
+    '''
+    Split SQL text into statements on top level semicolons. Comments are
+    removed; quoted strings, identifiers and dollar-quoted bodies are kept
+    as they are. Returns a list of statements without the trailing ';'.
+    '''
+    statements, current = [], []
+    i, n = 0, len(sql)
+    while i < n:
+        char = sql[i]
+        if char == "'":
+            # String literal; E'...' strings can also escape with a backslash
+            escapes = i > 0 and sql[i - 1] in 'eE' and (i < 2 or not (sql[i - 2].isalnum() or sql[i - 2] == '_'))
+            j = i + 1
+            while j < n:
+                if escapes and sql[j] == '\\':
+                    j += 2
+                    continue
+                if sql[j] == "'":
+                    if j + 1 < n and sql[j + 1] == "'":
+                        j += 2
+                        continue
+                    break
+                j += 1
+            current.append(sql[i:j + 1])
+            i = j + 1
+        elif char == '"':
+            j = sql.find('"', i + 1)
+            while j != -1 and j + 1 < n and sql[j + 1] == '"':
+                j = sql.find('"', j + 2)
+            j = n - 1 if j == -1 else j
+            current.append(sql[i:j + 1])
+            i = j + 1
+        elif char == '$' and not (i > 0 and (sql[i - 1].isalnum() or sql[i - 1] in '_$')) \
+                and _DOLLAR_QUOTE.match(sql, i):
+            tag = _DOLLAR_QUOTE.match(sql, i).group(0)
+            j = sql.find(tag, i + len(tag))
+            j = n if j == -1 else j + len(tag)
+            current.append(sql[i:j])
+            i = j
+        elif sql.startswith('--', i):
+            j = sql.find('\n', i)
+            i = n if j == -1 else j
+            current.append(' ')
+        elif sql.startswith('/*', i):
+            depth, j = 1, i + 2
+            while j < n and depth:
+                if sql.startswith('/*', j):
+                    depth, j = depth + 1, j + 2
+                elif sql.startswith('*/', j):
+                    depth, j = depth - 1, j + 2
+                else:
+                    j += 1
+            current.append(' ')
+            i = j
+        elif char == ';':
+            statements.append(''.join(current))
+            current = []
+            i += 1
+        else:
+            current.append(char)
+            i += 1
+    statements.append(''.join(current))
+    return [statement.strip() for statement in statements if statement.strip()]
+
+
+def read_statements(file_path):
+    '''
+    Statements of the SQL file at file_path, parsed once per file version.
+    '''
+    with open(file_path, 'rb') as file:
+        data = file.read()
+    digest = hashlib.sha1(data).hexdigest()
+    if digest not in _statement_cache:
+        _statement_cache[digest] = split_statements(data.decode('utf-8'))
+    return list(_statement_cache[digest])
+
+
+def numbered_queries(file_path):
+    '''
+    Dict of query number -> list of statements of the "-- Query N" sections
+    of the SQL file at file_path.
+    '''
+    with open(file_path, encoding='utf-8') as file:
+        sql = file.read()
+    headers = list(_QUERY_HEADER.finditer(sql))
+    queries = {}
+    for header, following in zip(headers, headers[1:] + [None]):
+        end = following.start() if following else len(sql)
+        queries[int(header.group(1))] = split_statements(sql[header.end():end])
+    return queries
+
+
+def run_statements(statements, conn, transactional=True, batch_size=1):
+    '''
+    Execute statements over conn (SQLAlchemy or psycopg2 connection).
+
+    batch_size statements are sent to the server in one round trip. With
+    transactional=True everything is committed at the end and a failure
+    rolls the whole script back and raises SqlScriptError. Otherwise every
+    batch is committed on its own and failing batches are reported and
+    skipped.
+    Returns a list of StatementTiming, one per batch.
+    '''
+    raw = getattr(conn, 'connection', conn)
+    cursor = raw.cursor()
+    timings, errors = [], []
+    try:
+        for index in range(0, len(statements), batch_size):
+            sql = ';\n'.join(statements[index:index + batch_size])
+            start = time.perf_counter()
+            try:
+                cursor.execute(sql)
+                # Results of queries are fetched, so that their time counts too
+                if cursor.description is not None:
+                    cursor.fetchall()
+            except Exception as e:
+                raw.rollback()
+                if transactional:
+                    raise SqlScriptError(index, sql, e) from e
+                errors.append(SqlScriptError(index, sql, e))
+                continue
+            if not transactional:
+                raw.commit()
+            timings.append(StatementTiming(index, sql, time.perf_counter() - start, cursor.rowcount))
+        if transactional:
+            raw.commit()
+    finally:
+        cursor.close()
+
+    for error in errors:
+        print(f'\nError while executing SQL:\n{error}\n')
+    return timings
+
+
+def run_script(file_path, conn, transactional=True, batch_size=1):
+    '''
+    Run the SQL script at file_path, see run_statements.
+    '''
+    return run_statements(read_statements(file_path), conn, transactional=transactional,
+                          batch_size=batch_size)
+
+
+def run_sql_from_file(file_path, conn):
+    '''
+    Read and run SQL queries from a file at file_path in one transaction.
+    Returns False (and prints the error) if any statement fails.
+    '''
+    try:
+        run_script(file_path, conn)
+    except SqlScriptError as e:
+        print(f'\nError while executing SQL:\n{e}\n')
+        return False
+    return True
+
+
+def format_rows(columns, rows):
+    '''
+    The rows (sequences of values) as a text table with the column names
+    columns as a header line.
+    '''
+    cells = [[str(column) for column in columns]] + [['' if value is None else str(value) for value in row]
+                                                       for row in rows]
+    widths = [max(len(row[i]) for row in cells) for i in range(len(columns))]
+    lines = ['  '.join(value.ljust(width) for value, width in zip(row, widths)).rstrip() for row in cells]
+    lines.insert(1, '  '.join('-' * width for width in widths))
+    return '\n'.join(lines)
+
+
+def format_timings(timings):
+    '''
+    One line per batch: running number, time and the start of the SQL.
+    '''
+    lines = []
+    for timing in timings:
+        first_line = ' '.join(timing.sql.split())[:60]
+        lines.append(f'{timing.index + 1:>4} {timing.seconds * 1000:>10.2f} ms  {first_line}')
+    lines.append(f'     {sum(t.seconds for t in timings) * 1000:>10.2f} ms  total')
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run a SQL script and report statement timings.')
+    parser.add_argument('script', help='path to the .sql file')
+    parser.add_argument('--batch-size', type=int, default=1, help='statements per round trip')
+    parser.add_argument('--no-transaction', action='store_true',
+                        help='commit every batch on its own and continue after errors')
+    dbConnection.add_arguments(parser)
+    args = parser.parse_args()
+
+    connection = dbConnection.connect(args.database_url, args.statement_timeout)
+    try:
+        print(format_timings(run_script(args.script, connection, transactional=not args.no_transaction,
+                                        batch_size=args.batch_size)))
+    finally:
+        connection.close()
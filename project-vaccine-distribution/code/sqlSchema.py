@@ -0,0 +1,156 @@
+'''
+Minimal parser for the CREATE TABLE statements in sqlCreatingDatabase.sql.
+
+It extracts what the loader needs to know about the schema: the columns of
+every table with their types, primary keys, foreign keys and named CHECK
+constraints. Only the constructs used in our schema file are supported.
+'''
+import re
+from dataclasses import dataclass, field
+
+
+@dataclass
+class ForeignKey:
+    columns: list
+    ref_table: str
+    ref_columns: list
+
+
+@dataclass
+class Table:
+    name: str
+    columns: dict = field(default_factory=dict)  # column name -> SQL type
+    not_null: set = field(default_factory=set)
+    primary_key: list = field(default_factory=list)
+    foreign_keys: list = field(default_factory=list)
+    checks: dict = field(default_factory=dict)  # constraint name -> expression
+
+    @property
+    def dependencies(self):
+        '''
+        Names of the other tables this table references.
+        '''
+        return {fk.ref_table for fk in self.foreign_keys if fk.ref_table != self.name}
+
+
+_CREATE_TABLE = re.compile(r'CREATE\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)\s*\(', re.IGNORECASE)
+
+
+def _strip_comments(sql):
+    return re.sub(r'--[^\n]*', '', sql)
+
+
+def _split_top_level(body):
+    '''
+    Split the body of a CREATE TABLE on commas that are not inside parentheses.
+    '''
+    items, depth, start = [], 0, 0
+    for i, char in enumerate(body):
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif char == ',' and depth == 0:
+            items.append(body[start:i].strip())
+            start = i + 1
+    items.append(body[start:].strip())
+    return [item for item in items if item]
+
+
+def _names(text):
+    return [name.strip().strip('"').lower() for name in text.split(',')]
+
+
+def _matching_paren(text, start):
+    '''
+    Index of the parenthesis closing the one at text[start].
+    '''
+    depth = 0
+    for i in range(start, len(text)):
+        if text[i] == '(':
+            depth += 1
+        elif text[i] == ')':
+            depth -= 1
+            if depth == 0:
+                return i
+    raise ValueError('Unbalanced parentheses in CREATE TABLE')
+
+
+def _parse_item(table, item):
+    match = re.match(r'PRIMARY\s+KEY\s*\((.*)\)$', item, re.IGNORECASE | re.DOTALL)
+    if match:
+        table.primary_key = _names(match.group(1))
+        return
+
+    match = re.match(r'FOREIGN\s+KEY\s*\((.*?)\)\s*REFERENCES\s+(\w+)\s*\((.*?)\)', item,
+                     re.IGNORECASE | re.DOTALL)
+    if match:
+        table.foreign_keys.append(ForeignKey(
+            _names(match.group(1)), match.group(2).lower(), _names(match.group(3))))
+        return
+
+    match = re.match(r'CONSTRAINT\s+(\w+)\s+CHECK\s*\((.*)\)$', item, re.IGNORECASE | re.DOTALL)
+    if match:
+        table.checks[match.group(1).lower()] = ' '.join(match.group(2).split())
+        return
+
+    # Column definition: name TYPE [NOT NULL] [PRIMARY KEY] [REFERENCES t(c)]
+    match = re.match(r'(\w+)\s+(.*)$', item, re.DOTALL)
+    column, definition = match.group(1).lower(), ' '.join(match.group(2).split())
+    sql_type = re.split(r'\s+(?:NOT\s+NULL|NULL|PRIMARY\s+KEY|REFERENCES|DEFAULT|CHECK)\b',
+                        definition, maxsplit=1, flags=re.IGNORECASE)[0]
+    table.columns[column] = sql_type.upper()
+    if re.search(r'\bNOT\s+NULL\b|\bPRIMARY\s+KEY\b', definition, re.IGNORECASE):
+        table.not_null.add(column)
+    if re.search(r'\bPRIMARY\s+KEY\b', definition, re.IGNORECASE):
+        table.primary_key = [column]
+    ref = re.search(r'REFERENCES\s+(\w+)\s*\((.*?)\)', definition, re.IGNORECASE)
+    if ref:
+        table.foreign_keys.append(ForeignKey([column], ref.group(1).lower(), _names(ref.group(2))))
+
+
+def parse_schema(sql):
+    '''
+    Parse the CREATE TABLE statements in the SQL text.
+    Returns a dict of table name -> Table, in the order of the statements.
+    '''
+    sql = _strip_comments(sql)
+    tables = {}
+    for match in _CREATE_TABLE.finditer(sql):
+        table = Table(match.group(1).lower())
+        end = _matching_paren(sql, match.end() - 1)
+        for item in _split_top_level(sql[match.end():end]):
+            _parse_item(table, item)
+        tables[table.name] = table
+    return tables
+
+
+def read_schema(file_path):
+    '''
+    Parse the schema in the SQL file at file_path.
+    '''
+    with open(file_path, 'r') as file:
+        return parse_schema(file.read())
+
+
+def dependency_levels(schema, tables=None):
+    '''
+    Group tables into levels so that every table only references tables in
+    earlier levels (a topological order of the foreign key graph). Tables
+    within one level are independent of each other and can be loaded at the
+    same time. Only the tables listed in tables (default: all) are included.
+    '''
+    pending = {name: schema[name].dependencies for name in (tables or schema)}
+    for name in pending:
+        pending[name] = {dep for dep in pending[name] if dep in pending}
+
+    levels, done = [], set()
+    while pending:
+        level = [name for name, deps in pending.items() if deps <= done]
+        if not level:
+            raise ValueError('Foreign keys form a cycle between: %s' % ', '.join(sorted(pending)))
+        levels.append(level)
+        done.update(level)
+        for name in level:
+            del pending[name]
+    return levels
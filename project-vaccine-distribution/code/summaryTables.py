@@ -0,0 +1,194 @@
+'''
+Summaries of queries 5 and 6 of sqlQueries.sql, kept up to date by the
+loader (see derivedTables.py).
+
+patient_status (query 5): every patient with the number of doses they got,
+the doses their vaccine type needs and whether they are fully vaccinated
+(vaccinationStatus). It used to be a view that joined five tables and
+grouped them by patient on every read; now it is a table, and an
+incremental load only recomputes the patients whose rows changed:
+  - patient and vaccine_patient rows: their patients,
+  - vaccination_event rows: the patients vaccinated at those events,
+  - batch and vaccine_type rows: everybody (a rebuild).
+
+hospital_inventory (query 6): doses stored at every hospital, in total and
+per vaccine type. The counts are kept in hospital_stock by triggers on
+batch (see sqlCreatingDatabase.sql); hospital_inventory is a view over it
+with an "<id>_amount" column for every row of vaccine_type, generated here
+and generated again when the vaccine types change.
+
+  python summaryTables.py [--database-url URL] status [--patient SSN]
+  python summaryTables.py [--database-url URL] inventory [--hospital NAME]
+'''
+import argparse
+
+import pandas as pd
+
+import dbConnection
+from dbConnection import create_pool, query_frame, raw_cursor
+
+# {where} limits the patients
+PATIENT_STATUS = """
+    SELECT patient.*, COUNT(vp.patient) AS doses, MIN(vt.doses) AS required_doses,
+        COALESCE((COUNT(patient.ssn) >= MIN(vt.doses))::INT, 0) AS "vaccinationStatus"
+    FROM patient
+    LEFT JOIN vaccine_patient AS vp ON vp.patient = patient.ssn
+    LEFT JOIN vaccination_event AS ve ON ve.date = vp.date AND ve.hospital = vp.hospital
+    LEFT JOIN batch ON batch.id = ve.batch
+    LEFT JOIN vaccine_type AS vt ON vt.id = batch.vaccine_type
+    {where}
+    GROUP BY patient.ssn
+"""
+
+# patient_status was a view before it became a table
+DROP_PATIENT_STATUS = """
+    DO $$
+    BEGIN
+        IF (SELECT relkind FROM pg_class WHERE oid = to_regclass('patient_status')) = 'v' THEN
+            DROP VIEW patient_status;
+        ELSE
+            DROP TABLE IF EXISTS patient_status;
+        END IF;
+    END
+    $$
+"""
+
+EVENT_PATIENTS = """
+    SELECT DISTINCT vp.patient
+    FROM vaccine_patient AS vp
+    JOIN unnest(%(dates)s::date[], %(hospitals)s::text[]) AS e (date, hospital)
+        ON vp.date = e.date AND vp.hospital = e.hospital
+"""
+
+# {amounts} is filled in by create_inventory_view (a psycopg2.sql template)
+INVENTORY = """
+    CREATE VIEW hospital_inventory AS
+    SELECT hospital AS hospital_name, SUM(amount)::BIGINT AS total_vaccines{amounts}
+    FROM hospital_stock
+    GROUP BY hospital
+"""
+
+AMOUNT = ',\n        COALESCE(SUM(amount) FILTER (WHERE vaccine_type = {type}), 0)::BIGINT AS {column}'
+
+
+def rebuild_patient_status(conn):
+    '''
+    Create patient_status from scratch.
+    '''
+    cursor = raw_cursor(conn)
+    try:
+        cursor.execute(DROP_PATIENT_STATUS)
+        cursor.execute('CREATE TABLE patient_status AS ' + PATIENT_STATUS.format(where=''))
+        cursor.execute('ALTER TABLE patient_status ADD PRIMARY KEY (ssn)')
+        cursor.execute('ANALYZE patient_status')
+    finally:
+        cursor.close()
+
+
+def refresh_patient_status(conn, changes):
+    '''
+    Recompute patient_status for the patients affected by changes (see the
+    module docstring).
+    '''
+    if any(len(changes.get(table, ())) for table in ['batch', 'vaccine_type']):
+        rebuild_patient_status(conn)
+        return
+
+    patients = set()
+    if 'patient' in changes:
+        patients.update(changes['patient']['ssn'])
+    if 'vaccine_patient' in changes:
+        patients.update(changes['vaccine_patient']['patient'])
+    cursor = raw_cursor(conn)
+    try:
+        if 'vaccination_event' in changes and len(changes['vaccination_event']):
+            events = changes['vaccination_event']
+            cursor.execute(EVENT_PATIENTS, {'dates': list(pd.to_datetime(events['date']).dt.date),
+                                            'hospitals': list(events['hospital'])})
+            patients.update(patient for patient, in cursor.fetchall())
+        if not patients:
+            return
+        params = {'patients': sorted(patients)}
+        cursor.execute('DELETE FROM patient_status WHERE ssn = ANY(%(patients)s)', params)
+        cursor.execute('INSERT INTO patient_status ' + PATIENT_STATUS.format(
+            where='WHERE patient.ssn = ANY(%(patients)s)'), params)
+    finally:
+        cursor.close()
+
+
+def create_inventory_view(conn):
+    '''
+    (Re)create the view hospital_inventory with a column per vaccine type.
+    '''
+    from psycopg2 import sql
+
+    cursor = raw_cursor(conn)
+    try:
+        cursor.execute('SELECT id FROM vaccine_type ORDER BY id')
+        types = [vaccine_type for vaccine_type, in cursor.fetchall()]
+        # The ids are quoted into the statement, not passed as parameters,
+        # so a % in an id is just a character
+        amounts = sql.SQL('').join(sql.SQL(AMOUNT).format(type=sql.Literal(vaccine_type),
+                                                          column=sql.Identifier(vaccine_type + '_amount'))
+                                   for vaccine_type in types)
+        cursor.execute('DROP VIEW IF EXISTS hospital_inventory')
+        cursor.execute(sql.SQL(INVENTORY).format(amounts=amounts))
+    finally:
+        cursor.close()
+
+
+def refresh_inventory_view(conn, changes):
+    '''
+    The stock itself is kept up to date by the triggers on batch; the view
+    only changes with the vaccine types.
+    '''
+    if len(changes.get('vaccine_type', ())):
+        create_inventory_view(conn)
+
+
+def patient_status(conn, patients=None):
+    '''
+    Rows of patient_status, of all patients or of the SSNs patients.
+    '''
+    if patients is None:
+        return query_frame(conn, 'SELECT * FROM patient_status ORDER BY ssn')
+    return query_frame(conn, 'SELECT * FROM patient_status WHERE ssn = ANY(%s) ORDER BY ssn', (list(patients),))
+
+
+def hospital_inventory(conn, hospitals=None):
+    '''
+    Rows of hospital_inventory, of all hospitals or of the hospitals
+    hospitals.
+    '''
+    if hospitals is None:
+        return query_frame(conn, 'SELECT * FROM hospital_inventory ORDER BY hospital_name')
+    return query_frame(conn, 'SELECT * FROM hospital_inventory WHERE hospital_name = ANY(%s) ORDER BY hospital_name',
+                  (list(hospitals),))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Vaccination status of the patients and stock of the hospitals.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    status = commands.add_parser('status', help='vaccination status of patients (query 5)')
+    status.add_argument('--patient', action='append', help='SSN of a patient (can be repeated, default: all)')
+    inventory = commands.add_parser('inventory', help='doses stored at the hospitals (query 6)')
+    inventory.add_argument('--hospital', action='append', help='name of a hospital (can be repeated, default: all)')
+    dbConnection.add_arguments(parser)
+    args = parser.parse_args(argv)
+
+    engine = create_pool(args.database_url, pool_size=1, statement_timeout_ms=args.statement_timeout)
+    try:
+        with engine.connect() as conn:
+            if args.command == 'status':
+                res = patient_status(conn, args.patient)
+            else:
+                res = hospital_inventory(conn, args.hospital)
+    finally:
+        engine.dispose()
+
+    with pd.option_context('display.max_rows', None, 'display.width', 200):
+        print(res)
+
+
+if __name__ == '__main__':
+    main()
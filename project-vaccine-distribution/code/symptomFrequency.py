@@ -0,0 +1,139 @@
+'''
+Symptom frequencies per vaccine type, a generalization of Part 3
+requirement 7.
+
+Every diagnosis is assigned to the most recent vaccination of the patient
+before the diagnosis, and the frequency of a symptom for a vaccine type is
+its share of all the diagnoses assigned to that vaccine type:
+  - very common: at least 10 %,
+  - common: at least 5 %,
+  - rare: less than that.
+
+One query does all of it, Query 7 of sqlQueries.sql (so it is the same for
+"vaccinedist.py query --only 7"): a LATERAL lookup finds the latest earlier
+dose of every diagnosis through the primary key vaccine_patient(patient,
+date) (an index scan backwards, one row), the counts are grouped once and
+the totals per vaccine type are a window SUM over the counts. Here the
+diagnoses can be limited to a date window, which is read with the index
+diagnosis(date) of sqlIndexes.sql, so the cost depends on the size of the
+window and not on the size of the tables. The labels are given to the
+frequencies afterwards (frequency_labels).
+
+  python symptomFrequency.py [--database-url URL] --start 2021-05-01 --end 2021-05-31
+'''
+import argparse
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import dbConnection
+from dbConnection import create_pool, query_frame
+from sqlRunner import numbered_queries
+
+QUERIES_FILE = Path(__file__).parent / 'sqlQueries.sql'
+QUERY = 7
+# The date window replaces the open one of Query 7
+OPEN_WINDOW = "BETWEEN '-infinity' AND 'infinity'"
+WINDOW = 'BETWEEN %(start)s AND %(end)s'
+
+# (lowest frequency, label) from the most frequent down; lower is 'rare'
+FREQUENCY_LABELS = [(0.1, 'very common'), (0.05, 'common')]
+RARE = 'rare'
+# Symptoms that were not diagnosed after any dose of a vaccine type
+NOT_DIAGNOSED = '-'
+
+
+def frequencies_sql(path=QUERIES_FILE):
+    '''
+    Query 7 of the SQL file at path with the date window as parameters
+    (see query_params).
+    '''
+    sql, = numbered_queries(path)[QUERY]
+    if sql.count(OPEN_WINDOW) != 1:
+        raise ValueError('Query %d of %s has no date window %s' % (QUERY, path, OPEN_WINDOW))
+    return sql.replace(OPEN_WINDOW, WINDOW)
+
+
+FREQUENCIES = frequencies_sql()
+
+
+def query_params(start=None, end=None):
+    '''
+    Parameters of FREQUENCIES. start and end are dates or ISO date strings,
+    both included in the window; without them the window is open.
+    '''
+    return {'start': pd.Timestamp(start).date() if start is not None else '-infinity',
+            'end': pd.Timestamp(end).date() if end is not None else 'infinity'}
+
+
+def frequency_labels(frequencies):
+    '''
+    Label of every frequency (a share between 0 and 1), see FREQUENCY_LABELS.
+    '''
+    frequencies = np.asarray(frequencies, dtype=float)
+    return np.select([frequencies >= low for low, _ in FREQUENCY_LABELS],
+                     [label for _, label in FREQUENCY_LABELS], default=RARE)
+
+
+def symptom_counts(conn, start=None, end=None):
+    '''
+    Number of diagnoses, frequency and frequency label of every symptom
+    diagnosed after a dose of every vaccine type, for the diagnoses between
+    start and end. conn is a SQLAlchemy or psycopg2 connection.
+    '''
+    counts = query_frame(conn, FREQUENCIES, query_params(start, end))
+    counts['frequency_text'] = frequency_labels(counts['frequency'])
+    return counts
+
+
+def frequency_matrix(counts, symptoms):
+    '''
+    The frequency labels of counts (see symptom_counts) as a table of the
+    symptoms (the rows of the data frame symptoms, with the symptom in the
+    column name) and a column per vaccine type, NOT_DIAGNOSED where a
+    symptom wasn't diagnosed after that vaccine type.
+    '''
+    matrix = counts.pivot(index='symptom', columns='vaccine_type', values='frequency_text')
+    matrix.columns.name = None
+    res = symptoms.merge(matrix, left_on='name', right_index=True, how='left')
+    return res.fillna(NOT_DIAGNOSED).reset_index(drop=True)
+
+
+def symptom_frequencies(conn, start=None, end=None):
+    '''
+    Requirement 7 for the diagnoses between start and end: every symptom
+    with its frequency label per vaccine type.
+    '''
+    return frequency_matrix(symptom_counts(conn, start, end), query_frame(conn, 'SELECT * FROM symptoms'))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Frequencies of the symptoms diagnosed after each vaccine type.')
+    parser.add_argument('--start', help='first day of the diagnoses (default: all)')
+    parser.add_argument('--end', help='last day of the diagnoses (default: all)')
+    parser.add_argument('--counts', action='store_true',
+                        help='print the counts and frequencies instead of the table of labels')
+    parser.add_argument('--out', help='write the result to this CSV file instead of printing it')
+    dbConnection.add_arguments(parser)
+    args = parser.parse_args(argv)
+
+    engine = create_pool(args.database_url, pool_size=1, statement_timeout_ms=args.statement_timeout)
+    try:
+        with engine.connect() as conn:
+            if args.counts:
+                res = symptom_counts(conn, args.start, args.end)
+            else:
+                res = symptom_frequencies(conn, args.start, args.end)
+    finally:
+        engine.dispose()
+
+    if args.out:
+        res.to_csv(args.out, index=False)
+    else:
+        with pd.option_context('display.max_rows', None, 'display.width', 200):
+            print(res)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+'''
+Reading tables into compact, typed data frames.
+
+pd.read_sql("select * ...") fetches the whole result to the client at once
+and keeps every text column as Python strings, so a hospital name or a
+symptom repeated in a million rows is stored a million times. Here
+  - the rows are streamed in chunks through a server-side (named) cursor,
+    so only one chunk of raw tuples is in memory at a time,
+  - every chunk gets the dtypes declared in TABLE_DTYPES: categoricals for
+    the few distinct values (hospitals, symptoms, vaccine types, genders,
+    ...), datetime64 for dates and bool for flags,
+  - optionally every chunk is aggregated right away and only the partial
+    aggregates are kept and combined at the end.
+'''
+import itertools
+
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+DEFAULT_CHUNK_ROWS = 50000
+
+# Columns not listed here keep the type they get from the database (object
+# for text). SSNs and ids are (nearly) unique, so they stay as strings.
+TABLE_DTYPES = {
+    'vaccine_type': {'doses': 'int16', 'temp_min': 'int16', 'temp_max': 'int16'},
+    'manufacturer': {'origin': 'category', 'vaccine_type': 'category'},
+    'hospital': {},
+    'batch': {'num_of_vacc': 'int32', 'vaccine_type': 'category', 'manufacturer': 'category',
+              'prod_date': 'datetime64[ns]', 'exp_date': 'datetime64[ns]', 'hospital': 'category'},
+    'transport_log': {'dep_hos': 'category', 'arr_hos': 'category',
+                      'dep_date': 'datetime64[ns]', 'arr_date': 'datetime64[ns]'},
+    'staff': {'birthday': 'datetime64[ns]', 'role': 'category', 'vacc_status': 'bool', 'hospital': 'category'},
+    'vaccination_shift': {'hospital': 'category', 'weekday': 'category'},
+    'vaccination_event': {'date': 'datetime64[ns]', 'hospital': 'category'},
+    'patient': {'birthday': 'datetime64[ns]', 'gender': 'category'},
+    'vaccine_patient': {'date': 'datetime64[ns]', 'hospital': 'category'},
+    'symptoms': {'critical': 'bool'},
+    'diagnosis': {'symptom': 'category', 'date': 'datetime64[ns]'},
+}
+
+_cursor_names = itertools.count()
+
+
+def _typed(rows, columns, dtypes):
+    df = pd.DataFrame.from_records(rows, columns=columns)
+    for column, dtype in dtypes.items():
+        if column not in df.columns:
+            continue
+        if dtype.startswith('datetime64'):
+            df[column] = pd.to_datetime(df[column]).astype(dtype)
+        else:
+            df[column] = df[column].astype(dtype)
+    return df
+
+
+def iter_query_chunks(conn, sql, params=None, dtypes=None, chunk_rows=DEFAULT_CHUNK_ROWS):
+    '''
+    Run sql over a server-side cursor and yield the result as typed data
+    frames of at most chunk_rows rows. conn is a SQLAlchemy or psycopg2
+    connection; the named cursor needs a transaction, so conn must not be in
+    autocommit mode. An empty result gives one empty frame with the columns
+    of the query.
+    '''
+    raw = getattr(conn, 'connection', conn)
+    cursor = raw.cursor(name='table_reader_%d' % next(_cursor_names))
+    cursor.itersize = chunk_rows
+    try:
+        cursor.execute(sql, params)
+        columns = None
+        while True:
+            rows = cursor.fetchmany(chunk_rows)
+            if columns is None:
+                columns = [d[0] for d in cursor.description]
+                if not rows:
+                    yield _typed(rows, columns, dtypes or {})
+            if not rows:
+                break
+            yield _typed(rows, columns, dtypes or {})
+    finally:
+        cursor.close()
+
+
+def iter_table_chunks(conn, table, columns=None, where=None, params=None, chunk_rows=DEFAULT_CHUNK_ROWS):
+    '''
+    The rows of table (optionally only columns, and rows matching the SQL
+    condition where) as typed data frames of at most chunk_rows rows.
+    '''
+    select = ', '.join('"%s"' % c for c in columns) if columns else '*'
+    sql = 'SELECT %s FROM "%s"' % (select, table)
+    if where:
+        sql += ' WHERE ' + where
+    yield from iter_query_chunks(conn, sql, params, TABLE_DTYPES.get(table, {}), chunk_rows)
+
+
+def concat_chunks(chunks, columns=None):
+    '''
+    Concatenate typed chunks into one data frame. Categorical columns stay
+    categorical even when the chunks saw different categories. columns is
+    used for the empty frame when there are no chunks.
+    '''
+    chunks = list(chunks)
+    if not chunks:
+        return pd.DataFrame(columns=columns)
+    if len(chunks) == 1:
+        return chunks[0]
+    categorical = [c for c in chunks[0].columns if isinstance(chunks[0][c].dtype, pd.CategoricalDtype)]
+    df = pd.concat([chunk.drop(columns=categorical) for chunk in chunks], ignore_index=True)
+    for column in categorical:
+        df[column] = union_categoricals([chunk[column] for chunk in chunks])
+    return df[chunks[0].columns]
+
+
+def read_table(conn, table, columns=None, where=None, params=None, chunk_rows=DEFAULT_CHUNK_ROWS,
+               aggregate=None, combine='sum'):
+    '''
+    Read table into one typed data frame, see iter_table_chunks.
+
+    With aggregate (a function data frame -> Series/data frame with the
+    group keys as index) every chunk is aggregated as soon as it is read and
+    only the partial results are kept. They are combined per group with
+    combine (any groupby aggregation: 'sum', 'min', 'max', ...), e.g.
+        read_table(conn, 'vaccine_patient', ['patient'],
+                   aggregate=lambda df: df.groupby('patient').size())
+    gives the number of doses per patient.
+    '''
+    chunks = iter_table_chunks(conn, table, columns, where, params, chunk_rows)
+    if aggregate is None:
+        return concat_chunks(chunks, columns)
+
+    partials = [aggregate(chunk) for chunk in chunks]
+    if not partials:
+        return pd.Series(dtype='float64')
+    result = pd.concat(partials)
+    levels = list(range(result.index.nlevels))
+    return result.groupby(level=levels, observed=True).agg(combine)
+
+
+def memory_usage_mb(df):
+    '''
+    Memory used by the data frame df including its strings, in MB.
+    '''
+    return df.memory_usage(deep=True).sum() / 1024 ** 2
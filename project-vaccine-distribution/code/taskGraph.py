@@ -0,0 +1,208 @@
+'''
+Running analysis tasks as a dependency graph.
+
+Every task declares its inputs: names of other tasks or of source tables.
+The scheduler
+  - reads every source table that is needed exactly once (in a thread, over
+    its own connection) into a shared cache,
+  - starts a task as soon as all its inputs are in the cache, so
+    independent tasks run at the same time: 'sql' tasks (mostly waiting
+    for the database) in a thread pool with their own connection, 'pandas'
+    tasks marked heavy (CPU bound for long enough to pay for pickling
+    their inputs and result) in a process pool and the other, cheap
+    'pandas' tasks in the thread pool as well,
+  - only runs what the requested targets need.
+The result of every task is stored in the cache under the task's name.
+Every task (and table read) is a stage of the active profiling.Profiler;
+tasks in the process pool are profiled there and their records sent back.
+With a resultCache.ResultCache results of earlier runs are reused while the
+tables they depend on haven't changed, and the tasks (and tables) only
+needed to compute them are skipped.
+'''
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Callable
+
+import profiling
+from dbConnection import run_with_connection
+from tableReader import read_table
+
+DEFAULT_THREADS = 4
+DEFAULT_PROCESSES = 2
+
+
+@dataclass
+class Task:
+    '''
+    A unit of work. function is called with the results of inputs as
+    positional arguments (in the order of inputs) and with params as keyword
+    arguments; 'sql' tasks also get a SQLAlchemy connection as the first
+    argument, which is committed after the task. 'pandas' tasks with heavy
+    run in another process, so function and its arguments must be
+    picklable (module level functions are); the data frames are copied to
+    that process and back, so only tasks that compute long enough to make
+    up for that should be heavy.
+
+    reads lists the tables a 'sql' task queries itself (for the result
+    cache); tasks with side effects (like storing a table) set cacheable to
+    False.
+    '''
+    name: str
+    function: Callable
+    inputs: list = field(default_factory=list)
+    params: dict = field(default_factory=dict)
+    kind: str = 'pandas'
+    reads: list = field(default_factory=list)
+    cacheable: bool = True
+    heavy: bool = False
+
+
+def _run_sql(engine, function, args, kwargs):
+    return run_with_connection(engine, function, *args, **kwargs)
+
+
+def _timed(name, function, *args):
+    start = time.perf_counter()
+    with profiling.stage(name) as current:
+        result = function(*args)
+        current.rows_out = profiling.count_rows(result)
+    return result, time.perf_counter() - start, []
+
+
+def _timed_in_process(name, profile, function, *args):
+    start = time.perf_counter()
+    result, records = profiling.run_profiled(name, profile, function, *args)
+    return result, time.perf_counter() - start, records
+
+
+def required_tasks(tasks, targets, done=()):
+    '''
+    Names of the tasks needed to compute targets (including the targets).
+    The inputs of tasks in done are not needed.
+    '''
+    by_name = {task.name: task for task in tasks}
+    needed, stack = set(), list(targets)
+    while stack:
+        name = stack.pop()
+        if name in needed or name not in by_name:
+            continue
+        needed.add(name)
+        if name not in done:
+            stack.extend(by_name[name].inputs)
+    return needed
+
+
+def source_tables(tasks, name):
+    '''
+    The tables the result of task name depends on, directly or through
+    its inputs.
+    '''
+    by_name = {task.name: task for task in tasks}
+    tables = set()
+    for needed in required_tasks(tasks, [name]):
+        task = by_name[needed]
+        tables.update(task.reads)
+        tables.update(i for i in task.inputs if i not in by_name)
+    return tables
+
+
+def _cached_results(tasks, engine, targets, cache, result_cache):
+    '''
+    Load the results of the needed tasks that result_cache has for the
+    current table versions into cache. Returns the cache keys of the
+    cacheable tasks that still have to run.
+    '''
+    from resultCache import result_key, table_fingerprints
+
+    by_name = {task.name: task for task in tasks}
+    needed = [name for name in required_tasks(tasks, targets) if by_name[name].cacheable]
+    dependencies = {name: source_tables(tasks, name) for name in needed}
+    with engine.connect() as conn:
+        fingerprints = table_fingerprints(conn, set().union(*dependencies.values()))
+        conn.rollback()
+
+    keys = {}
+    for name in needed:
+        task = by_name[name]
+        if name in cache or any(fingerprints[table] is None for table in dependencies[name]):
+            # Tables that don't exist (yet) can't be fingerprinted
+            continue
+        key = result_key(name, task.function, task.params,
+                         {table: fingerprints[table] for table in dependencies[name]})
+        hit, result = result_cache.get(key)
+        if hit:
+            cache[name] = result
+        else:
+            keys[name] = key
+    return keys
+
+
+def run_tasks(tasks, engine, targets=None, cache=None, threads=DEFAULT_THREADS, processes=DEFAULT_PROCESSES,
+              reader=read_table, result_cache=None):
+    '''
+    Run the tasks needed for targets (default: all tasks). Inputs that are
+    not tasks are source tables, read with reader(conn, table).
+    With processes=0 heavy 'pandas' tasks run in the thread pool as well.
+
+    cache (a dict) may already hold results or tables; they are not
+    computed again. Returns the cache with the results of all tasks run and
+    the timings as cache['_timings'] (name -> seconds). result_cache is an
+    optional resultCache.ResultCache.
+    '''
+    by_name = {task.name: task for task in tasks}
+    targets = targets or list(by_name)
+    cache = {} if cache is None else cache
+    timings = cache.setdefault('_timings', {})
+    keys = _cached_results(tasks, engine, targets, cache, result_cache) if result_cache else {}
+    needed = required_tasks(tasks, targets, done=cache)
+    tables = {name for task in needed if task not in cache
+              for name in by_name[task].inputs if name not in by_name}
+
+    pending = {name for name in needed | tables if name not in cache}
+    thread_pool = ThreadPoolExecutor(max_workers=threads)
+    process_pool = ProcessPoolExecutor(max_workers=processes) if processes else None
+    profiler = profiling.active()
+    profile = None if profiler is None else profiler.trace_memory
+    running = {}
+    try:
+        while pending or running:
+            for name in sorted(pending):
+                if name in tables:
+                    future = thread_pool.submit(_timed, 'read ' + name, _run_sql, engine, reader, [name], {})
+                else:
+                    task = by_name[name]
+                    if any(i not in cache for i in task.inputs):
+                        continue
+                    args = [cache[i] for i in task.inputs]
+                    if task.kind == 'sql':
+                        future = thread_pool.submit(_timed, name, _run_sql, engine, task.function, args, task.params)
+                    elif task.heavy and process_pool:
+                        future = process_pool.submit(_timed_in_process, name, profile, _call, task.function, args,
+                                                     task.params)
+                    else:
+                        future = thread_pool.submit(_timed, name, _call, task.function, args, task.params)
+                running[future] = name
+                pending.discard(name)
+
+            if not running:
+                raise ValueError('Tasks with unresolvable inputs: %s' % ', '.join(sorted(pending)))
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                cache[name], timings[name], records = future.result()
+                if profiler is not None:
+                    profiler.add(records)
+                if name in keys:
+                    result_cache.put(keys[name], cache[name])
+    finally:
+        for future in running:
+            future.cancel()
+        thread_pool.shutdown(wait=True)
+        if process_pool:
+            process_pool.shutdown(wait=True)
+    return cache
+
+
+def _call(function, args, kwargs):
+    return function(*args, **kwargs)
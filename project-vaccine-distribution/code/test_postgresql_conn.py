@@ -1,35 +1,28 @@
 # Source: https://pynative.com/python-postgresql-tutorial/
-import psycopg2
 from psycopg2 import Error
 
+from dbConnection import create_pool, describe
+
+# NOTE:
+# The database and the credentials are not stored here. Set them in the
+# environment before running this file, e.g.
+#   export VACCINEDIST_DATABASE_URL=postgresql+psycopg2://grp10@dbcourse2022.cs.aalto.fi:5432/grp10_vaccinedist
+#   export PGPASSWORD=...
+# (see dbConnection.py)
+engine = None
 try:
-   # Connect to an test database 
-   # NOTE: 
-   # 1. NEVER store credential like this in practice. This is only for testing purpose
-   # 2. Replace your "database" name, "user" and "password" that we provide to test the connection to your database 
-   connection = psycopg2.connect(
-   database='grp10_vaccinedist',  # TO BE REPLACED
-   user='grp10',    # TO BE REPLACED
-   password='VeKQ^hLf', # TO BE REPLACED
-   host='dbcourse2022.cs.aalto.fi',
-   port='5432'
-   )
+   # Connect to the test database through the connection pool
+   engine = create_pool(pool_size=1)
 
-   # Create a cursor to perform database operations
-   cursor = connection.cursor()
-   # Print PostgreSQL details
+   # Print PostgreSQL details and execute SELECT version()
+   url, version = describe(engine)
    print("PostgreSQL server information")
-   print(connection.get_dsn_parameters(), "\n")
-   # Executing a SQL query
-   cursor.execute("SELECT version();")
-   # Fetch result
-   record = cursor.fetchone()
-   print("You are connected to - ", record, "\n")
+   print(url, "\n")
+   print("You are connected to - ", version, "\n")
 
 except (Exception, Error) as error:
    print("Error while connecting to PostgreSQL", error)
 finally:
-   if (connection):
-      cursor.close()
-      connection.close()
+   if (engine):
+      engine.dispose()
       print("PostgreSQL connection is closed")
@@ -0,0 +1,8 @@
+'''
+The modules of the project are scripts in the code directory, imported by
+their names.
+'''
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from cohorts import AGE_EDGES, AGE_GROUPS, age_group_codes, age_groups, ages_at, status_distribution
+
+
+def test_ages_on_the_edges():
+    # Exactly on an edge belongs to the group starting there
+    codes = age_group_codes([0, 9, 10, 19, 20, 39, 40, 59, 60, 120])
+    assert codes.tolist() == [0, 0, 1, 1, 2, 2, 3, 3, 4, 4]
+    assert age_group_codes(AGE_EDGES).tolist() == list(range(len(AGE_EDGES)))
+
+
+def test_ages_below_the_first_edge_and_missing():
+    assert age_group_codes([-1, -0.5, np.nan]).tolist() == [-1, -1, -1]
+    assert age_groups([-1, np.nan, 0]).tolist() == [None, None, '0-9']
+
+
+def test_ages_at_birthdays():
+    birthdays = pd.to_datetime(['2000-06-15', '2000-06-16', '2011-06-15', '2030-01-01', None])
+    ages = ages_at(birthdays, '2021-06-15')
+    assert ages[:4].tolist() == [21, 20, 10, -9]
+    assert np.isnan(ages[4])
+
+
+@pytest.mark.parametrize('reference, age', [('2021-02-28', 20), ('2021-03-01', 21), ('2024-02-28', 23),
+                                            ('2024-02-29', 24)])
+def test_ages_at_for_29_february(reference, age):
+    # Born on 29 February: a year older on 1 March, or on 29 February in leap years
+    assert ages_at(pd.to_datetime(['2000-02-29']), reference).tolist() == [age]
+
+
+def test_empty_input():
+    assert ages_at(pd.to_datetime([]), '2021-01-01').tolist() == []
+    assert age_group_codes([]).tolist() == []
+    assert age_groups([]).tolist() == []
+    status = status_distribution([], [])
+    assert status.shape == (3, 0)
+    assert list(status.index) == ['0-vacc', '1-vacc', '2-vacc']
+
+
+def test_status_distribution():
+    groups = ['0-9', '0-9', '60+', '60+', '60+', None]
+    doses = [0, 2, 1, 1, 3, 2]
+    status = status_distribution(groups, doses)
+    assert list(status.columns) == ['0-9', '60+']
+    assert list(status.index) == ['0-vacc', '1-vacc', '2-vacc', '3-vacc']
+    assert status['0-9'].tolist() == [50.0, 0.0, 50.0, 0.0]
+    assert status['60+'].tolist() == pytest.approx([0.0, 200 / 3, 0.0, 100 / 3])
+    assert set(status.columns) <= set(AGE_GROUPS)
@@ -0,0 +1,104 @@
+'''
+Requirements 1-6 computed in pandas and as SQL give identical frames.
+
+The comparison against the database needs a PostgreSQL database whose
+tables may be replaced, given by $VACCINEDIST_TEST_DATABASE_URL (a
+SQLAlchemy URL); it is skipped otherwise. The tests without a database
+check the parts the two versions share: the comparison of the frames and
+the requirement 6 table built from the rows of the SQL GROUP BY.
+'''
+import datetime
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import cohorts
+import databaseAnalysis
+
+CODE_DIR = Path(__file__).parent.parent
+TEST_URL_ENV = 'VACCINEDIST_TEST_DATABASE_URL'
+
+
+@pytest.fixture(scope='module')
+def generated_db():
+    url = os.environ.get(TEST_URL_ENV)
+    if not url:
+        pytest.skip('$%s is not set' % TEST_URL_ENV)
+    from dataGenerator import copy_to_database
+    from dbConnection import create_pool
+    from derivedTables import rebuild_all
+    from partitioning import create_schema
+    from sqlRunner import run_script
+
+    engine = create_pool(url)
+    try:
+        with engine.connect() as conn:
+            create_schema(conn, CODE_DIR / 'sqlCreatingDatabase.sql')
+            copy_to_database(conn, scale=0.2, seed=1)
+            run_script(CODE_DIR / 'sqlIndexes.sql', conn)
+            rebuild_all(conn)
+            conn.connection.commit()
+        yield engine
+    finally:
+        engine.dispose()
+
+
+# Before most birthdays of the generated patients (negative ages), in the
+# middle of them and after all of them
+@pytest.mark.parametrize('now', ['1950-01-01', '1990-06-01', '2022-01-01'])
+def test_sql_and_pandas_requirements_are_identical(generated_db, now):
+    with generated_db.connect() as conn:
+        databaseAnalysis.compare_requirements(conn, pd.Timestamp(now))
+
+
+def _patients():
+    return pd.DataFrame({
+        'ssn': ['p1', 'p2', 'p3', 'p4', 'p5', 'p6'],
+        'birthday': pd.to_datetime(['2015-03-01', '2001-01-01', '1960-06-30', '1999-12-31', '2030-01-01',
+                                    '1950-02-01']),
+    })
+
+
+def test_status_from_sql_counts_matches_pandas():
+    now = pd.Timestamp('2021-06-30')
+    patients = _patients()
+    vaccinated = pd.Series(['p1', 'p2', 'p2', 'p3', 'p3', 'p3', 'p5'])
+
+    groups = cohorts.age_groups(cohorts.ages_at(patients['birthday'], now))
+    doses = cohorts.dose_counts(patients['ssn'], vaccinated)
+    pandas_status = cohorts.status_distribution(groups, doses)
+
+    # The rows of STATUS_COUNTS: age group index (NULL below the first
+    # edge), number of doses, patients
+    codes = cohorts.age_group_codes(cohorts.ages_at(patients['birthday'], now)).astype(float)
+    codes[codes < 0] = np.nan
+    rows = pd.DataFrame({'age_group': codes, 'vacc_status': doses}).groupby(
+        ['age_group', 'vacc_status'], dropna=False).size().reset_index(name='patients')
+    sql_status = cohorts.status_from_counts(rows)
+
+    pd.testing.assert_frame_equal(pandas_status, sql_status)
+    assert list(sql_status.index) == ['0-vacc', '1-vacc', '2-vacc', '3-vacc']
+
+
+def test_normalized_ignores_the_representation_of_the_results():
+    pandas_frame = pd.DataFrame({
+        'ssn': pd.Categorical(['b', 'a']),
+        'date_of_birth': pd.to_datetime(['2000-01-02', '1990-05-06']),
+        'symptom': ['fever', None],
+    })
+    sql_frame = pd.DataFrame({
+        'index': [0, 1],
+        'ssn': ['a', 'b'],
+        'date_of_birth': [datetime.date(1990, 5, 6), datetime.date(2000, 1, 2)],
+        'symptom': [None, 'fever'],
+    })
+    pd.testing.assert_frame_equal(databaseAnalysis._normalized(pandas_frame),
+                                  databaseAnalysis._normalized(sql_frame), check_dtype=False)
+
+    sql_frame.loc[0, 'date_of_birth'] = datetime.date(1990, 5, 7)
+    with pytest.raises(AssertionError):
+        pd.testing.assert_frame_equal(databaseAnalysis._normalized(pandas_frame),
+                                      databaseAnalysis._normalized(sql_frame), check_dtype=False)
@@ -0,0 +1,27 @@
+import numpy as np
+import pytest
+
+from reserveEstimator import merge, remove
+
+
+def _stats(values):
+    values = np.asarray(values, dtype=float)
+    if len(values) == 0:
+        return 0, 0.0, 0.0
+    return len(values), values.mean(), float(((values - values.mean()) ** 2).sum())
+
+
+def test_merge_equals_stats_of_the_union():
+    a, b = [80.0, 95.5, 101.0], [70.0, 130.0]
+    assert merge(_stats(a), _stats(b)) == pytest.approx(_stats(a + b))
+
+
+def test_merge_with_nothing():
+    assert merge(_stats([]), _stats([90.0])) == pytest.approx(_stats([90.0]))
+    assert merge(_stats([]), _stats([])) == (0, 0.0, 0.0)
+
+
+def test_remove_is_the_inverse_of_merge():
+    a, b = [80.0, 95.5, 101.0, 99.0], [70.0, 130.0]
+    assert remove(_stats(a + b), _stats(b)) == pytest.approx(_stats(a))
+    assert remove(_stats(b), _stats(b)) == (0, 0.0, 0.0)
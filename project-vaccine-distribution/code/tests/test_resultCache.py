@@ -0,0 +1,33 @@
+import inspect
+
+import analysisSql
+import cohorts
+import databaseAnalysis
+import resultCache
+from resultCache import _project_modules, result_key
+
+FINGERPRINTS = {'patient': ('statistics', 1, ((1, 2, 3, 0, 0),)), 'vaccine_patient': ('statistics', 4, ((4, 5, 6, 0, 0),))}
+
+
+def test_project_modules_follow_delegated_functions():
+    names = [module.__name__ for module in _project_modules(databaseAnalysis)]
+    assert {'databaseAnalysis', 'symptomFrequency', 'cohorts', 'reserveEstimator'} <= set(names)
+    assert 'pandas' not in names
+
+
+def test_result_key_changes_with_a_delegated_module(monkeypatch):
+    key = result_key('age_groups', analysisSql.patient_vaccination_status, {}, FINGERPRINTS)
+    assert result_key('age_groups', analysisSql.patient_vaccination_status, {}, FINGERPRINTS) == key
+
+    getsource = inspect.getsource
+    monkeypatch.setattr(resultCache.inspect, 'getsource',
+                        lambda module: getsource(module) + ('# edited' if module is cohorts else ''))
+    assert result_key('age_groups', analysisSql.patient_vaccination_status, {}, FINGERPRINTS) != key
+
+
+def test_result_key_changes_with_sql_read_from_a_file(monkeypatch):
+    import symptomFrequency
+
+    key = result_key('symptom_frequencies', databaseAnalysis.symptom_frequencies, {}, FINGERPRINTS)
+    monkeypatch.setattr(symptomFrequency, 'FREQUENCIES', symptomFrequency.FREQUENCIES + ' LIMIT 1')
+    assert result_key('symptom_frequencies', databaseAnalysis.symptom_frequencies, {}, FINGERPRINTS) != key
@@ -0,0 +1,23 @@
+from sqlRunner import split_statements
+
+
+def test_split_on_top_level_semicolons():
+    assert split_statements('SELECT 1; SELECT 2;\n') == ['SELECT 1', 'SELECT 2']
+
+
+def test_semicolons_in_quotes_and_dollar_bodies_are_kept():
+    sql = """
+        SELECT 'a;b', "c;d";
+        CREATE FUNCTION f() RETURNS INT AS $body$ SELECT 1; $body$ LANGUAGE sql;
+        DO $$ BEGIN PERFORM 1; END $$
+    """
+    assert split_statements(sql) == [
+        """SELECT 'a;b', "c;d\"""",
+        'CREATE FUNCTION f() RETURNS INT AS $body$ SELECT 1; $body$ LANGUAGE sql',
+        'DO $$ BEGIN PERFORM 1; END $$',
+    ]
+
+
+def test_comments_are_removed():
+    sql = 'SELECT 1; -- one; two\n/* three; /* nested; */ four; */ SELECT 2'
+    assert split_statements(sql) == ['SELECT 1', 'SELECT 2']
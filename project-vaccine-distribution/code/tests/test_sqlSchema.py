@@ -0,0 +1,45 @@
+from pathlib import Path
+
+import pytest
+
+from sqlSchema import dependency_levels, parse_schema, read_schema
+
+SCHEMA = """
+    CREATE TABLE a (id TEXT PRIMARY KEY);
+    CREATE TABLE b (id TEXT PRIMARY KEY, a TEXT REFERENCES a(id));
+    CREATE TABLE c (id TEXT PRIMARY KEY);
+    CREATE TABLE d (
+        b TEXT NOT NULL,
+        c TEXT NOT NULL,
+        PRIMARY KEY (b, c),
+        FOREIGN KEY (b) REFERENCES b(id),
+        FOREIGN KEY (c) REFERENCES c(id)
+    );
+"""
+
+
+def test_dependency_levels():
+    levels = dependency_levels(parse_schema(SCHEMA))
+    assert [sorted(level) for level in levels] == [['a', 'c'], ['b'], ['d']]
+
+
+def test_dependency_levels_of_some_tables():
+    assert dependency_levels(parse_schema(SCHEMA), ['d', 'c']) == [['c'], ['d']]
+
+
+def test_cycle_raises():
+    schema = parse_schema("""
+        CREATE TABLE x (id TEXT PRIMARY KEY, y TEXT REFERENCES y(id));
+        CREATE TABLE y (id TEXT PRIMARY KEY, x TEXT REFERENCES x(id));
+    """)
+    with pytest.raises(ValueError):
+        dependency_levels(schema)
+
+
+def test_project_schema_parents_come_first():
+    schema = read_schema(Path(__file__).parent.parent / 'sqlCreatingDatabase.sql')
+    seen = set()
+    for level in dependency_levels(schema):
+        for table in level:
+            assert schema[table].dependencies <= seen
+        seen.update(level)
@@ -0,0 +1,39 @@
+import pandas as pd
+import pytest
+
+from symptomFrequency import NOT_DIAGNOSED, OPEN_WINDOW, frequencies_sql, frequency_labels, frequency_matrix
+
+
+def _original_label(frequency):
+    # The labels of requirement 7 before symptomFrequency.py
+    return 'very common' if frequency >= 0.1 else ('common' if frequency >= 0.05 else 'rare')
+
+
+@pytest.mark.parametrize('frequency', [0.0, 0.0499, 0.05, 0.0501, 0.0999, 0.1, 0.1001, 1.0])
+def test_labels_at_the_thresholds(frequency):
+    assert frequency_labels([frequency])[0] == _original_label(frequency)
+
+
+def test_labels_of_exact_shares():
+    # 1 of 10 and 1 of 20 diagnoses are exactly on the thresholds
+    assert list(frequency_labels([1 / 10, 1 / 20, 1 / 21])) == ['very common', 'common', 'rare']
+
+
+def test_frequency_matrix():
+    counts = pd.DataFrame({
+        'vaccine_type': ['V01', 'V01', 'V02'],
+        'symptom': ['fever', 'headache', 'fever'],
+        'frequency': [0.1, 0.9, 0.04],
+    })
+    counts['frequency_text'] = frequency_labels(counts['frequency'])
+    symptoms = pd.DataFrame({'name': ['fever', 'headache', 'nausea'], 'criticality': [False, False, True]})
+    matrix = frequency_matrix(counts, symptoms)
+    assert list(matrix.columns) == ['name', 'criticality', 'V01', 'V02']
+    assert matrix['V01'].tolist() == ['very common', 'very common', NOT_DIAGNOSED]
+    assert matrix['V02'].tolist() == ['rare', NOT_DIAGNOSED, NOT_DIAGNOSED]
+
+
+def test_query_has_the_window_parameters():
+    sql = frequencies_sql()
+    assert OPEN_WINDOW not in sql
+    assert '%(start)s' in sql and '%(end)s' in sql
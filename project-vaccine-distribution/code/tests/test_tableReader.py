@@ -0,0 +1,81 @@
+import datetime
+
+import pandas as pd
+
+from tableReader import concat_chunks, read_table
+
+
+class FakeCursor:
+    '''
+    The part of a psycopg2 named cursor the reader uses, over rows in memory.
+    '''
+
+    def __init__(self, columns, rows):
+        self.columns = columns
+        self.rows = list(rows)
+        self.description = None
+
+    def execute(self, sql, params=None):
+        self.description = [(column,) for column in self.columns]
+
+    def fetchmany(self, size):
+        rows, self.rows = self.rows[:size], self.rows[size:]
+        return rows
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, columns, rows):
+        self.columns = columns
+        self.rows = rows
+
+    def cursor(self, name=None):
+        return FakeCursor(self.columns, self.rows)
+
+
+def test_concat_chunks_unions_categories():
+    chunks = [
+        pd.DataFrame({'patient': ['a', 'b'], 'hospital': pd.Categorical(['H1', 'H2'])}),
+        pd.DataFrame({'patient': ['c'], 'hospital': pd.Categorical(['H3'])}),
+        pd.DataFrame({'patient': ['d'], 'hospital': pd.Categorical(['H1'])}),
+    ]
+    df = concat_chunks(chunks)
+    assert isinstance(df['hospital'].dtype, pd.CategoricalDtype)
+    assert df['hospital'].tolist() == ['H1', 'H2', 'H3', 'H1']
+    assert sorted(df['hospital'].cat.categories) == ['H1', 'H2', 'H3']
+    assert df['patient'].tolist() == ['a', 'b', 'c', 'd']
+    assert list(df.columns) == ['patient', 'hospital']
+
+
+def test_concat_no_chunks():
+    df = concat_chunks([], ['patient', 'date'])
+    assert list(df.columns) == ['patient', 'date'] and len(df) == 0
+
+
+def test_read_table_in_chunks():
+    rows = [('p%d' % i, datetime.date(2021, 5, 1 + i % 3), 'H%d' % (i % 2)) for i in range(7)]
+    conn = FakeConnection(['patient', 'date', 'hospital'], rows)
+    df = read_table(conn, 'vaccine_patient', chunk_rows=3)
+    assert len(df) == 7
+    assert df['date'].dtype == 'datetime64[ns]'
+    assert isinstance(df['hospital'].dtype, pd.CategoricalDtype)
+    assert df['hospital'].tolist() == [row[2] for row in rows]
+
+
+def test_read_table_empty_result_keeps_columns_and_types():
+    conn = FakeConnection(['patient', 'date', 'hospital'], [])
+    df = read_table(conn, 'vaccine_patient')
+    assert list(df.columns) == ['patient', 'date', 'hospital']
+    assert len(df) == 0
+    assert df['date'].dtype == 'datetime64[ns]'
+    assert isinstance(df['hospital'].dtype, pd.CategoricalDtype)
+
+
+def test_read_table_aggregate():
+    rows = [('p1',), ('p2',), ('p1',), ('p3',), ('p1',)]
+    conn = FakeConnection(['patient'], rows)
+    doses = read_table(conn, 'vaccine_patient', ['patient'], chunk_rows=2,
+                       aggregate=lambda df: df.groupby('patient').size())
+    assert doses.to_dict() == {'p1': 3, 'p2': 1, 'p3': 1}
@@ -0,0 +1,35 @@
+import os
+
+from taskGraph import Task, run_tasks
+
+
+def _pid(*inputs):
+    return os.getpid()
+
+
+def _total(*numbers):
+    return sum(numbers)
+
+
+def test_only_heavy_pandas_tasks_run_in_other_processes():
+    tasks = [
+        Task('cheap', _pid),
+        Task('heavy', _pid, heavy=True),
+        Task('total', _total, ['cheap', 'heavy']),
+    ]
+    cache = run_tasks(tasks, engine=None, processes=1)
+    assert cache['cheap'] == os.getpid()
+    assert cache['heavy'] != os.getpid()
+    assert cache['total'] == cache['cheap'] + cache['heavy']
+    assert set(cache['_timings']) == {'cheap', 'heavy', 'total'}
+
+
+def test_without_processes_heavy_tasks_run_in_threads():
+    cache = run_tasks([Task('heavy', _pid, heavy=True)], engine=None, processes=0)
+    assert cache['heavy'] == os.getpid()
+
+
+def test_only_the_targets_and_their_inputs_run():
+    tasks = [Task('a', _total), Task('b', _total, ['a']), Task('c', _total)]
+    cache = run_tasks(tasks, engine=None, targets=['b'])
+    assert 'b' in cache and 'c' not in cache
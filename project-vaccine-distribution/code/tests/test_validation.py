@@ -0,0 +1,58 @@
+from pathlib import Path
+
+import pandas as pd
+
+from sqlSchema import read_schema
+from validation import rejected_keys, validate_table, validate_tables
+
+SCHEMA = read_schema(Path(__file__).parent.parent / 'sqlCreatingDatabase.sql')
+
+
+def test_valid_rows_pass_with_their_types():
+    df = pd.DataFrame({'id': ['A'], 'name': ['a'], 'doses': ['2'], 'temp_min': [-10], 'temp_max': [5]})
+    valid, reasons = validate_table(df, SCHEMA['vaccine_type'])
+    assert len(valid) == 1 and len(reasons) == 0
+    assert valid['doses'].dtype == 'int64'
+
+
+def test_constraints():
+    df = pd.DataFrame({'id': ['A', 'B', 'C', 'A', None],
+                       'name': ['a', 'b', 'c', 'd', 'e'],
+                       'doses': [2, 0, 'x', 1, 1],
+                       'temp_min': [-10, 5, 1, 0, 0],
+                       'temp_max': [5, 1, None, 3, 3]})
+    valid, reasons = validate_table(df, SCHEMA['vaccine_type'])
+    assert list(valid['id']) == ['A']
+    assert reasons.to_dict() == {
+        1: 'violates positive_doses; violates temp_min_less_than_max',
+        2: 'temp_max is NULL; invalid integer in doses',
+        3: 'duplicate primary key (id)',
+        4: 'id is NULL',
+    }
+
+
+def test_invalid_dates():
+    df = pd.DataFrame({'patient': ['1', '2', '3'], 'symptom': ['s'] * 3,
+                       'date': ['2021-02-28', '2021-02-29', 44237.0]})
+    valid, reasons = validate_table(df, SCHEMA['diagnosis'])
+    assert list(valid['patient']) == ['1']
+    assert valid['date'].iloc[0] == pd.Timestamp('2021-02-28')
+    assert list(reasons) == ['invalid date in date'] * 2
+
+
+def test_rows_referencing_rejected_rows_are_rejected():
+    tables = {
+        'patient': pd.DataFrame({'ssn': ['1', '2'], 'name': ['a', 'b'],
+                                 'birthday': ['2000-01-01', 'not a date'], 'gender': ['F', 'M']}),
+        'vaccine_patient': pd.DataFrame({'patient': ['1', '2', '3'], 'date': ['2021-05-10'] * 3,
+                                         'hospital': ['H'] * 3}),
+    }
+    valid, rejected = validate_tables(tables, SCHEMA)
+    assert list(valid['patient']['ssn']) == ['1']
+    assert list(valid['vaccine_patient']['patient']) == ['1']
+    assert list(zip(rejected['table'], rejected['row'])) == [
+        ('patient', 1), ('vaccine_patient', 1), ('vaccine_patient', 2)]
+
+    keys = rejected_keys(tables, rejected, SCHEMA)
+    assert list(keys['patient']['ssn']) == ['2']
+    assert list(keys['vaccine_patient']['patient']) == ['2', '3']
@@ -0,0 +1,44 @@
+import datetime
+
+import pandas as pd
+
+from workbookReader import read_sheet, read_workbook, write_sheet
+
+
+def test_sheet_with_mixed_cells_round_trips(tmp_path):
+    frame = pd.DataFrame({
+        'patient': ['a', 'b', 'c', 'd'],
+        'date': [datetime.datetime(2021, 5, 1), 'not a date', 44321.0, None],
+        'count': [1, 2, 3, 4],
+        'day': pd.to_datetime(['2021-05-01', '2021-05-02', '2021-05-03', '2021-05-04']),
+    })
+    write_sheet(frame, tmp_path / 'sheet.parquet')
+    read = read_sheet(tmp_path / 'sheet.parquet')
+    pd.testing.assert_frame_equal(read, frame, check_dtype=False)
+    assert [type(value) for value in read['date']] == [type(value) for value in frame['date']]
+    assert read['count'].dtype == 'int64'
+
+
+def test_workbook_cache(tmp_path, monkeypatch):
+    import workbookReader
+
+    sheets = {'Patients': pd.DataFrame({'ssNo': ['a', 'b'], 'mixed': [1, 'x']})}
+    workbook = tmp_path / 'book.xlsx'
+    workbook.write_bytes(b'version 1')
+    parsed = []
+    monkeypatch.setattr(workbookReader, 'parse_workbook', lambda path, chunk_rows: parsed.append(path) or sheets)
+
+    cache_dir = tmp_path / 'cache'
+    read_workbook(workbook, cache_dir=cache_dir)
+    cached = read_workbook(workbook, cache_dir=cache_dir)
+    pd.testing.assert_frame_equal(cached['Patients'], sheets['Patients'], check_dtype=False)
+    assert len(parsed) == 1
+
+    # A new modification time alone doesn't parse the workbook again, new contents do
+    workbook.write_bytes(b'version 1')
+    read_workbook(workbook, cache_dir=cache_dir)
+    assert len(parsed) == 1
+    workbook.write_bytes(b'version 2')
+    read_workbook(workbook, cache_dir=cache_dir)
+    assert len(parsed) == 2
+    assert len(list(cache_dir.glob('book-*.parquet'))) == 1
@@ -0,0 +1,111 @@
+'''
+Command line entry point for the vaccine distribution database.
+
+  python vaccinedist.py load [--incremental] [sqlPython.py options]
+  python vaccinedist.py analyze [--only 1,7,10] [databaseAnalysis.py options]
+  python vaccinedist.py query [--only 5,6]
+  python vaccinedist.py trace --worker SSN [--start DATE] [--end DATE] [--days N]
+
+load, analyze and trace run sqlPython.py, databaseAnalysis.py and
+contactTracing.py with the options that follow (see their --help). query
+runs the numbered queries of sqlQueries.sql.
+
+Every subcommand imports what it needs when it runs: the loader and the
+analysis bring in pandas, SQLAlchemy, matplotlib and so on, while query and
+trace only need psycopg2 and print the rows themselves, so they start in a
+fraction of a second. The database is given by --database-url,
+$VACCINEDIST_DATABASE_URL or the libpq environment (see dbConnection.py).
+'''
+import argparse
+import sys
+from pathlib import Path
+
+import dbConnection
+from sqlRunner import format_rows, numbered_queries
+
+CODE_DIR = Path(__file__).parent
+QUERIES_FILE = CODE_DIR / 'sqlQueries.sql'
+
+
+def _numbers(value):
+    return [int(n) for n in value.split(',')]
+
+
+def run_load(args, rest):
+    import sqlPython
+
+    sqlPython.main(rest)
+
+
+def run_analyze(args, rest):
+    import databaseAnalysis
+
+    databaseAnalysis.main(rest)
+
+
+def run_query(args, rest):
+    queries = numbered_queries(QUERIES_FILE)
+    selected = args.only or sorted(queries)
+    unknown = [n for n in selected if n not in queries]
+    if unknown:
+        sys.exit('Unknown queries: %s (sqlQueries.sql has %s)'
+                 % (', '.join(map(str, unknown)), ', '.join(map(str, sorted(queries)))))
+
+    conn = dbConnection.connect(args.database_url, args.statement_timeout)
+    try:
+        cursor = conn.cursor()
+        for n in selected:
+            for sql in queries[n]:
+                cursor.execute(sql)
+                print('Query %d' % n)
+                print(format_rows([column.name for column in cursor.description], cursor.fetchall()))
+                print()
+        cursor.close()
+    finally:
+        # The queries only read
+        conn.rollback()
+        conn.close()
+
+
+def run_trace(args, rest):
+    import contactTracing
+
+    contactTracing.main(rest)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='vaccinedist', description='Load, analyze and query the vaccine '
+                                                                      'distribution database.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    # The options of load, analyze and trace are parsed by sqlPython.py,
+    # databaseAnalysis.py and contactTracing.py
+    load = commands.add_parser('load', add_help=False, help='create the database and load the workbook '
+                                                            '(options of sqlPython.py)')
+    load.set_defaults(run=run_load)
+    analyze = commands.add_parser('analyze', add_help=False, help='run the analysis requirements '
+                                                                  '(options of databaseAnalysis.py, e.g. --only 1,7)')
+    analyze.set_defaults(run=run_analyze)
+
+    query = commands.add_parser('query', help='run queries of sqlQueries.sql')
+    query.add_argument('--only', type=_numbers, metavar='N,N,...', help='numbers of the queries (default: all)')
+    dbConnection.add_arguments(query)
+    query.set_defaults(run=run_query)
+
+    trace = commands.add_parser('trace', add_help=False, help='patients and staff members workers may have met '
+                                                              '(options of contactTracing.py)')
+    trace.set_defaults(run=run_trace)
+
+    args, rest = parser.parse_known_args(argv)
+    if rest and args.command not in ('load', 'analyze', 'trace'):
+        parser.error('unrecognized arguments: %s' % ' '.join(rest))
+    return args, rest
+
+
+def main(argv=None):
+    args, rest = parse_args(argv)
+    args.run(args, rest)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,232 @@
+'''
+Validation of the tables before they are loaded.
+
+Every constraint of the schema (sqlSchema.py) is checked on the data
+frames, so that a bad row doesn't abort a COPY or INSERT halfway through a
+load. The checks work on whole columns:
+  - types: DATE and TIMESTAMP columns are converted with pd.to_datetime
+    (numbers, e.g. Excel serial dates, and impossible dates such as
+    2021-02-29 are rejected), INT columns with pd.to_numeric, and values
+    longer than a CHAR(n) / VARCHAR(n) column are rejected,
+  - NOT NULL,
+  - the named CHECK constraints, evaluated with DataFrame.eval,
+  - primary keys: the first row of every key is kept, later duplicates are
+    rejected,
+  - foreign keys: set lookups (Index.isin) against the rows of the
+    referenced table that passed, so the rows depending on a rejected row
+    are rejected as well.
+Rejected rows are returned with the reasons and written to a quarantine
+file (CSV with the table, the row number in the table, the reasons and the
+values of the row as JSON) instead of being loaded. An incremental load
+leaves the database rows with the keys of rejected rows as they are
+(rejected_keys), so a bad cell doesn't delete a row that is already there.
+'''
+import json
+import re
+
+import numpy as np
+import pandas as pd
+
+from sqlSchema import dependency_levels
+
+QUARANTINE_COLUMNS = ['table', 'row', 'reason', 'values']
+
+_LENGTH = re.compile(r'^(?:CHAR|CHARACTER|VARCHAR|CHARACTER VARYING)\s*\((\d+)\)$')
+# SQL operators of CHECK expressions and their pandas counterparts
+_OPERATORS = [(r'<>', '!='), (r'(?<![<>!=])=(?!=)', '=='), (r'\bAND\b', '&'), (r'\bOR\b', '|'),
+              (r'\bNOT\b', '~')]
+
+
+def _is_date_type(sql_type):
+    return sql_type.startswith('DATE') or sql_type.startswith('TIMESTAMP')
+
+
+def _is_int_type(sql_type):
+    return sql_type in ('INT', 'INTEGER', 'SMALLINT', 'BIGINT')
+
+
+def coerce_dates(values):
+    '''
+    values as datetime64 and the mask of the values that are given but are
+    not dates (numbers or strings that aren't valid ISO dates).
+    '''
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values, pd.Series(False, index=values.index)
+    numbers = pd.to_numeric(values, errors='coerce').notna() if values.dtype == object else \
+        pd.Series(pd.api.types.is_numeric_dtype(values), index=values.index)
+    dates = pd.to_datetime(values.where(~numbers), format='ISO8601', errors='coerce')
+    return dates, values.notna() & dates.isna()
+
+
+def check_mask(df, expression):
+    '''
+    Rows of df that violate the CHECK expression (True), or None if the
+    expression can't be evaluated here (it is left to the database then).
+    NULLs pass a CHECK, as in SQL.
+    '''
+    translated = expression
+    for pattern, replacement in _OPERATORS:
+        translated = re.sub(pattern, replacement, translated, flags=re.IGNORECASE)
+    try:
+        result = df.eval(translated, engine='python')
+    except Exception:
+        return None
+    columns = [name for name in re.findall(r'\b\w+\b', expression) if name in df.columns]
+    given = df[columns].notna().all(axis=1)
+    return given & ~pd.Series(result, index=df.index).fillna(True).astype(bool)
+
+
+def _key_index(df, columns):
+    if len(columns) == 1:
+        return pd.Index(df[columns[0]])
+    return pd.MultiIndex.from_frame(df[columns])
+
+
+class _Rejections:
+    '''
+    The rejected rows of one table, collected a constraint at a time as
+    boolean masks; the reasons are only spelled out for the rejected rows.
+    '''
+
+    def __init__(self, index):
+        self.index = index
+        self.mask = np.zeros(len(index), dtype=bool)
+        self.failed = []  # (mask, reason) of the constraints some rows violate
+
+    def add(self, mask, reason):
+        mask = mask.reindex(self.index, fill_value=False).to_numpy(dtype=bool)
+        if mask.any():
+            self.mask |= mask
+            self.failed.append((mask, reason))
+
+    def reasons(self):
+        '''
+        Series of the reasons of the rejected rows, joined with '; '.
+        '''
+        positions = np.flatnonzero(self.mask)
+        return pd.Series(['; '.join(reason for mask, reason in self.failed if mask[position])
+                          for position in positions], index=self.index[positions], dtype=object)
+
+
+def validate_table(df, table, references=None):
+    '''
+    Check df against the Table table of the schema. references is a dict
+    of table name -> valid rows of the tables it references (tables missing
+    from it are not checked).
+    Returns (valid rows with coerced types, reasons of the rejected rows as
+    a series indexed like df).
+    '''
+    df = df.copy()
+    rejections = _Rejections(df.index)
+    columns = [column for column in table.columns if column in df.columns]
+
+    # Before the types are coerced, so that invalid values are not reported as NULL too
+    for column in sorted(table.not_null & set(df.columns)):
+        rejections.add(df[column].isna(), '%s is NULL' % column)
+    for column in sorted(table.not_null - set(df.columns)):
+        rejections.add(pd.Series(True, index=df.index), '%s is missing' % column)
+
+    for column in columns:
+        sql_type = table.columns[column]
+        if _is_date_type(sql_type):
+            df[column], invalid = coerce_dates(df[column])
+            rejections.add(invalid, 'invalid date in %s' % column)
+        elif _is_int_type(sql_type):
+            numbers = pd.to_numeric(df[column], errors='coerce')
+            invalid = df[column].notna() & (numbers.isna() | (numbers % 1 != 0))
+            rejections.add(invalid, 'invalid integer in %s' % column)
+            df[column] = numbers
+        else:
+            length = _LENGTH.match(sql_type)
+            if length:
+                rejections.add(df[column].astype('string').str.len() > int(length.group(1)),
+                               '%s longer than %s' % (column, length.group(1)))
+
+    for name, expression in table.checks.items():
+        mask = check_mask(df, expression)
+        if mask is not None:
+            rejections.add(mask, 'violates %s' % name)
+
+    for fk in table.foreign_keys:
+        if references is None or fk.ref_table not in references \
+                or not set(fk.columns) <= set(df.columns):
+            continue
+        ref = references[fk.ref_table]
+        given = df[fk.columns].notna().all(axis=1)
+        found = _key_index(df, fk.columns).isin(_key_index(ref, fk.ref_columns))
+        rejections.add(given & ~pd.Series(found, index=df.index),
+                       'unknown %s.%s' % (fk.ref_table, ','.join(fk.ref_columns)))
+
+    if table.primary_key and set(table.primary_key) <= set(df.columns):
+        # Only rows that pass everything else keep their key
+        passed = ~rejections.mask
+        duplicate = df[passed].duplicated(table.primary_key, keep='first')
+        rejections.add(duplicate, 'duplicate primary key (%s)' % ', '.join(table.primary_key))
+
+    df = df[~rejections.mask]
+    for column in columns:
+        if _is_int_type(table.columns[column]) and df[column].notna().all():
+            df[column] = df[column].astype('int64')
+    return df, rejections.reasons()
+
+
+def validate_tables(tables, schema):
+    '''
+    Validate the tables (table name -> data frame) against the schema, the
+    referenced tables first. Returns (dict of table name -> valid rows,
+    data frame of the rejected rows with QUARANTINE_COLUMNS).
+    '''
+    valid, rejected = {}, []
+    for level in dependency_levels(schema, [name for name in tables if name in schema]):
+        for name in level:
+            df, reasons = validate_table(tables[name], schema[name], valid)
+            valid[name] = df
+            if len(reasons):
+                rows = tables[name].loc[reasons.index]
+                rejected.append(pd.DataFrame({
+                    'table': name,
+                    'row': reasons.index,
+                    'reason': reasons.to_numpy(),
+                    'values': [json.dumps(row, default=str) for row in rows.to_dict('records')],
+                }))
+    # Tables that aren't in the schema are passed on as they are
+    for name in tables:
+        valid.setdefault(name, tables[name])
+    valid = {name: valid[name] for name in tables}
+    if rejected:
+        return valid, pd.concat(rejected, ignore_index=True)
+    return valid, pd.DataFrame(columns=QUARANTINE_COLUMNS)
+
+
+def rejected_keys(tables, rejected, schema):
+    '''
+    Primary keys of the rejected rows (see validate_tables) of the tables,
+    as a dict of table name -> data frame with the key columns in their
+    schema types. Keys that can't be converted (e.g. an invalid date) are
+    left out, no row of the database can have them. An incremental load
+    keeps the database rows with these keys instead of deleting them.
+    '''
+    keys = {}
+    for name, rows in rejected.groupby('table')['row']:
+        key = schema[name].primary_key
+        if not key or not set(key) <= set(tables[name].columns):
+            continue
+        df = tables[name].loc[rows.to_numpy(), key].copy()
+        for column in key:
+            sql_type = schema[name].columns[column]
+            if _is_date_type(sql_type):
+                df[column] = coerce_dates(df[column])[0]
+            elif _is_int_type(sql_type):
+                numbers = pd.to_numeric(df[column], errors='coerce')
+                df[column] = numbers.where(numbers % 1 == 0)
+        df = df.dropna().drop_duplicates()
+        if len(df):
+            keys[name] = df
+    return keys
+
+
+def write_quarantine(rejected, path):
+    '''
+    Write the rejected rows of validate_tables to the CSV file at path.
+    '''
+    rejected.to_csv(path, index=False)
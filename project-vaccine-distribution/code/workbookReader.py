@@ -0,0 +1,247 @@
+'''
+Single-pass reader for the Excel source with an on-disk cache.
+
+pd.read_excel(sheet_name=...) re-opens and re-parses the whole workbook for
+every sheet it reads. Here the workbook is opened once in openpyxl read-only
+(streaming) mode and every sheet is turned into typed data frames chunk by
+chunk. The parsed sheets are then stored in a cache next to the workbook, one
+columnar Parquet file per sheet, keyed by the modification time and the
+content hash of the file, so loading an unchanged workbook again skips the
+XLSX parsing completely and reads the columns straight into arrays.
+'''
+import datetime
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# Number of worksheet rows collected into one data frame chunk.
+DEFAULT_CHUNK_ROWS = 10000
+
+# Cache directory, created next to the workbook.
+CACHE_DIR_NAME = '.cache'
+
+# Parquet metadata key of the columns with cells of different types
+MIXED_COLUMNS_KEY = b'vaccinedist.mixed_columns'
+
+
+def file_hash(file_path, block_size=1 << 20):
+    '''
+    SHA-1 of the contents of file_path.
+    '''
+    sha = hashlib.sha1()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def _typed_frame(rows, columns):
+    '''
+    Build a data frame out of worksheet rows. Column types are inferred by
+    pandas: integer, float and datetime columns get their numpy dtypes, while
+    columns with mixed cell types (e.g. dates mixed with text) stay objects.
+    '''
+    frame = pd.DataFrame(rows, columns=columns)
+    # Excel stores all numbers as floats. Like pd.read_excel, turn columns
+    # of whole numbers back into integers.
+    for column in frame.columns[frame.dtypes == 'float64']:
+        values = frame[column]
+        if values.notna().all() and (values % 1 == 0).all():
+            frame[column] = values.astype('int64')
+    return frame
+
+
+def iter_sheet_chunks(excel_file, chunk_rows=DEFAULT_CHUNK_ROWS):
+    '''
+    Open the workbook once and yield (sheet_name, data frame) pairs with at
+    most chunk_rows rows each. The first row of a sheet is its header and
+    completely empty rows are skipped.
+    '''
+    import openpyxl
+
+    workbook = openpyxl.load_workbook(excel_file, read_only=True, data_only=True)
+    try:
+        for sheet in workbook.worksheets:
+            rows = sheet.iter_rows(values_only=True)
+            header = next(rows, None)
+            if header is None:
+                continue
+            # Drop empty header cells that openpyxl reports past the last column
+            keep = [i for i, name in enumerate(header) if name is not None]
+            columns = [str(header[i]) for i in keep]
+
+            chunk = []
+            emitted = False
+            for row in rows:
+                values = [row[i] if i < len(row) else None for i in keep]
+                if all(value is None for value in values):
+                    continue
+                chunk.append(values)
+                if len(chunk) >= chunk_rows:
+                    yield sheet.title, _typed_frame(chunk, columns)
+                    emitted = True
+                    chunk = []
+            if chunk or not emitted:
+                yield sheet.title, _typed_frame(chunk, columns)
+    finally:
+        workbook.close()
+
+
+def parse_workbook(excel_file, chunk_rows=DEFAULT_CHUNK_ROWS):
+    '''
+    Read every sheet of the workbook in one pass.
+    Returns a dict of sheet name -> data frame.
+    '''
+    chunks = {}
+    for name, frame in iter_sheet_chunks(excel_file, chunk_rows=chunk_rows):
+        chunks.setdefault(name, []).append(frame)
+    return {name: frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+            for name, frames in chunks.items()}
+
+
+def _encode_mixed(values):
+    '''
+    An object column with cells of different types (e.g. dates mixed with
+    text) as strings tagged with the type of every cell, see _decode_mixed.
+    '''
+    def encode(value):
+        if isinstance(value, np.generic):
+            value = value.item()
+        if value is None:
+            return None
+        if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+            return '%s:%s' % (type(value).__name__, value.isoformat())
+        if isinstance(value, datetime.timedelta):
+            return 'timedelta:%r' % value.total_seconds()
+        return '%s:%s' % (type(value).__name__, value)
+    return values.map(encode).astype(object)
+
+
+_DECODERS = {
+    'str': str,
+    'int': int,
+    'float': float,
+    'bool': lambda text: text == 'True',
+    'datetime': datetime.datetime.fromisoformat,
+    'Timestamp': pd.Timestamp,
+    'date': datetime.date.fromisoformat,
+    'time': datetime.time.fromisoformat,
+    'timedelta': lambda text: datetime.timedelta(seconds=float(text)),
+}
+
+
+def _decode_mixed(values):
+    def decode(text):
+        if not isinstance(text, str):
+            return None
+        kind, value = text.split(':', 1)
+        return _DECODERS[kind](value)
+    return values.map(decode).astype(object)
+
+
+def _is_mixed(values):
+    if values.dtype != object:
+        return False
+    return len({type(value) for value in values.dropna()}) > 1
+
+
+def write_sheet(frame, path):
+    '''
+    Write the sheet frame into the Parquet file at path. Columns with cells
+    of different types are stored as tagged strings and listed in the
+    metadata of the file, so read_sheet gives them back as they were.
+    '''
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    mixed = [column for column in frame.columns if _is_mixed(frame[column])]
+    frame = frame.assign(**{column: _encode_mixed(frame[column]) for column in mixed})
+    table = pa.Table.from_pandas(frame, preserve_index=False)
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}),
+                                           MIXED_COLUMNS_KEY: json.dumps(mixed).encode('utf-8')})
+    pq.write_table(table, path)
+
+
+def read_sheet(path):
+    '''
+    The sheet written by write_sheet into the Parquet file at path.
+    '''
+    import pyarrow.parquet as pq
+
+    table = pq.read_table(path)
+    frame = table.to_pandas()
+    for column in json.loads(table.schema.metadata.get(MIXED_COLUMNS_KEY, b'[]')):
+        frame[column] = _decode_mixed(frame[column])
+    return frame
+
+
+def _cached_sheets(cache_dir, manifest):
+    try:
+        return {name: read_sheet(cache_dir / file_name) for name, file_name in manifest['sheets']}
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def read_workbook(excel_file, use_cache=True, cache_dir=None, chunk_rows=DEFAULT_CHUNK_ROWS):
+    '''
+    Return a dict of sheet name -> data frame for the workbook at excel_file.
+
+    With use_cache every parsed sheet is stored as a Parquet file in
+    cache_dir, by default a .cache directory next to the workbook, and a
+    manifest (<workbook>.json) lists them with the modification time, size
+    and hash of the workbook. A workbook with the same modification time
+    and size is taken from the cache without reading it; otherwise its hash
+    decides, so only a change of the contents parses the workbook again.
+    '''
+    excel_file = Path(excel_file)
+    if not use_cache:
+        return parse_workbook(excel_file, chunk_rows=chunk_rows)
+
+    cache_dir = Path(cache_dir) if cache_dir else excel_file.parent / CACHE_DIR_NAME
+    manifest_file = cache_dir / (excel_file.stem + '.json')
+    stat = excel_file.stat()
+    try:
+        with open(manifest_file) as file:
+            manifest = json.load(file)
+    except (OSError, ValueError):
+        manifest = None
+
+    digest = None
+    if manifest is not None:
+        same_file = [manifest.get('mtime_ns'), manifest.get('size')] == [stat.st_mtime_ns, stat.st_size]
+        if not same_file:
+            digest = file_hash(excel_file)
+        if same_file or manifest.get('hash') == digest:
+            sheets = _cached_sheets(cache_dir, manifest)
+            if sheets is not None:
+                if not same_file:
+                    # Touched but not changed: remember the new modification time
+                    _write_manifest(manifest_file, dict(manifest, mtime_ns=stat.st_mtime_ns, size=stat.st_size))
+                return sheets
+
+    sheets = parse_workbook(excel_file, chunk_rows=chunk_rows)
+    digest = digest or file_hash(excel_file)
+
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    # Remove the sheets of older versions of the same workbook
+    for old in cache_dir.glob('%s-*' % excel_file.stem):
+        old.unlink()
+    files = []
+    for i, (name, frame) in enumerate(sheets.items()):
+        file_name = '%s-%s-%d.parquet' % (excel_file.stem, digest[:16], i)
+        write_sheet(frame, cache_dir / file_name)
+        files.append([name, file_name])
+    _write_manifest(manifest_file, {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size, 'hash': digest,
+                                    'sheets': files})
+    return sheets
+
+
+def _write_manifest(path, manifest):
+    tmp_path = path.with_suffix('.tmp')
+    with open(tmp_path, 'w') as file:
+        json.dump(manifest, file, indent=2)
+    os.replace(tmp_path, path)